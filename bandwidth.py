@@ -0,0 +1,178 @@
+"""
+تشكيل عرض النطاق: حد عام للتنزيل موزع على التنزيلات الجارية مع هامش محجوز للرفع إلى تليجرام
+"""
+import math
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Callable, Dict, Optional, Set
+from config import config
+import logging
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """دلو رموز آمن بين الخيوط؛ الاستهلاك الزائد يصبح ديناً يُسدد بالانتظار"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def set_rate(self, rate: float, burst: float):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = rate
+            self.capacity = burst
+            self.tokens = min(self.tokens, burst)
+
+    def consume(self, amount: float) -> float:
+        """استهلاك amount وإرجاع مدة الانتظار اللازمة بالثواني"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens -= amount
+            if self.tokens >= 0 or self.rate <= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+class BandwidthLease:
+    """حصة تنزيل واحد (استدعاء yt-dlp): حد السرعة الحالي والإنتاجية الفعلية"""
+
+    # ثابت زمني لمتوسط الإنتاجية المتحرك (ثوانٍ)
+    SMOOTHING = 1.0
+
+    def __init__(self, manager: "BandwidthManager", opts: Dict[str, Any]):
+        self.manager = manager
+        self.opts = opts
+        self.speed = 0.0
+        self._last_bytes = 0
+        self._last_time: Optional[float] = None
+
+    @property
+    def limit(self) -> Optional[int]:
+        return self.opts.get('ratelimit')
+
+    def _measure(self, downloaded: int) -> int:
+        now = time.monotonic()
+        delta = downloaded - self._last_bytes
+        if delta < 0:  # ملف جديد بنفس الخيارات
+            delta = downloaded
+        if self._last_time is not None:
+            elapsed = now - self._last_time
+            if elapsed > 0:
+                # أول قياس يبدأ منه المتوسط مباشرة بدلاً من الصفر
+                alpha = 1 - math.exp(-elapsed / self.SMOOTHING) if self.speed else 1.0
+                self.speed += alpha * (delta / elapsed - self.speed)
+        self._last_bytes = downloaded
+        self._last_time = now
+        return delta
+
+    def hook(self, progress_hook: Optional[Callable[[Dict], None]] = None) -> Callable[[Dict], None]:
+        """خطاف تقدم لـ yt-dlp: يقيس الإنتاجية ويطبق الحد العام ثم يمرر الحالة"""
+        def shaped(d: Dict):
+            if d.get('status') == 'downloading':
+                delta = self._measure(d.get('downloaded_bytes') or 0)
+                if progress_hook:
+                    progress_hook({**d, 'speed': self.speed, 'rate_limit': self.limit})
+                self.manager.throttle(delta)
+            elif progress_hook:
+                progress_hook(d)
+        return shaped
+
+class BandwidthManager:
+    """حد عام لسرعة التنزيل يُوزع بالتساوي على التنزيلات الجارية
+
+    كل تنزيل يحصل على ratelimit الخاص بـ yt-dlp بقيمة حصته، ويُعاد التوزيع عند بدء تنزيل أو انتهائه
+    (yt-dlp يقرأ الحد من القاموس نفسه مع كل دفعة). دلو رموز عام في خطاف التقدم يضمن ألا يتجاوز
+    المجموع الحد. أثناء الرفع إلى تليجرام يُحجز UPLOAD_HEADROOM من الخط للرفع.
+    """
+
+    def __init__(self, total_bps: float, upload_headroom: float, burst_seconds: float):
+        self.total = total_bps
+        self.headroom = min(max(upload_headroom, 0.0), 0.9)
+        self.burst_seconds = max(burst_seconds, 0.1)
+        self.leases: Set[BandwidthLease] = set()
+        self.uploads = 0
+        self._lock = threading.Lock()
+        self.bucket = TokenBucket(total_bps, total_bps * self.burst_seconds)
+
+    @property
+    def enabled(self) -> bool:
+        return self.total > 0
+
+    def download_cap(self) -> float:
+        """سقف التنزيل الحالي بالبايت/ثانية"""
+        if self.uploads:
+            return self.total * (1 - self.headroom)
+        return self.total
+
+    def _rebalance(self):
+        """إعادة توزيع السقف على التنزيلات الجارية (تحت القفل)"""
+        if not self.enabled:
+            return
+        cap = self.download_cap()
+        self.bucket.set_rate(cap, cap * self.burst_seconds)
+        if self.leases:
+            share = max(int(cap / len(self.leases)), 1024)
+            for lease in self.leases:
+                lease.opts['ratelimit'] = share
+
+    def throttle(self, amount: int):
+        """الانتظار داخل خيط التنزيل حتى يسمح الدلو العام بـ amount بايت"""
+        if not self.enabled or amount <= 0:
+            return
+        delay = self.bucket.consume(amount)
+        if delay > 0:
+            time.sleep(delay)
+
+    @contextmanager
+    def lease(self, opts: Dict[str, Any]):
+        """تسجيل تنزيل جارٍ طوال استدعاء yt-dlp بخيارات opts"""
+        lease = BandwidthLease(self, opts)
+        with self._lock:
+            self.leases.add(lease)
+            self._rebalance()
+        try:
+            yield lease
+        finally:
+            with self._lock:
+                self.leases.discard(lease)
+                self._rebalance()
+
+    @asynccontextmanager
+    async def uploading(self):
+        """حجز هامش الرفع طوال إرسال ملف إلى تليجرام"""
+        with self._lock:
+            self.uploads += 1
+            self._rebalance()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.uploads -= 1
+                self._rebalance()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            leases = list(self.leases)
+            uploads = self.uploads
+        return {
+            'enabled': self.enabled,
+            'cap': self.download_cap() if self.enabled else 0,
+            'downloads': len(leases),
+            'uploads': uploads,
+            'throughput': sum(lease.speed for lease in leases)
+        }
+
+# مثيل عام؛ BANDWIDTH_LIMIT_MBPS بالميجابت في الثانية
+bandwidth = BandwidthManager(
+    config.BANDWIDTH_LIMIT_MBPS * 1_000_000 / 8,
+    config.UPLOAD_HEADROOM,
+    config.BANDWIDTH_BURST_SECONDS
+)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+خادم Bot API وهمي لاختبار الإرسال عبر خادم محلي (TELEGRAM_API_URL) دون تليجرام
+
+يسجل لكل ملف مرسل هل وصل كمسار (file://) أم كمحتوى مرفوع، ويرفض ما يتجاوز حد الرفع.
+
+مثال: python bot_api_stub.py --port 8081 --max-upload-mb 2000
+ثم: TELEGRAM_API_URL=http://localhost:8081 python main.py
+"""
+import argparse
+import itertools
+import logging
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import unquote, urlparse
+
+from aiohttp import web
+
+logger = logging.getLogger("bot_api_stub")
+
+class BotAPIStub:
+    """يرد على طرق Bot API التي يستخدمها البوت بردود صالحة"""
+
+    def __init__(self, max_upload_mb: int):
+        self.max_upload = max_upload_mb * 1024 * 1024
+        self.message_ids = itertools.count(1)
+        self.sent: List[Dict] = []
+
+    def message(self, chat_id, **extra) -> Dict:
+        return {
+            'message_id': next(self.message_ids),
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id or 0), 'type': 'private'},
+            **extra
+        }
+
+    async def read_fields(self, request: web.Request) -> Dict:
+        """قراءة الحقول مع عد بايتات الملفات المرفوعة دون تحميلها في الذاكرة"""
+        fields: Dict = {}
+        if request.content_type == 'multipart/form-data':
+            reader = await request.multipart()
+            async for part in reader:
+                if part.filename:
+                    size = 0
+                    while chunk := await part.read_chunk():
+                        size += len(chunk)
+                    fields[part.name] = {'upload': part.filename, 'size': size}
+                else:
+                    fields[part.name] = await part.text()
+        elif request.content_type == 'application/json':
+            fields.update(await request.json())
+        else:
+            fields.update(await request.post())
+        return fields
+
+    def resolve_file(self, value, fields: Dict) -> Dict:
+        """وصف الملف المرسل: مرفوع، أو مسار محلي، أو معرف ملف سابق"""
+        if isinstance(value, str) and value.startswith('attach://'):
+            value = fields.get(value[len('attach://'):], value)
+
+        if isinstance(value, dict):
+            return {'mode': 'upload', 'name': value['upload'], 'size': value['size']}
+
+        if value.startswith('file://'):
+            path = Path(unquote(urlparse(value).path))
+            if not path.is_file():
+                raise web.HTTPBadRequest(text=f"file not found: {path}")
+            return {'mode': 'path', 'name': path.name, 'size': path.stat().st_size}
+
+        return {'mode': 'file_id', 'name': value, 'size': 0}
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method'].lower()
+        fields = await self.read_fields(request)
+
+        if method == 'getme':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Stub', 'username': 'stub_bot'}
+        elif method in ('sendvideo', 'senddocument'):
+            kind = 'video' if method == 'sendvideo' else 'document'
+            sent = self.resolve_file(fields.get(kind, ''), fields)
+            if sent['size'] > self.max_upload:
+                return web.json_response(
+                    {'ok': False, 'error_code': 413, 'description': 'Request Entity Too Large'}, status=413
+                )
+
+            self.sent.append(sent)
+            logger.info(f"{kind} via {sent['mode']}: {sent['name']} ({sent['size']} bytes)")
+            file_id = f"stub-{len(self.sent)}"
+            media = {'file_id': file_id, 'file_unique_id': file_id, 'file_size': sent['size']}
+            if kind == 'video':
+                media.update({'width': 0, 'height': 0, 'duration': 0})
+            result = self.message(fields.get('chat_id'), **{kind: media, 'caption': fields.get('caption')})
+        elif method in ('sendmessage', 'editmessagetext'):
+            result = self.message(fields.get('chat_id'), text=fields.get('text', ''))
+        elif method == 'getupdates':
+            result = []
+        else:
+            result = True
+
+        return web.json_response({'ok': True, 'result': result})
+
+def create_app(max_upload_mb: int) -> web.Application:
+    stub = BotAPIStub(max_upload_mb)
+    app = web.Application(client_max_size=0)
+    app['stub'] = stub
+    app.router.add_post('/bot{token}/{method}', stub.handle)
+    return app
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Minimal Bot API server stub")
+    parser.add_argument("--host", default="127.0.0.1", help="عنوان الاستماع")
+    parser.add_argument("--port", type=int, default=8081, help="منفذ الاستماع")
+    parser.add_argument("--max-upload-mb", type=int, default=2000, help="حد الرفع كما في الخادم المحلي")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+    web.run_app(create_app(args.max_upload_mb), host=args.host, port=args.port, print=None)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,22 +2,37 @@
 معالج البوت والأوامر
 """
 import asyncio
+import math
 import os
+import shutil
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
 from typing import Dict, Any, Optional
-from aiogram import Bot, Dispatcher, Router, F
+from aiogram import Dispatcher, Router, F
 from aiogram.types import (
     Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup,
-    BufferedInputFile, FSInputFile
+    BufferedInputFile
 )
 from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.exceptions import TelegramBadRequest
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 import humanize
 from config import config
-from database import db
-from downloader import downloader, DownloadProgress
+from database import db, Download, TelegramFile
+from downloader import downloader, VideoSummary
+from media import iter_segments, probe_duration
+from cache import metadata_cache
+from sessions import create_fsm_storage
+from telegram_api import create_bot, input_file
+from store import subtitle_key
+from disk_cache import disk_cache
+from retention import archiver
+from bandwidth import bandwidth
+from jobs import DownloadJob, JobWorker, create_job_queue
 import logging
 
 logger = logging.getLogger(__name__)
@@ -36,11 +51,15 @@ class TelegramBot:
     """فئة البوت الرئيسية"""
     
     def __init__(self):
-        self.bot = Bot(token=config.BOT_TOKEN)
-        self.storage = MemoryStorage()
+        self.bot = create_bot()
+        # الجلسات تُحفظ في بيانات FSM (ذاكرة محدودة أو Redis مشترك بين النسخ)
+        self.storage = create_fsm_storage()
         self.dp = Dispatcher(storage=self.storage)
         self.router = Router()
-        self.user_sessions: Dict[int, Dict] = {}
+        self.job_queue = create_job_queue()
+        self.local_worker: Optional[JobWorker] = None
+        self.delivery_task: Optional[asyncio.Task] = None
+        self.web_runner: Optional[web.AppRunner] = None
         self.setup_handlers()
     
     def setup_handlers(self):
@@ -62,6 +81,7 @@ class TelegramBot:
         self.router.callback_query(F.data.startswith("subtitle_"))(self.handle_subtitle_callback)
         self.router.callback_query(F.data.startswith("playlist_"))(self.handle_playlist_callback)
         self.router.callback_query(F.data.startswith("settings_"))(self.handle_settings_callback)
+        self.router.callback_query(F.data == "cancel")(self.handle_cancel_callback)
         
         # تسجيل الموجه
         self.dp.include_router(self.router)
@@ -109,6 +129,53 @@ class TelegramBot:
 🕐 آخر نشاط: `{user_stats['last_activity']}`
         """
         
+        # مقاييس مجمعات التنفيذ للمشرفين فقط
+        if message.from_user.id in config.ADMIN_IDS:
+            stats_text += "\n⚙️ **مجمعات التنفيذ:**\n"
+            for name, pool in downloader.get_executor_stats().items():
+                stats_text += (
+                    f"• {name}: نشط `{pool['active']}/{pool['workers']}`، "
+                    f"منتظر `{pool['queued']}` (الأقصى `{pool['max_queued']}`)، "
+                    f"متوسط الانتظار `{pool['avg_wait']:.1f}ث`\n"
+                )
+            
+            shaping = bandwidth.stats()
+            if shaping['enabled']:
+                stats_text += (
+                    f"\n📶 **عرض النطاق:** حد التنزيل `{humanize.naturalsize(shaping['cap'])}/ث`، "
+                    f"الفعلي `{humanize.naturalsize(shaping['throughput'])}/ث` "
+                    f"(`{shaping['downloads']}` تنزيل، `{shaping['uploads']}` رفع)\n"
+                )
+            
+            scheduler = downloader.scheduler.stats()
+            stats_text += (
+                f"\n🚦 **الجدولة:** خانات `{scheduler['active']}/{scheduler['capacity']}`، "
+                f"منتظر `{scheduler['waiting']}`، مستخدمون نشطون `{scheduler['users']}`، "
+                f"متوسط الانتظار `{scheduler['avg_wait']:.1f}ث`\n"
+            )
+            
+            if db.writer:
+                writes = db.writer.stats()
+                stats_text += (
+                    f"\n🗃 **كاتب SQLite:** `{writes['writes']}` كتابة في `{writes['commits']}` معاملة "
+                    f"(`{writes['writes_per_commit']:.1f}` لكل معاملة)، منتظر `{writes['waiting']}`\n"
+                )
+            
+            archive = archiver.stats()
+            if archive['last_run']:
+                stats_text += (
+                    f"\n📦 **الأرشيف:** `{archive['archived']}` تنزيل منقول، "
+                    f"أقسام محذوفة `{archive['dropped_partitions']}`\n"
+                )
+            
+            cache = await disk_cache.stats()
+            stats_text += (
+                f"\n🗄 **المخزن:** `{humanize.naturalsize(cache['size'])}` من `{humanize.naturalsize(cache['quota'])}` "
+                f"(`{cache['entries']}` ملف، مثبت `{cache['pinned']}`)\n"
+                f"• نسبة الإصابة: `{cache['hit_rate']:.0%}` ({cache['hits']}/{cache['hits'] + cache['misses']})\n"
+                f"• الإخلاء: `{cache['evictions']}` ملف، `{humanize.naturalsize(cache['evicted_bytes'])}`\n"
+            )
+        
         await message.answer(stats_text, parse_mode="Markdown")
     
     async def cmd_settings(self, message: Message):
@@ -116,13 +183,31 @@ class TelegramBot:
         await self.show_settings_menu(message.from_user.id, message)
     
     async def cmd_cancel(self, message: Message, state: FSMContext):
-        """إلغاء العملية الحالية"""
+        """إلغاء العملية الحالية والتنزيلات الجارية"""
         await state.clear()
-        if message.from_user.id in self.user_sessions:
-            del self.user_sessions[message.from_user.id]
+        await self.cancel_user_downloads(message.from_user.id)
         
         await message.answer("❌ تم إلغاء العملية الحالية")
     
+    async def handle_cancel_callback(self, callback: CallbackQuery, state: FSMContext):
+        """زر الإلغاء في القوائم"""
+        await state.clear()
+        await self.cancel_user_downloads(callback.from_user.id)
+        
+        try:
+            await callback.message.edit_text("❌ تم إلغاء العملية الحالية")
+        except TelegramBadRequest:
+            pass
+        await callback.answer()
+    
+    async def cancel_user_downloads(self, user_id: int):
+        """إيقاف تنزيلات المستخدم في هذه العملية، وإبلاغ العمال الآخرين عبر الطابور"""
+        downloader.cancel_user(user_id)
+        try:
+            await self.job_queue.request_cancel(user_id)
+        except Exception as e:
+            logger.error(f"Failed to request job cancellation: {e}")
+    
     async def handle_url(self, message: Message, state: FSMContext):
         """معالجة الروابط"""
         url = message.text.strip()
@@ -146,18 +231,18 @@ class TelegramBot:
     
     async def handle_video_url(self, message: Message, url: str, state: FSMContext, processing_msg: Message):
         """معالجة رابط فيديو"""
-        video_info = await downloader.extract_video_info(url)
+        video_info = await downloader.extract_video_summary(url)
         
         if not video_info:
             await processing_msg.edit_text("❌ فشل في استخراج معلومات الفيديو")
             return
         
-        # حفظ معلومات الجلسة
-        self.user_sessions[message.from_user.id] = {
+        # حفظ معلومات الجلسة (الملخص المضغوط فقط؛ المعلومات الكاملة تبقى في الذاكرة المؤقتة)
+        await state.set_data({
             'url': url,
-            'video_info': video_info,
+            'video': video_info.to_dict(),
             'type': 'video'
-        }
+        })
         
         # إنشاء معاينة الفيديو
         duration_str = self._format_duration(video_info.duration)
@@ -197,12 +282,19 @@ class TelegramBot:
             await processing_msg.edit_text(config.Messages.ERROR_PLAYLIST_TOO_LARGE)
             return
         
-        # حفظ معلومات الجلسة
-        self.user_sessions[message.from_user.id] = {
+        # حفظ معلومات الجلسة (ملخص مضغوط للمعاينة فقط)
+        await state.set_data({
             'url': url,
-            'playlist_info': playlist_info,
-            'type': 'playlist'
-        }
+            'type': 'playlist',
+            'playlist': {
+                'title': playlist_info.title,
+                'total': total_videos,
+                'preview': [
+                    [entry.get('title', 'عنوان غير متاح')[:50], entry.get('duration') or 0]
+                    for entry in (playlist_info.entries or [])[:10]
+                ]
+            }
+        })
         
         # إنشاء معاينة قائمة التشغيل
         playlist_preview = f"""
@@ -227,17 +319,16 @@ class TelegramBot:
     
     async def handle_download_callback(self, callback: CallbackQuery, state: FSMContext):
         """معالجة اختيار نوع التنزيل"""
-        user_id = callback.from_user.id
         download_type = callback.data.split("_")[1]
         
-        if user_id not in self.user_sessions:
+        session = await state.get_data()
+        if not session.get('url'):
             await callback.answer("❌ الجلسة منتهية الصلاحية، يرجى إرسال الرابط مرة أخرى")
             return
         
-        session = self.user_sessions[user_id]
-        session['download_type'] = download_type
+        session = await state.update_data(download_type=download_type)
         
-        video_info = session.get('video_info')
+        video_info = await self.get_session_video(session)
         if not video_info:
             await callback.message.edit_text("❌ لا يمكن العثور على معلومات الفيديو")
             return
@@ -251,6 +342,14 @@ class TelegramBot:
         
         await callback.answer()
     
+    async def get_session_video(self, session: Dict) -> Optional[VideoSummary]:
+        """ملخص الفيديو المحفوظ في الجلسة"""
+        if session.get('type') != 'video' or not session.get('url'):
+            return None
+        if session.get('video'):
+            return VideoSummary.from_dict(session['video'])
+        return await downloader.extract_video_summary(session['url'])
+    
     async def show_quality_selection(self, callback: CallbackQuery, video_info, include_subtitle=False):
         """عرض اختيار الجودة"""
         if not video_info:
@@ -283,18 +382,16 @@ class TelegramBot:
     
     async def handle_quality_callback(self, callback: CallbackQuery, state: FSMContext):
         """معالجة اختيار الجودة"""
-        user_id = callback.from_user.id
         quality = callback.data.split("_")[1]
         
-        if user_id not in self.user_sessions:
+        if not (await state.get_data()).get('url'):
             await callback.answer("❌ الجلسة منتهية الصلاحية")
             return
         
-        session = self.user_sessions[user_id]
-        session['quality'] = quality
+        session = await state.update_data(quality=quality)
         
         if session.get('download_type') == "both":
-            video_info = session.get('video_info')
+            video_info = await self.get_session_video(session)
             if not video_info:
                 await callback.message.edit_text("❌ لا يمكن العثور على معلومات الفيديو")
                 return
@@ -340,22 +437,19 @@ class TelegramBot:
     
     async def handle_subtitle_callback(self, callback: CallbackQuery, state: FSMContext):
         """معالجة اختيار الترجمة"""
-        user_id = callback.from_user.id
         action = callback.data.split("_")[1]
         
-        if user_id not in self.user_sessions:
+        if not (await state.get_data()).get('url'):
             await callback.answer("❌ الجلسة منتهية الصلاحية")
             return
         
-        session = self.user_sessions[user_id]
-        
         if action == "lang":
             lang_code = callback.data.split("_")[2]
-            session['subtitle_lang'] = lang_code
+            await state.update_data(subtitle_lang=lang_code)
             await self.show_subtitle_format_selection(callback)
         elif action == "format":
             format_type = callback.data.split("_")[2]
-            session['subtitle_format'] = format_type
+            await state.update_data(subtitle_format=format_type)
             await self.start_download(callback, state)
         
         await callback.answer()
@@ -377,38 +471,34 @@ class TelegramBot:
     
     async def handle_playlist_callback(self, callback: CallbackQuery, state: FSMContext):
         """معالجة قوائم التشغيل"""
-        user_id = callback.from_user.id
         action = callback.data.split("_")[1]
         
-        if user_id not in self.user_sessions:
+        session = await state.get_data()
+        if not session.get('url'):
             await callback.answer("❌ الجلسة منتهية الصلاحية")
             return
         
-        session = self.user_sessions[user_id]
-        
         if action == "confirm":
             await self.show_quality_selection(callback, None)
         elif action == "preview":
-            playlist_info = session.get('playlist_info')
-            if not playlist_info:
+            playlist = session.get('playlist')
+            if not playlist:
                 await callback.message.edit_text("❌ لا يمكن العثور على معلومات قائمة التشغيل")
                 return
-            await self.show_playlist_preview(callback, playlist_info)
+            await self.show_playlist_preview(callback, playlist)
         
         await callback.answer()
     
-    async def show_playlist_preview(self, callback: CallbackQuery, playlist_info):
-        """عرض معاينة قائمة التشغيل"""
-        entries = playlist_info.entries[:10] if playlist_info.entries else []
-        preview_text = f"📑 **معاينة قائمة التشغيل:** {playlist_info.title}\n\n"
+    async def show_playlist_preview(self, callback: CallbackQuery, playlist: Dict):
+        """عرض معاينة قائمة التشغيل (من ملخص الجلسة)"""
+        preview_text = f"📑 **معاينة قائمة التشغيل:** {playlist.get('title')}\n\n"
         
-        for i, entry in enumerate(entries, 1):
-            title = entry.get('title', 'عنوان غير متاح')[:50]
-            duration = self._format_duration(entry.get('duration', 0))
-            preview_text += f"{i}. {title} ({duration})\n"
+        for i, (title, duration) in enumerate(playlist.get('preview', []), 1):
+            preview_text += f"{i}. {title} ({self._format_duration(duration)})\n"
         
-        if playlist_info.entries and len(playlist_info.entries) > 10:
-            preview_text += f"\n... و {len(playlist_info.entries) - 10} فيديوهات أخرى"
+        total = playlist.get('total', 0)
+        if total > 10:
+            preview_text += f"\n... و {total - 10} فيديوهات أخرى"
         
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="✅ تأكيد التنزيل", callback_data="playlist_confirm")],
@@ -419,17 +509,12 @@ class TelegramBot:
         await callback.message.edit_text(preview_text, reply_markup=keyboard, parse_mode="Markdown")
     
     async def start_download(self, callback: CallbackQuery, state: FSMContext):
-        """بدء عملية التنزيل"""
-        user_id = callback.from_user.id
-        if user_id not in self.user_sessions:
+        """بدء عملية التنزيل (بإضافتها إلى طابور المهام)"""
+        session = await state.get_data()
+        if not session.get('url'):
             await callback.message.edit_text("❌ الجلسة منتهية الصلاحية")
             return
         
-        session = self.user_sessions[user_id]
-        
-        # تحديث الرسالة لإظهار بدء التنزيل
-        await callback.message.edit_text(config.Messages.INFO_DOWNLOADING)
-        
         try:
             if session.get('type') == 'video':
                 await self.download_video(callback, session, state)
@@ -441,60 +526,36 @@ class TelegramBot:
             await callback.message.edit_text(f"❌ فشل في التنزيل: {str(e)}")
         
         # تنظيف الجلسة
-        if user_id in self.user_sessions:
-            del self.user_sessions[user_id]
-        
         await state.clear()
     
     async def download_video(self, callback: CallbackQuery, session: Dict, state: FSMContext):
         """تنزيل فيديو واحد"""
         user_id = callback.from_user.id
-        progress_msg = None
-        
-        async def progress_callback(progress: DownloadProgress):
-            nonlocal progress_msg
-            try:
-                percent = progress.percent if progress.percent else 0
-                speed_str = humanize.naturalsize(progress.speed) if progress.speed else "0"
-                downloaded_str = humanize.naturalsize(progress.downloaded_bytes)
-                total_str = humanize.naturalsize(progress.total_bytes) if progress.total_bytes else "غير محدد"
-                
-                progress_text = f"""
-⬇️ **جاري التنزيل...**
-
-📊 التقدم: {percent:.1f}%
-📥 تم تنزيل: {downloaded_str} / {total_str}
-🚀 السرعة: {speed_str}/ث
-                """
-                
-                if progress_msg:
-                    try:
-                        await progress_msg.edit_text(progress_text, parse_mode="Markdown")
-                    except TelegramBadRequest:
-                        pass  # تجاهل الأخطاء إذا كان النص مطابق
-                else:
-                    progress_msg = await callback.message.edit_text(progress_text, parse_mode="Markdown")
-                    
-            except Exception as e:
-                logger.error(f"Progress callback error: {e}")
+        chat_id = callback.message.chat.id
+        video_info = await self.get_session_video(session)
+        if not video_info:
+            await callback.message.edit_text("❌ لا يمكن العثور على معلومات الفيديو")
+            return
+        payload = {
+            'url': session['url'],
+            'download_type': session.get('download_type'),
+            'video_id': video_info.id
+        }
         
-        # تنزيل الفيديو
         if session.get('download_type') in ['video', 'both']:
             if not session.get('quality'):
                 await callback.message.edit_text("❌ لم يتم تحديد جودة الفيديو")
                 return
+            payload['quality'] = session['quality']
             
-            file_path = await downloader.download_video(
-                session['url'],
-                session['quality'],
-                user_id,
-                progress_callback
-            )
-            
-            if file_path and os.path.exists(file_path):
-                await self.send_file(callback.message, file_path, "video")
+            # إعادة إرسال ملف سبق رفعه دون تنزيل أو رفع
+            cached = await self.send_cached_file(chat_id, video_info.id, session['quality'])
+            if cached:
+                await downloader.record_cached_delivery(
+                    session['url'], video_info, session['quality'], 'video', user_id, cached.file_size or 0
+                )
+                payload['skip_video'] = True
         
-        # تنزيل الترجمة
         if session.get('download_type') in ['subtitle', 'both']:
             if not session.get('subtitle_lang'):
                 await callback.message.edit_text("❌ لم يتم تحديد لغة الترجمة")
@@ -502,104 +563,386 @@ class TelegramBot:
             if not session.get('subtitle_format'):
                 await callback.message.edit_text("❌ لم يتم تحديد صيغة الترجمة")
                 return
+            payload['subtitle_lang'] = session['subtitle_lang']
+            payload['subtitle_format'] = session['subtitle_format']
             
-            subtitle_path = await downloader.download_subtitle(
-                session['url'],
-                session['subtitle_lang'],
-                session['subtitle_format'],
-                user_id
-            )
-            
-            if subtitle_path and os.path.exists(subtitle_path):
-                await self.send_file(callback.message, subtitle_path, "document")
+            subtitle_fmt = subtitle_key(session['subtitle_lang'], session['subtitle_format'])
+            cached = await self.send_cached_file(chat_id, video_info.id, subtitle_fmt)
+            if cached:
+                await downloader.record_cached_delivery(
+                    session['url'], video_info, subtitle_fmt, 'subtitle', user_id, cached.file_size or 0
+                )
+                payload['skip_subtitle'] = True
         
-        await callback.message.edit_text(config.Messages.SUCCESS_DOWNLOAD)
+        # كل شيء أُرسل من ملفات تليجرام المحفوظة
+        wants_video = session.get('download_type') in ['video', 'both']
+        wants_subtitle = session.get('download_type') in ['subtitle', 'both']
+        if (not wants_video or payload.get('skip_video')) and (not wants_subtitle or payload.get('skip_subtitle')):
+            await callback.message.edit_text(config.Messages.SUCCESS_DOWNLOAD)
+            return
+        
+        await self.enqueue_job('video', callback, payload)
     
     async def download_playlist(self, callback: CallbackQuery, session: Dict, state: FSMContext):
         """تنزيل قائمة التشغيل"""
-        user_id = callback.from_user.id
-        progress_msg = None
-        
-        async def progress_callback(message: str):
-            nonlocal progress_msg
-            try:
-                if progress_msg:
-                    await progress_msg.edit_text(f"📥 {message}")
-                else:
-                    progress_msg = await callback.message.edit_text(f"📥 {message}")
-            except TelegramBadRequest:
-                pass
-        
         if not session.get('quality'):
             await callback.message.edit_text("❌ لم يتم تحديد جودة الفيديو")
             return
         
-        result = await downloader.download_playlist(
-            session['url'],
-            session['quality'],
-            user_id,
-            progress_callback=progress_callback
+        await self.enqueue_job('playlist', callback, {
+            'url': session['url'],
+            'quality': session['quality']
+        })
+    
+    async def enqueue_job(self, kind: str, callback: CallbackQuery, payload: Dict[str, Any]):
+        """إضافة مهمة تنزيل إلى الطابور؛ رسالة الزر تصبح رسالة الحالة"""
+        user = await db.get_user(callback.from_user.id)
+        job = DownloadJob(
+            kind=kind,
+            user_id=callback.from_user.id,
+            chat_id=callback.message.chat.id,
+            message_id=callback.message.message_id,
+            payload=payload,
+            premium=bool(user and user.is_premium)
+        )
+        await self.job_queue.enqueue(job)
+        
+        position = await self.job_queue.position(job)
+        if position:
+            await callback.message.edit_text(config.Messages.INFO_QUEUE_POSITION.format(position=position))
+        else:
+            await callback.message.edit_text(config.Messages.INFO_QUEUED)
+    
+    async def recover_interrupted_downloads(self) -> int:
+        """استئناف التنزيلات التي قطعتها إعادة التشغيل من سجل التنزيلات
+        
+        مع الطابور المحلي كل تنزيل غير مكتمل متوقف حتماً؛ ومع الطوابير المشتركة
+        نعتمد على النبضات حتى لا نستأنف ما يعمل عليه عامل آخر.
+        """
+        stale_after = config.DOWNLOAD_STALE_AFTER
+        if self.job_queue.name == 'local':
+            rows = await db.get_interrupted_downloads(('pending', 'downloading', 'interrupted'))
+        else:
+            reaped = await self.job_queue.reap_stale(time.time() - stale_after)
+            if reaped:
+                logger.info(f"Closed {reaped} jobs abandoned by dead workers")
+            rows = await db.get_interrupted_downloads(
+                stale_before=datetime.now(timezone.utc) - timedelta(seconds=stale_after)
+            )
+        
+        resumed = 0
+        for row in rows:
+            if not await db.mark_download_interrupted(row.id, row.status):
+                continue  # استأنفته نسخة أخرى
+            try:
+                await self.resume_download(row)
+                resumed += 1
+            except Exception as e:
+                logger.error(f"Failed to resume download {row.id}: {e}")
+                await db.update_download_status(row.id, 'failed', error_message=str(e))
+        
+        if resumed:
+            logger.info(f"Resumed {resumed} interrupted downloads")
+        return resumed
+    
+    async def resume_download(self, row: Download):
+        """إعادة مهمة تنزيل متوقف إلى الطابور مع إشعار المستخدم"""
+        payload: Dict[str, Any] = {
+            'url': row.url,
+            'download_type': row.download_type,
+            'video_id': row.video_id,
+            'download_id': row.id
+        }
+        if row.download_type == 'subtitle':
+            metadata = row.file_metadata or {}
+            if not metadata.get('language') or not metadata.get('format'):
+                raise ValueError("Subtitle download has no language/format recorded")
+            payload['subtitle_lang'] = metadata['language']
+            payload['subtitle_format'] = metadata['format']
+        else:
+            payload['quality'] = row.quality or 'best'
+        
+        # رسالة جديدة تصبح رسالة الحالة (المحادثات الخاصة: chat_id == user_id)
+        message = await self.bot.send_message(
+            row.user_id, config.Messages.INFO_RESUMED.format(title=row.title or row.url)
         )
+        await self.job_queue.enqueue(DownloadJob(
+            kind='video',
+            user_id=row.user_id,
+            chat_id=row.user_id,
+            message_id=message.message_id,
+            payload=payload
+        ))
+    
+    async def start_job_processing(self):
+        """بدء تسليم نتائج المهام، وتشغيل عامل داخلي عند الحاجة"""
+        if self.delivery_task is None:
+            self.delivery_task = asyncio.create_task(self._deliver_results())
+        
+        if self.job_queue.name == 'local' or config.BOT_RUNS_WORKER:
+            if self.local_worker is None:
+                self.local_worker = JobWorker(self.job_queue, self.bot)
+                await self.local_worker.start()
+    
+    async def stop_job_processing(self):
+        if self.local_worker:
+            await self.local_worker.stop()
+            self.local_worker = None
         
-        if result.get('status') == 'failed':
-            await callback.message.edit_text(f"❌ فشل تنزيل قائمة التشغيل: {result.get('error', 'خطأ غير محدد')}")
+        if self.delivery_task:
+            self.delivery_task.cancel()
+            try:
+                await self.delivery_task
+            except asyncio.CancelledError:
+                pass
+            self.delivery_task = None
+        
+        await self.job_queue.close()
+    
+    async def _deliver_results(self):
+        """استقبال نتائج المهام من العمال وإرسالها للمستخدمين"""
+        while True:
+            try:
+                for job in await self.job_queue.finished(timeout=config.JOB_POLL_INTERVAL):
+                    try:
+                        await self.deliver_job(job)
+                    except Exception as e:
+                        logger.error(f"Failed to deliver job {job.id}: {e}")
+                    await self.job_queue.ack(job)
+            
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job delivery loop error: {e}")
+                await asyncio.sleep(config.JOB_POLL_INTERVAL)
+    
+    async def deliver_job(self, job: DownloadJob):
+        """إرسال نتيجة مهمة واحدة"""
+        if job.status == 'failed':
+            if job.error and job.error.startswith("❌"):
+                # رسالة موجهة للمستخدم (رفض التنزيل قبل بدئه، الإلغاء، المهلة)
+                text = job.error
+            elif job.kind == 'playlist':
+                text = f"❌ فشل تنزيل قائمة التشغيل: {job.error or 'خطأ غير محدد'}"
+            else:
+                text = config.Messages.ERROR_DOWNLOAD_FAILED
+            await self.edit_status(job, text)
             return
         
-        # إرسال ملخص النتائج
-        summary = f"""
+        result = job.result or {}
+        files = result.get('files', [])
+        
+        if job.kind == 'playlist':
+            playlist = result.get('playlist', {})
+            
+            # إرسال ملخص النتائج
+            summary = f"""
 ✅ **تم الانتهاء من تنزيل قائمة التشغيل**
 
 📊 **النتائج:**
-• العدد الكلي: {result.get('total_videos', 0)}
-• تم بنجاح: {result.get('completed', 0)}
-• فشل: {result.get('failed', 0)}
+• العدد الكلي: {playlist.get('total_videos', 0)}
+• تم بنجاح: {playlist.get('completed', 0)}
+• فشل: {playlist.get('failed', 0)}
 
 📁 تم حفظ الملفات في مجلد منفصل
-        """
-        
-        await callback.message.edit_text(summary, parse_mode="Markdown")
+            """
+            await self.edit_status(job, summary, parse_mode="Markdown")
+            
+            # إرسال الملفات (الأوائل فقط لتجنب الحد الأقصى)
+            for item in files[:5]:
+                await self.send_file(job.chat_id, item['path'], item['type'], item['video_id'], item['format'])
+            
+            if len(files) > 5:
+                await self.bot.send_message(job.chat_id, f"📁 تم تنزيل {len(files) - 5} ملفات إضافية")
+            return
         
-        # إرسال الملفات (الأوائل فقط لتجنب الحد الأقصى)
-        for file_path in result.get('downloaded_files', [])[:5]:
-            if os.path.exists(file_path):
-                await self.send_file(callback.message, file_path, "video")
+        for item in files:
+            await self.send_file(job.chat_id, item['path'], item['type'], item['video_id'], item['format'])
         
-        if len(result.get('downloaded_files', [])) > 5:
-            await callback.message.answer(f"📁 تم تنزيل {len(result['downloaded_files']) - 5} ملفات إضافية")
+        await self.edit_status(job, config.Messages.SUCCESS_DOWNLOAD)
+    
+    async def edit_status(self, job: DownloadJob, text: str, **kwargs):
+        """تحديث رسالة حالة المهمة"""
+        try:
+            if job.message_id:
+                await self.bot.edit_message_text(text, chat_id=job.chat_id, message_id=job.message_id, **kwargs)
+            else:
+                await self.bot.send_message(job.chat_id, text, **kwargs)
+        except TelegramBadRequest:
+            pass
     
-    async def send_file(self, message: Message, file_path: str, file_type: str):
-        """إرسال الملف للمستخدم"""
+    async def send_file(
+        self,
+        chat_id: int,
+        file_path: str,
+        file_type: str,
+        video_id: Optional[str] = None,
+        fmt: Optional[str] = None
+    ):
+        """إرسال الملف للمستخدم وحفظ معرف ملف تليجرام لإعادة استخدامه"""
+        # الملف مثبت في المخزن حتى لا يُخلى أثناء الرفع، والتنزيلات تترك هامشاً للرفع
+        async with disk_cache.pinned(file_path), bandwidth.uploading():
+            await self._send_file(chat_id, file_path, file_type, video_id, fmt)
+    
+    async def _send_file(
+        self,
+        chat_id: int,
+        file_path: str,
+        file_type: str,
+        video_id: Optional[str] = None,
+        fmt: Optional[str] = None
+    ):
         try:
             if not os.path.exists(file_path):
-                await message.answer("❌ الملف غير موجود")
+                await self.bot.send_message(chat_id, "❌ الملف غير موجود")
                 return
                 
             file_size = os.path.getsize(file_path)
             
-            # التحقق من حجم الملف (حد تليجرام 50 ميجا للبوت)
-            if file_size > 50 * 1024 * 1024:
-                await message.answer(f"❌ الملف كبير جداً للإرسال: {humanize.naturalsize(file_size)}")
+            # التحقق من حجم الملف (حد الرفع في Bot API)
+            if file_size > config.UPLOAD_LIMIT_MB * 1024 * 1024:
+                if file_type == "video" and config.SPLIT_OVERSIZED:
+                    await self.send_split_video(chat_id, file_path, file_size, video_id, fmt)
+                    return
+                await self.bot.send_message(chat_id, f"❌ الملف كبير جداً للإرسال: {humanize.naturalsize(file_size)}")
                 return
             
             file_name = os.path.basename(file_path)
             
             if file_type == "video":
-                await message.answer_video(
-                    FSInputFile(file_path),
+                sent = await self.bot.send_video(
+                    chat_id,
+                    input_file(file_path),
                     caption=f"🎬 {file_name}"
                 )
+                telegram_file = sent.video or sent.document
             else:
-                await message.answer_document(
-                    FSInputFile(file_path),
+                sent = await self.bot.send_document(
+                    chat_id,
+                    input_file(file_path),
                     caption=f"📄 {file_name}"
                 )
+                telegram_file = sent.document
             
-            # حذف الملف بعد الإرسال
-            os.remove(file_path)
+            # الملف يبقى في المخزن المشترك، ونحفظ معرفه للطلبات القادمة
+            if video_id and fmt and telegram_file:
+                await db.save_telegram_file({
+                    'video_id': video_id,
+                    'format': fmt,
+                    'file_type': file_type,
+                    'file_id': telegram_file.file_id,
+                    'file_unique_id': telegram_file.file_unique_id,
+                    'file_name': file_name,
+                    'file_size': file_size
+                })
             
         except Exception as e:
             logger.error(f"Error sending file: {e}")
-            await message.answer(f"❌ فشل في إرسال الملف: {os.path.basename(file_path) if file_path else 'غير معروف'}")
+            await self.bot.send_message(chat_id, f"❌ فشل في إرسال الملف: {os.path.basename(file_path) if file_path else 'غير معروف'}")
+    
+    async def send_split_video(
+        self,
+        chat_id: int,
+        file_path: str,
+        file_size: int,
+        video_id: Optional[str] = None,
+        fmt: Optional[str] = None
+    ):
+        """تقسيم فيديو أكبر من حد الرفع إلى أجزاء متتالية وإرسالها بالترتيب
+        
+        التقسيم بنسخ المسارات عند الإطارات المفتاحية (بدون إعادة ترميز)، ويُرفع كل جزء
+        فور اكتماله بينما يُقطع الجزء التالي.
+        """
+        file_name = os.path.basename(file_path)
+        loop = asyncio.get_event_loop()
+        duration = await loop.run_in_executor(downloader.postprocess_executor, probe_duration, file_path)
+        if not duration:
+            await self.bot.send_message(chat_id, f"❌ الملف كبير جداً للإرسال: {humanize.naturalsize(file_size)}")
+            return
+        
+        # هامش 15% لأن القطع يتم عند أقرب إطار مفتاحي ومعدل البت غير ثابت
+        limit = config.UPLOAD_LIMIT_MB * 1024 * 1024
+        segment_time = duration * limit * 0.85 / file_size
+        total = math.ceil(duration / segment_time)
+        
+        output_dir = config.DOWNLOAD_PATH / ".split" / uuid.uuid4().hex
+        output_dir.mkdir(parents=True, exist_ok=True)
+        parts = []
+        try:
+            async for segment in iter_segments(file_path, output_dir, segment_time):
+                index = len(parts) + 1
+                segment_size = segment.stat().st_size
+                if segment_size > limit:
+                    raise RuntimeError(f"Segment {segment.name} exceeds the upload limit ({segment_size} bytes)")
+                
+                sent = await self.bot.send_video(
+                    chat_id,
+                    input_file(segment, filename=f"{index:03d}-{file_name}"),
+                    caption=f"🎬 {file_name}\n📦 الجزء {index}/{max(total, index)}"
+                )
+                telegram_file = sent.video or sent.document
+                parts.append((telegram_file, segment_size))
+                segment.unlink(missing_ok=True)
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+        
+        logger.info(f"Sent {file_name} in {len(parts)} parts")
+        
+        # نحفظ معرفات الأجزاء فقط عند اكتمالها جميعاً
+        if video_id and fmt:
+            for index, (telegram_file, segment_size) in enumerate(parts, 1):
+                await db.save_telegram_file({
+                    'video_id': video_id,
+                    'format': f"{fmt}#part{index:03d}",
+                    'file_type': 'video',
+                    'file_id': telegram_file.file_id,
+                    'file_unique_id': telegram_file.file_unique_id,
+                    'file_name': file_name,
+                    'file_size': segment_size
+                })
+    
+    async def send_cached_parts(self, chat_id: int, video_id: str, fmt: str) -> Optional[TelegramFile]:
+        """إعادة إرسال فيديو سبق رفعه مقسماً إلى أجزاء"""
+        parts = await db.get_telegram_file_parts(video_id, fmt)
+        if not parts:
+            return None
+        
+        for index, part in enumerate(parts, 1):
+            await self.bot.send_video(
+                chat_id, part.file_id, caption=f"🎬 {part.file_name}\n📦 الجزء {index}/{len(parts)}"
+            )
+        
+        # سجل يمثل الملف كاملاً لإحصائيات التسليم
+        return TelegramFile(
+            video_id=video_id,
+            format=fmt,
+            file_type='video',
+            file_id=parts[0].file_id,
+            file_name=parts[0].file_name,
+            file_size=sum(part.file_size or 0 for part in parts)
+        )
+    
+    async def send_cached_file(self, chat_id: int, video_id: str, fmt: str) -> Optional[TelegramFile]:
+        """إعادة إرسال ملف سبق رفعه عبر معرفه في تليجرام"""
+        try:
+            cached = await db.get_telegram_file(video_id, fmt)
+            if not cached:
+                return await self.send_cached_parts(chat_id, video_id, fmt)
+            
+            if cached.file_type == "video":
+                await self.bot.send_video(chat_id, cached.file_id, caption=f"🎬 {cached.file_name}")
+            else:
+                await self.bot.send_document(chat_id, cached.file_id, caption=f"📄 {cached.file_name}")
+            return cached
+        
+        except TelegramBadRequest as e:
+            # المعرف لم يعد صالحاً؛ نحذفه ونعود للتنزيل
+            logger.warning(f"Stale Telegram file_id for {video_id} [{fmt}]: {e}")
+            await db.delete_telegram_file(video_id, fmt)
+            return None
+        except Exception as e:
+            logger.error(f"Error sending cached file: {e}")
+            return None
     
     async def show_settings_menu(self, user_id: int, message: Message):
         """عرض قائمة الإعدادات"""
@@ -651,14 +994,76 @@ class TelegramBot:
             return f"{hours}س {minutes}د"
     
     async def start_polling(self):
-        """بدء استقبال الرسائل"""
-        await db.init_db()
+        """بدء استقبال الرسائل (قاعدة البيانات هيأها BotApplication.startup)"""
+        await self.start_job_processing()
+        # إزالة أي webhook سابق وإلا رفض تليجرام الاستطلاع
+        await self.bot.delete_webhook()
         logger.info("Bot started polling...")
         await self.dp.start_polling(self.bot)
     
+    def create_webhook_app(self) -> web.Application:
+        """تطبيق aiohttp يستقبل التحديثات من تليجرام مع نقاط فحص الصحة"""
+        app = web.Application()
+        app.router.add_get("/healthz", self.handle_healthz)
+        app.router.add_get("/readyz", self.handle_readyz)
+        
+        SimpleRequestHandler(
+            dispatcher=self.dp,
+            bot=self.bot,
+            secret_token=config.WEBHOOK_SECRET
+        ).register(app, path=config.WEBHOOK_PATH)
+        setup_application(app, self.dp, bot=self.bot)
+        return app
+    
+    async def handle_healthz(self, request: web.Request) -> web.Response:
+        """العملية تعمل"""
+        return web.json_response({'status': 'ok'})
+    
+    async def handle_readyz(self, request: web.Request) -> web.Response:
+        """النسخة جاهزة لاستقبال التحديثات (لموازن الأحمال)"""
+        checks = {
+            'jobs': self.delivery_task is not None and not self.delivery_task.done(),
+            'database': await db.ping(),
+            'queue': await self.job_queue.ping()
+        }
+        ready = all(checks.values())
+        return web.json_response(
+            {'status': 'ready' if ready else 'unavailable', 'checks': checks},
+            status=200 if ready else 503
+        )
+    
+    async def start_webhook(self):
+        """استقبال التحديثات عبر webhook (يمكن تشغيل عدة نسخ خلف وكيل عكسي)"""
+        await self.start_job_processing()
+        
+        self.web_runner = web.AppRunner(self.create_webhook_app())
+        await self.web_runner.setup()
+        await web.TCPSite(self.web_runner, config.WEBAPP_HOST, config.WEBAPP_PORT).start()
+        logger.info(f"Webhook server listening on {config.WEBAPP_HOST}:{config.WEBAPP_PORT}{config.WEBHOOK_PATH}")
+        
+        # تكفي نسخة واحدة لتسجيل العنوان لدى تليجرام
+        if config.WEBHOOK_SET_ON_START:
+            if not config.WEBHOOK_URL:
+                raise ValueError("WEBHOOK_URL is required to register the webhook")
+            await self.bot.set_webhook(
+                f"{config.WEBHOOK_URL}{config.WEBHOOK_PATH}",
+                secret_token=config.WEBHOOK_SECRET,
+                allowed_updates=self.dp.resolve_used_update_types()
+            )
+            logger.info("Webhook registered with Telegram")
+        
+        # الخادم يعمل في الخلفية حتى الإيقاف
+        await asyncio.Event().wait()
+    
     async def stop(self):
         """إيقاف البوت"""
+        if self.web_runner:
+            await self.web_runner.cleanup()
+            self.web_runner = None
+        await self.stop_job_processing()
         await self.bot.session.close()
+        await self.storage.close()
+        await metadata_cache.close()
         await db.close()
 
 # مثيل عام من البوت
@@ -0,0 +1,155 @@
+"""
+التخزين المؤقت لمعلومات الفيديوهات
+"""
+import json
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from config import config
+import logging
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # Redis اختياري
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+# أنماط معرف الفيديو في روابط YouTube (11 حرفاً)
+_VIDEO_ID_RE = re.compile(r'(?:[?&]v=|youtu\.be/|/shorts/|/embed/|/live/)([A-Za-z0-9_-]{11})')
+
+def canonical_video_id(url: str) -> Optional[str]:
+    """استخراج معرف الفيديو من الرابط دون الحاجة إلى yt-dlp"""
+    match = _VIDEO_ID_RE.search(url or '')
+    return match.group(1) if match else None
+
+class TTLCache:
+    """ذاكرة مؤقتة محدودة الحجم مع انتهاء صلاحية (LRU + TTL)"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return default
+
+        expires_at, value = item
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return default
+
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Any, value: Any, ttl: Optional[float] = None):
+        self._data[key] = (time.monotonic() + (ttl or self.ttl), value)
+        self._data.move_to_end(key)
+
+        # إخراج الأقدم استخداماً عند تجاوز الحجم
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Any, default: Any = None) -> Any:
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def purge_expired(self) -> int:
+        """حذف العناصر المنتهية وإرجاع عددها"""
+        now = time.monotonic()
+        expired = [key for key, (expires_at, _) in self._data.items() if expires_at <= now]
+        for key in expired:
+            del self._data[key]
+        return len(expired)
+
+    def __contains__(self, key: Any) -> bool:
+        return self.get(key) is not None
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+class MetadataCache:
+    """ذاكرة مؤقتة لمعلومات yt-dlp مفهرسة بمعرف الفيديو
+
+    الطبقة الأولى في ذاكرة العملية، والثانية (اختيارية) في Redis لمشاركتها بين العمليات
+    """
+
+    KEY_PREFIX = "ytmeta:"
+
+    def __init__(self, maxsize: int, ttl: int, redis_url: Optional[str] = None):
+        self.ttl = ttl
+        self.local = TTLCache(maxsize, ttl)
+        self.redis_url = redis_url
+        self._redis = None
+        self.hits = 0
+        self.misses = 0
+
+    def _get_redis(self):
+        if self._redis is None and self.redis_url and aioredis is not None:
+            self._redis = aioredis.from_url(self.redis_url)
+        return self._redis
+
+    async def get(self, video_id: str) -> Optional[Dict]:
+        """الحصول على معلومات الفيديو المخزنة"""
+        info = self.local.get(video_id)
+
+        if info is None:
+            redis = self._get_redis()
+            if redis is not None:
+                try:
+                    raw = await redis.get(self.KEY_PREFIX + video_id)
+                    if raw:
+                        info = json.loads(raw)
+                        self.local.set(video_id, info)
+                except Exception as e:
+                    logger.warning(f"Metadata cache read failed: {e}")
+
+        if info is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return info
+
+    async def set(self, video_id: str, info: Dict):
+        """تخزين معلومات الفيديو (يجب أن تكون قابلة للتحويل إلى JSON)"""
+        self.local.set(video_id, info)
+
+        redis = self._get_redis()
+        if redis is not None:
+            try:
+                await redis.set(self.KEY_PREFIX + video_id, json.dumps(info, default=str), ex=self.ttl)
+            except Exception as e:
+                logger.warning(f"Metadata cache write failed: {e}")
+
+    async def invalidate(self, video_id: str):
+        self.local.pop(video_id)
+
+        redis = self._get_redis()
+        if redis is not None:
+            try:
+                await redis.delete(self.KEY_PREFIX + video_id)
+            except Exception as e:
+                logger.warning(f"Metadata cache invalidate failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'size': len(self.local),
+            'hits': self.hits,
+            'misses': self.misses,
+            'backend': 'redis' if self._get_redis() is not None else 'memory'
+        }
+
+    async def close(self):
+        if self._redis is not None:
+            await self._redis.close()
+            self._redis = None
+
+# مثيل عام من ذاكرة معلومات الفيديو
+metadata_cache = MetadataCache(
+    maxsize=config.METADATA_CACHE_SIZE,
+    ttl=config.METADATA_CACHE_TTL,
+    redis_url=config.REDIS_URL
+)
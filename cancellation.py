@@ -0,0 +1,84 @@
+"""
+إلغاء التنزيلات الجارية ومهلها (إلغاء تعاوني يُفحص من خطافات التقدم)
+"""
+import asyncio
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Optional, Set, TypeVar
+import yt_dlp
+
+T = TypeVar('T')
+
+class DownloadCancelled(yt_dlp.utils.DownloadCancelled):
+    """إيقاف التنزيل بطلب المستخدم (user) أو لتجاوز المهلة (timeout)
+
+    يرث من استثناء yt-dlp نفسه حتى يخرج من ydl.download ولا يبتلعه ignoreerrors.
+    """
+
+    def __init__(self, reason: str = 'user'):
+        super().__init__(f"Download cancelled ({reason})")
+        self.reason = reason
+
+class CancelToken:
+    """إشارة إلغاء مشتركة بين حلقة الأحداث وخيوط التنزيل
+
+    خطاف التقدم يفحصها داخل خيط yt-dlp فيتوقف التنزيل عند الدفعة التالية،
+    والمهام المنتظرة عبر run تُلغى فوراً عند الإلغاء أو انتهاء المهلة.
+    """
+
+    def __init__(self, timeout: Optional[float] = None):
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.reason: Optional[str] = None
+        self._event = threading.Event()
+        self._tasks: Set[asyncio.Future] = set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def remaining(self) -> Optional[float]:
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def cancel(self, reason: str = 'user'):
+        """الإلغاء من حلقة الأحداث"""
+        if self._event.is_set():
+            return
+        self.reason = reason
+        self._event.set()
+        for task in list(self._tasks):
+            task.cancel()
+
+    def check(self):
+        """رفع DownloadCancelled عند الإلغاء أو انتهاء المهلة (آمن من أي خيط)"""
+        if not self._event.is_set() and self.deadline is not None and time.monotonic() >= self.deadline:
+            self.reason = 'timeout'
+            self._event.set()
+        if self._event.is_set():
+            raise DownloadCancelled(self.reason or 'user')
+
+    def wrap_hook(self, hook: Optional[Callable[[Dict], None]] = None) -> Callable[[Dict], None]:
+        """خطاف تقدم لـ yt-dlp يفحص الإلغاء قبل تمرير الحالة"""
+        def checked(status: Dict):
+            self.check()
+            if hook:
+                hook(status)
+        return checked
+
+    async def run(self, awaitable: Awaitable[T]) -> T:
+        """انتظار awaitable مع إيقافه عند الإلغاء أو انتهاء المهلة"""
+        self.check()
+        task = asyncio.ensure_future(awaitable)
+        self._tasks.add(task)
+        try:
+            return await asyncio.wait_for(task, self.remaining())
+        except asyncio.TimeoutError:
+            self.cancel('timeout')
+            raise DownloadCancelled('timeout') from None
+        except asyncio.CancelledError:
+            if self.cancelled:
+                raise DownloadCancelled(self.reason or 'user') from None
+            raise  # إيقاف التطبيق
+        finally:
+            self._tasks.discard(task)
@@ -18,6 +18,21 @@ def _env_int(key: str, default: int) -> int:
     except (ValueError, AttributeError):
         return default
 
+def _env_float(key: str, default: float) -> float:
+    v = os.getenv(key)
+    if v is None:
+        return default
+    try:
+        return float(v.strip())
+    except (ValueError, AttributeError):
+        return default
+
+def _env_bool(key: str, default: bool) -> bool:
+    v = os.getenv(key)
+    if v is None:
+        return default
+    return v.strip().lower() in ("1", "true", "yes", "on")
+
 class Config:
     """فئة إعدادات البوت"""
 
@@ -34,12 +49,93 @@ class Config:
     DOWNLOAD_PATH: Path = Path(os.getenv("DOWNLOAD_PATH", "./downloads"))
     DOWNLOAD_PATH.mkdir(parents=True, exist_ok=True)
 
+    # المخزن المشترك للملفات المنزلة (يُعاد استخدامه بين المستخدمين)
+    STORE_PATH: Path = Path(os.getenv("STORE_PATH", str(DOWNLOAD_PATH / "store")))
+
+    # حصة المخزن وإخلاء الملفات الأقدم استخداماً
+    CACHE_QUOTA_MB: int = _env_int("CACHE_QUOTA_MB", 10240)
+    CACHE_HIGH_WATERMARK: float = _env_float("CACHE_HIGH_WATERMARK", 0.9)  # يبدأ الإخلاء فوق هذه النسبة
+    CACHE_LOW_WATERMARK: float = _env_float("CACHE_LOW_WATERMARK", 0.75)  # ويتوقف عند هذه النسبة
+    CACHE_SWEEP_INTERVAL: int = _env_int("CACHE_SWEEP_INTERVAL", 600)  # ثوانٍ بين الفحوص الدورية
+    CACHE_EVICT_BATCH: int = _env_int("CACHE_EVICT_BATCH", 100)  # ملفات لكل دفعة إخلاء
+    CACHE_INDEX_PATH: Path = Path(os.getenv("CACHE_INDEX_PATH", str(DOWNLOAD_PATH / ".cache-index.sqlite")))
+
     MAX_FILE_SIZE: int = _env_int("MAX_FILE_SIZE", 2000)         
+    MAX_VIDEO_DURATION: int = _env_int("MAX_VIDEO_DURATION", 0)  # بالثواني، 0 = بدون حد
+
+    # قبول التنزيل قبل بدئه حسب الحجم المقدر والمساحة الحرة
+    DISK_RESERVE_MB: int = _env_int("DISK_RESERVE_MB", 500)  # مساحة تبقى حرة دائماً
+    ADMISSION_WAIT_TIMEOUT: float = _env_float("ADMISSION_WAIT_TIMEOUT", 300.0)  # انتظار تحرر المساحة
+
+    # خادم Bot API (فارغ = الخادم العام api.telegram.org)
+    TELEGRAM_API_URL: str = os.getenv("TELEGRAM_API_URL", "").strip()  # مثل http://localhost:8081
+    # الوضع المحلي في telegram-bot-api: رفع حتى 2000MB وإرسال الملفات بمسارها
+    TELEGRAM_API_LOCAL: bool = _env_bool("TELEGRAM_API_LOCAL", bool(TELEGRAM_API_URL))
+    TELEGRAM_API_TIMEOUT: int = _env_int("TELEGRAM_API_TIMEOUT", 600 if TELEGRAM_API_LOCAL else 60)
+    UPLOAD_LIMIT_MB: int = _env_int("UPLOAD_LIMIT_MB", 2000 if TELEGRAM_API_LOCAL else 50)  # حد رفع الملفات في Bot API
+
+    # إعادة الترميز لتتسع الفيديوهات الكبيرة في حد الرفع (اختياري، يستهلك المعالج)
+    TRANSCODE_TO_FIT: bool = _env_bool("TRANSCODE_TO_FIT", False)
+    TRANSCODE_AUDIO_BITRATE: int = _env_int("TRANSCODE_AUDIO_BITRATE", 128)  # kbps
+    TRANSCODE_THREADS: int = _env_int("TRANSCODE_THREADS", 2)  # أنوية المعالج لكل مهمة
+    TRANSCODE_PRESET: str = os.getenv("TRANSCODE_PRESET", "veryfast")
+
+    # تقسيم الفيديوهات الأكبر من حد الرفع إلى أجزاء دون إعادة ترميز
+    SPLIT_OVERSIZED: bool = _env_bool("SPLIT_OVERSIZED", True)
     MAX_PLAYLIST_SIZE: int = _env_int("MAX_PLAYLIST_SIZE", 50)  
 
+    # التنزيل المتوازي لقوائم التشغيل
+    PLAYLIST_CONCURRENCY: int = _env_int("PLAYLIST_CONCURRENCY", 3)  # لكل قائمة
+    PLAYLIST_PROGRESS_BATCH: int = _env_int("PLAYLIST_PROGRESS_BATCH", 5)  # فيديوهات لكل تحديث للعدادات
+
+    # وضع التشغيل: polling أو webhook
+    RUN_MODE: str = os.getenv("RUN_MODE", "polling").lower()
+    WEBHOOK_URL: str = os.getenv("WEBHOOK_URL", "").rstrip("/")  # العنوان العام خلف الوكيل العكسي
+    WEBHOOK_PATH: str = os.getenv("WEBHOOK_PATH", "/webhook")
+    WEBHOOK_SECRET: Optional[str] = os.getenv("WEBHOOK_SECRET") or None
+    WEBHOOK_SET_ON_START: bool = _env_bool("WEBHOOK_SET_ON_START", True)  # نسخة واحدة فقط تسجل العنوان
+    WEBAPP_HOST: str = os.getenv("WEBAPP_HOST", "0.0.0.0")
+    WEBAPP_PORT: int = _env_int("WEBAPP_PORT", _env_int("PORT", 8080))
+
     DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite:///bot.db")
+    # مجمع اتصالات قاعدة البيانات (PostgreSQL؛ SQLite يستخدم إعدادات SQLAlchemy الافتراضية)
+    DB_POOL_SIZE: int = _env_int("DB_POOL_SIZE", 10)
+    DB_MAX_OVERFLOW: int = _env_int("DB_MAX_OVERFLOW", 20)
+    DB_POOL_TIMEOUT: float = _env_float("DB_POOL_TIMEOUT", 30.0)  # انتظار اتصال حر بالثواني
+    DB_POOL_RECYCLE: int = _env_int("DB_POOL_RECYCLE", 1800)  # تجديد الاتصالات الأقدم (ثوانٍ)
+    # تجميع تحديثات الحالة والنبضات والتقدم وكتابتها دفعة واحدة كل DB_FLUSH_INTERVAL ثانية
+    DB_WRITE_BEHIND: bool = _env_bool("DB_WRITE_BEHIND", False)
+    DB_FLUSH_INTERVAL: float = _env_float("DB_FLUSH_INTERVAL", 2.0)
+    # SQLite: WAL مع synchronous=NORMAL وmmap وذاكرة صفحات أكبر، واتصالات قراءة متزامنة
+    SQLITE_TUNING: bool = _env_bool("SQLITE_TUNING", True)
+    SQLITE_READERS: int = _env_int("SQLITE_READERS", 4)
+    SQLITE_MMAP_SIZE: int = _env_int("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)  # بالبايت
+    SQLITE_CACHE_SIZE: int = _env_int("SQLITE_CACHE_SIZE", 64 * 1024)  # بالكيلوبايت
+    SQLITE_BUSY_TIMEOUT: int = _env_int("SQLITE_BUSY_TIMEOUT", 5000)  # انتظار القفل بالميلي ثانية
+    # كاتب وحيد يجمع عمليات الكتابة المتزامنة في معاملة واحدة (group commit)؛ اختياري لأن WAL وحده
+    # أسرع في db_bench.py، ويفيد إذا ظهرت أخطاء "database is locked" تحت الحمل
+    SQLITE_SINGLE_WRITER: bool = _env_bool("SQLITE_SINGLE_WRITER", False)
+    SQLITE_WRITE_BATCH: int = _env_int("SQLITE_WRITE_BATCH", 64)  # أقصى عدد كتابات في المعاملة
+    # /start لا يكتب بيانات المستخدم مجدداً إذا لم تتغير، ويُحدّث last_activity مرة كل USER_ACTIVITY_INTERVAL ثانية
+    USER_ACTIVITY_INTERVAL: int = _env_int("USER_ACTIVITY_INTERVAL", 300)
+    USER_CACHE_SIZE: int = _env_int("USER_CACHE_SIZE", 10000)
+    # سجل التنزيلات: الأشهر الأقدم من DOWNLOAD_RETENTION_DAYS تُنقل إلى ملفات NDJSON مضغوطة في ARCHIVE_PATH
+    # وتُحذف من الجدول. معطلة افتراضياً (0) لأن الحذف لا رجعة فيه؛ فعّلها صراحة مثل 90
+    DOWNLOAD_RETENTION_DAYS: int = _env_int("DOWNLOAD_RETENTION_DAYS", 0)
+    ARCHIVE_PATH: Path = Path(os.getenv("ARCHIVE_PATH", "./archive"))
+    ARCHIVE_INTERVAL: int = _env_int("ARCHIVE_INTERVAL", 3600)  # ثوانٍ بين دورات الأرشفة
+    ARCHIVE_BATCH: int = _env_int("ARCHIVE_BATCH", 1000)  # سجلات لكل دفعة نقل
     REDIS_URL: Optional[str] = os.getenv("REDIS_URL")
 
+    # ذاكرة معلومات الفيديو المؤقتة (روابط الصيغ في YouTube تنتهي بعد ساعات)
+    METADATA_CACHE_TTL: int = _env_int("METADATA_CACHE_TTL", 1800)
+    METADATA_CACHE_SIZE: int = _env_int("METADATA_CACHE_SIZE", 512)
+
+    # جلسات المستخدمين وحالات المحادثة: memory أو redis (للمشاركة بين النسخ)
+    SESSION_BACKEND: str = os.getenv("SESSION_BACKEND", "memory").lower()
+    SESSION_TTL: int = _env_int("SESSION_TTL", 3600)  # بالثواني
+    SESSION_CACHE_SIZE: int = _env_int("SESSION_CACHE_SIZE", 100000)  # حد الجلسات في الذاكرة
+
     AVAILABLE_QUALITIES = [
         "144p", "240p", "360p", "480p",
         "720p", "1080p", "1440p", "2160p"
@@ -62,9 +158,44 @@ class Config:
     }
 
     MAX_CONCURRENT_DOWNLOADS: int = _env_int("MAX_CONCURRENT_DOWNLOADS", 3)
+
+    # الجدولة العادلة بين المستخدمين (خانات التنزيل = MAX_CONCURRENT_DOWNLOADS)
+    USER_DOWNLOAD_CONCURRENCY: int = _env_int("USER_DOWNLOAD_CONCURRENCY", 2)  # تنزيلات متزامنة لكل مستخدم
+    PREMIUM_DOWNLOAD_CONCURRENCY: int = _env_int("PREMIUM_DOWNLOAD_CONCURRENCY", 3)
+    USER_JOB_CONCURRENCY: int = _env_int("USER_JOB_CONCURRENCY", 2)  # مهام جارية لكل مستخدم في الطابور
+    PREMIUM_JOB_CONCURRENCY: int = _env_int("PREMIUM_JOB_CONCURRENCY", 3)
+    PREMIUM_WEIGHT: float = _env_float("PREMIUM_WEIGHT", 3.0)  # حصة المشترك المميز مقابل 1 للعادي
+
+    # تشكيل عرض النطاق (0 = بدون حد)
+    BANDWIDTH_LIMIT_MBPS: float = _env_float("BANDWIDTH_LIMIT_MBPS", 0.0)  # سعة الخط بالميجابت/ثانية
+    UPLOAD_HEADROOM: float = _env_float("UPLOAD_HEADROOM", 0.3)  # نسبة محجوزة للرفع أثناء الإرسال
+    BANDWIDTH_BURST_SECONDS: float = _env_float("BANDWIDTH_BURST_SECONDS", 1.0)
+
+    # أحجام مجمعات التنفيذ المنفصلة
+    EXTRACT_WORKERS: int = _env_int("EXTRACT_WORKERS", 4)
+    DOWNLOAD_WORKERS: int = _env_int("DOWNLOAD_WORKERS", MAX_CONCURRENT_DOWNLOADS)
+    SUBTITLE_WORKERS: int = _env_int("SUBTITLE_WORKERS", 2)
+    POSTPROCESS_WORKERS: int = _env_int("POSTPROCESS_WORKERS", 2)
+    MEDIA_WORKERS: int = _env_int("MEDIA_WORKERS", max(1, (os.cpu_count() or 2) // 2))  # عمليات ffmpeg
     CHUNK_SIZE: int = _env_int("CHUNK_SIZE", 8192)
 
-    DOWNLOAD_TIMEOUT: int = _env_int("DOWNLOAD_TIMEOUT", 3600)
+    # طابور المهام: local (داخل العملية)، database، redis
+    JOB_QUEUE_BACKEND: str = os.getenv("JOB_QUEUE_BACKEND", "local").lower()
+    WORKER_CONCURRENCY: int = _env_int("WORKER_CONCURRENCY", 4)  # مهام متزامنة لكل عامل
+    BOT_RUNS_WORKER: bool = _env_bool("BOT_RUNS_WORKER", False)  # عامل داخل عملية البوت مع الطوابير المشتركة
+    JOB_POLL_INTERVAL: float = _env_float("JOB_POLL_INTERVAL", 2.0)
+    JOB_HEARTBEAT_INTERVAL: float = _env_float("JOB_HEARTBEAT_INTERVAL", 15.0)
+
+    # استئناف التنزيلات المتوقفة بعد إعادة التشغيل
+    DOWNLOAD_STALE_AFTER: int = _env_int("DOWNLOAD_STALE_AFTER", 120)  # ثوانٍ بدون نبضة
+    RESUME_RETENTION_HOURS: int = _env_int("RESUME_RETENTION_HOURS", 48)  # مدة الاحتفاظ بالملفات الجزئية
+
+    # إيقاع تحديث رسائل التقدم (لتجنب حدود تليجرام)
+    PROGRESS_UPDATE_INTERVAL: float = _env_float("PROGRESS_UPDATE_INTERVAL", 2.5)  # بالثواني
+    PROGRESS_UPDATE_STEP: float = _env_float("PROGRESS_UPDATE_STEP", 5.0)  # نسبة مئوية
+
+    DOWNLOAD_TIMEOUT: int = _env_int("DOWNLOAD_TIMEOUT", 3600)  # مهلة الفيديو الواحد بالثواني
+    PLAYLIST_TIMEOUT: int = _env_int("PLAYLIST_TIMEOUT", 6 * 3600)  # مهلة قائمة التشغيل كاملة
     REQUEST_TIMEOUT: int = _env_int("REQUEST_TIMEOUT", 30)
 
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO").upper()
@@ -88,11 +219,18 @@ class Config:
         ERROR_INVALID_URL = "❌ الرابط غير صحيح. يرجى إرسال رابط YouTube صالح."
         ERROR_DOWNLOAD_FAILED = "❌ فشل في التنزيل. يرجى المحاولة مرة أخرى."
         ERROR_FILE_TOO_LARGE = "❌ حجم الملف كبير جداً (أقصى حد: {max_size} ميجابايت)"
+        ERROR_VIDEO_TOO_LONG = "❌ الفيديو طويل جداً (أقصى حد: {max_minutes} دقيقة)"
+        ERROR_DISK_FULL = "❌ لا توجد مساحة كافية لتنزيل هذا الفيديو حالياً، يرجى المحاولة لاحقاً"
+        ERROR_DOWNLOAD_TIMEOUT = "❌ تجاوز التنزيل المهلة المحددة وتم إيقافه"
         ERROR_PLAYLIST_TOO_LARGE = "❌ قائمة التشغيل كبيرة جداً (أقصى حد: {max_playlist} فيديو)"
 
         SUCCESS_DOWNLOAD = "✅ تم التنزيل بنجاح!"
         INFO_PROCESSING = "⏳ جاري المعالجة..."
         INFO_DOWNLOADING = "📥 جاري التنزيل..."
+        INFO_QUEUED = "⏳ تمت إضافة طلبك إلى طابور التنزيل..."
+        INFO_QUEUE_POSITION = "⏳ طلبك في طابور التنزيل، موقعك: {position}"
+        INFO_CANCELLED = "❌ تم إلغاء التنزيل"
+        INFO_RESUMED = "🔄 تم استئناف تنزيل توقف بسبب إعادة تشغيل البوت:\n{title}"
         INFO_EXTRACTING_INFO = "🔍 جاري استخراج المعلومات..."
 
     YTDL_OPTS = {
@@ -2,20 +2,39 @@
 إدارة قاعدة البيانات والمستخدمين
 """
 import asyncio
-from datetime import datetime, timezone
-from typing import Optional, List, Dict, Any
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, BigInteger, JSON
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+import re
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, BigInteger, JSON, UniqueConstraint, Index
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, AsyncConnection
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.future import select
-from sqlalchemy import func, update, delete
+from sqlalchemy import case, event, func, insert, literal_column, update, delete, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.orm import aliased
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from cache import TTLCache
 from config import config
 import logging
 from contextlib import asynccontextmanager
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar('T')
+
+# مفتاح قفل الترحيلات في PostgreSQL حتى لا تُرحّل عدة نسخ تبدأ معاً
+MIGRATION_LOCK_ID = 0x7464_6C62
+
+def async_database_url(url: str) -> str:
+    """رابط قاعدة البيانات بالمشغل غير المتزامن"""
+    if url.startswith('sqlite'):
+        return url.replace('sqlite://', 'sqlite+aiosqlite://')
+    return url.replace('postgresql://', 'postgresql+asyncpg://')
+
 # قاعدة البيانات
 Base = declarative_base()
 
@@ -30,8 +49,8 @@ class User(Base):
     language_code = Column(String(10), default='ar')
     is_active = Column(Boolean, default=True)
     is_premium = Column(Boolean, default=False)
-    created_at = Column(DateTime(timezone=True), default=datetime.now(timezone.utc))
-    last_activity = Column(DateTime(timezone=True), default=datetime.now(timezone.utc))
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    last_activity = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
     
     # إعدادات المستخدم
     preferred_quality = Column(String(10), default='720p')
@@ -43,9 +62,14 @@ class User(Base):
 class Download(Base):
     """جدول التنزيلات"""
     __tablename__ = 'downloads'
+    __table_args__ = (
+        Index('ix_downloads_user_created', 'user_id', 'created_at'),
+        Index('ix_downloads_user_status_created', 'user_id', 'status', 'created_at'),
+        Index('ix_downloads_status_created', 'status', 'created_at'),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
-    user_id = Column(BigInteger, nullable=False, index=True)
+    user_id = Column(BigInteger, nullable=False)
     url = Column(Text, nullable=False)
     title = Column(Text, nullable=True)
     video_id = Column(String(20), nullable=True)
@@ -53,11 +77,13 @@ class Download(Base):
     file_size = Column(BigInteger, nullable=True)
     duration = Column(Integer, nullable=True)  # بالثواني
     download_type = Column(String(20), default='video')  # video, subtitle, playlist
-    status = Column(String(20), default='pending')  # pending, downloading, completed, failed
+    status = Column(String(20), default='pending')  # pending, downloading, interrupted, completed, failed, rejected, cancelled
     file_path = Column(Text, nullable=True)
     error_message = Column(Text, nullable=True)
     file_metadata = Column(JSON, nullable=True)
-    created_at = Column(DateTime(timezone=True), default=datetime.now(timezone.utc))
+    # مفتاح التقسيم الشهري في PostgreSQL (الترحيل 0003)
+    created_at = Column(DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc))
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)  # آخر نبضة أثناء التنزيل
     completed_at = Column(DateTime(timezone=True), nullable=True)
 
 class PlaylistDownload(Base):
@@ -74,30 +100,321 @@ class PlaylistDownload(Base):
     failed_videos = Column(Integer, default=0)
     quality = Column(String(10), nullable=True)
     status = Column(String(20), default='pending')
-    created_at = Column(DateTime(timezone=True), default=datetime.now(timezone.utc))
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
     completed_at = Column(DateTime(timezone=True), nullable=True)
 
+class TelegramFile(Base):
+    """جدول معرفات ملفات تليجرام لإعادة إرسالها دون تنزيل أو رفع"""
+    __tablename__ = 'telegram_files'
+    __table_args__ = (UniqueConstraint('video_id', 'format', name='uq_telegram_files_video_format'),)
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    video_id = Column(String(20), nullable=False)
+    format = Column(String(40), nullable=False)  # الجودة أو مفتاح الترجمة
+    file_type = Column(String(20), nullable=False)  # video, document
+    file_id = Column(Text, nullable=False)
+    file_unique_id = Column(String(100), nullable=True)
+    file_name = Column(Text, nullable=True)
+    file_size = Column(BigInteger, nullable=True)
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+
+class Job(Base):
+    """جدول مهام التنزيل في الطابور المشترك بين البوت والعمال"""
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        Index('ix_jobs_status_created', 'status', 'created_at'),
+        Index('ix_jobs_user_status', 'user_id', 'status'),
+    )
+    
+    id = Column(String(32), primary_key=True)
+    kind = Column(String(20), nullable=False)  # video, playlist
+    user_id = Column(BigInteger, nullable=False, index=True)
+    chat_id = Column(BigInteger, nullable=False)
+    message_id = Column(BigInteger, nullable=True)  # رسالة الحالة
+    payload = Column(JSON, nullable=False)
+    status = Column(String(20), default='queued', index=True)  # queued, running, done, failed
+    result = Column(JSON, nullable=True)
+    error_message = Column(Text, nullable=True)
+    worker_id = Column(String(100), nullable=True)
+    attempts = Column(Integer, default=0)
+    delivery_status = Column(String(20), nullable=True)  # claimed, delivered
+    cancel_requested = Column(Boolean, default=False)  # /cancel من أي نسخة للبوت
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+class DownloadStats(Base):
+    """عدادات الإحصائيات المجمعة: صف لكل مستخدم وصف عام بمعرف 0، تُحدَّث مع كل تنزيل مكتمل"""
+    __tablename__ = 'download_stats'
+    
+    user_id = Column(BigInteger, primary_key=True)  # 0 = الإجمالي
+    completed_downloads = Column(BigInteger, nullable=False, default=0)
+    users = Column(BigInteger, nullable=False, default=0)  # في الصف العام فقط
+
+# معرف صف الإحصائيات العامة
+GLOBAL_STATS_ID = 0
+
+# أقسام downloads الشهرية في PostgreSQL: downloads_y2026m10
+PARTITION_NAME = re.compile(r'^downloads_y(\d{4})m(\d{2})$')
+
+def month_start(moment: datetime) -> datetime:
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def next_month(moment: datetime) -> datetime:
+    start = month_start(moment)
+    return start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+
+def retention_cutoff(now: Optional[datetime] = None) -> Optional[datetime]:
+    """بداية أقدم شهر يبقى في downloads؛ ما قبله يُؤرشف ولا تراه الاستعلامات (None = بلا أرشفة)"""
+    if config.DOWNLOAD_RETENTION_DAYS <= 0:
+        return None
+    return month_start((now or datetime.now(timezone.utc)) - timedelta(days=config.DOWNLOAD_RETENTION_DAYS))
+
+# حالات وسيطة يجوز تأجيل كتابتها؛ الحالات النهائية تُكتب فوراً
+BUFFERED_STATUSES = ('pending', 'downloading')
+
+class WriteBehindBuffer:
+    """تجميع التحديثات غير الحرجة (حالات وسيطة، نبضات، عدادات التقدم) لكل سجل وكتابتها دفعة واحدة
+    
+    التحديثات المتتالية للسجل نفسه تندمج (الأحدث يغلب، والعدادات تُجمع)، وتُكتب كل
+    DB_FLUSH_INTERVAL ثانية في معاملة واحدة. الكتابة النهائية للسجل تأخذ ما بقي له في الذاكرة
+    وتكتبه معها، فلا تتأخر حالة نهائية ولا تُستبدل بحالة وسيطة أقدم.
+    """
+    
+    def __init__(self, manager: "DatabaseManager", interval: float):
+        self.manager = manager
+        self.interval = max(interval, 0.1)
+        self.enabled = False
+        self.flushes = 0
+        self._pending: Dict[Tuple[type, int], Dict[str, Dict[str, Any]]] = {}
+        self._task: Optional[asyncio.Task] = None
+    
+    def __len__(self) -> int:
+        return len(self._pending)
+    
+    def _entry(self, model: type, row_id: int) -> Dict[str, Dict[str, Any]]:
+        return self._pending.setdefault((model, row_id), {'values': {}, 'counters': {}})
+    
+    def put(self, model: type, row_id: int, values: Dict[str, Any]):
+        """قيم تحل محل السابقة عند الكتابة"""
+        self._entry(model, row_id)['values'].update(values)
+    
+    def add(self, model: type, row_id: int, **counters: int):
+        """زيادات تُجمع ثم تُضاف إلى الأعمدة"""
+        entry = self._entry(model, row_id)['counters']
+        for column, amount in counters.items():
+            if amount:
+                entry[column] = entry.get(column, 0) + amount
+    
+    def take(self, model: type, row_id: int) -> Dict[str, Any]:
+        """إخراج ما ينتظر السجل في صورة قيم UPDATE"""
+        entry = self._pending.pop((model, row_id), None)
+        return self._statement_values(model, entry) if entry else {}
+    
+    @staticmethod
+    def _statement_values(model: type, entry: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        values = dict(entry['values'])
+        for column, amount in entry['counters'].items():
+            values[column] = getattr(model, column) + amount
+        return values
+    
+    async def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        
+        async def write(session: AsyncSession):
+            for (model, row_id), entry in pending.items():
+                query = update(model).where(model.id == row_id)
+                if 'status' in entry['values']:
+                    # لا تُستبدل حالة نهائية كُتبت أثناء هذه الدفعة
+                    query = query.where(model.status.in_(BUFFERED_STATUSES + ('interrupted',)))
+                await session.execute(query.values(**self._statement_values(model, entry)))
+        
+        try:
+            await self.manager._write(write)
+            self.flushes += 1
+        except Exception as e:
+            logger.warning(f"Write-behind flush of {len(pending)} rows failed: {e}")
+            # إعادة ما لم يُكتب دون تجاوز التحديثات الأحدث
+            for key, entry in pending.items():
+                current = self._pending.setdefault(key, {'values': {}, 'counters': {}})
+                current['values'] = {**entry['values'], **current['values']}
+                for column, amount in entry['counters'].items():
+                    current['counters'][column] = current['counters'].get(column, 0) + amount
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+    
+    def start(self):
+        self.enabled = True
+        if not self._task:
+            self._task = asyncio.ensure_future(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        self.enabled = False
+
+class SQLiteWriter:
+    """كاتب وحيد لـ SQLite: كل الكتابات تمر عبر اتصال واحد وتُجمع في معاملات مشتركة (group commit)
+    
+    SQLite يسمح بكاتب واحد فقط في كل لحظة؛ بدلاً من تسابق الجلسات على القفل ("database is locked")
+    تصطف عمليات الكتابة هنا وتُنفذ متتالية في معاملة واحدة تُثبَّت مرة واحدة. إذا فشلت إحداها تُلغى
+    المعاملة وتُعاد العمليات كل واحدة في معاملتها، فلا يصل الخطأ إلا إلى صاحبه. القراءات تبقى على
+    اتصالات المجمع الأخرى (WAL).
+    """
+    
+    def __init__(self, engine, batch_size: int):
+        self.engine = engine
+        self.batch_size = max(1, batch_size)
+        self.commits = 0
+        self.writes = 0
+        self._connection: Optional[AsyncConnection] = None
+        self._queue: "asyncio.Queue[Optional[Tuple[Callable, asyncio.Future]]]" = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+    
+    async def start(self):
+        self._connection = await self.engine.connect()
+        # BEGIN IMMEDIATE: يحجز قفل الكتابة من بداية المعاملة (انظر _configure_sqlite)
+        await self._connection.execution_options(sqlite_begin='IMMEDIATE')
+        self._task = asyncio.ensure_future(self._run())
+    
+    async def stop(self):
+        """إنهاء الكاتب بعد تنفيذ ما في الطابور"""
+        if self._task:
+            self._queue.put_nowait(None)
+            await self._task
+            self._task = None
+        if self._connection:
+            await self._connection.close()
+            self._connection = None
+    
+    async def submit(self, operation: Callable[[AsyncSession], Awaitable[Any]]) -> Any:
+        """تنفيذ operation(session) في الدفعة التالية وإرجاع نتيجتها بعد التثبيت"""
+        future = asyncio.get_event_loop().create_future()
+        self._queue.put_nowait((operation, future))
+        return await future
+    
+    async def _run(self):
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stopping = False
+            while len(batch) < self.batch_size and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            
+            # من أُلغي انتظاره قبل التنفيذ لا يُكتب
+            batch = [(operation, future) for operation, future in batch if not future.done()]
+            if batch:
+                await self._commit(batch)
+            if stopping:
+                return
+    
+    async def _commit(self, batch: List[Tuple[Callable, asyncio.Future]]):
+        try:
+            async with AsyncSession(bind=self._connection, expire_on_commit=False) as session:
+                results = [await operation(session) for operation, _ in batch]
+                await session.commit()
+        except Exception as e:
+            if len(batch) == 1:
+                if not batch[0][1].done():
+                    batch[0][1].set_exception(e)
+                return
+            logger.warning(f"Group commit of {len(batch)} writes failed ({e}); retrying them one by one")
+            for entry in batch:
+                await self._commit([entry])
+            return
+        
+        self.commits += 1
+        self.writes += len(batch)
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'commits': self.commits,
+            'writes': self.writes,
+            'waiting': self._queue.qsize(),
+            'writes_per_commit': self.writes / self.commits if self.commits else 0.0
+        }
+
+def _configure_sqlite(engine, tuning: bool):
+    """إعدادات كل اتصال SQLite، وإدارة BEGIN يدوياً (مطلوبة لـ SAVEPOINT في pysqlite/aiosqlite)"""
+    
+    @event.listens_for(engine.sync_engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA busy_timeout={int(config.SQLITE_BUSY_TIMEOUT)}")
+        if tuning:
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute(f"PRAGMA mmap_size={int(config.SQLITE_MMAP_SIZE)}")
+            cursor.execute(f"PRAGMA cache_size=-{int(config.SQLITE_CACHE_SIZE)}")
+            cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+    
+    @event.listens_for(engine.sync_engine, "begin")
+    def on_begin(connection):
+        mode = connection.get_execution_options().get('sqlite_begin', 'DEFERRED')
+        connection.exec_driver_sql(f"BEGIN {mode}")
+
 class DatabaseManager:
     """مدير قاعدة البيانات"""
     
     def __init__(self):
         self.engine = None
         self.async_session = None
+        self.buffer = WriteBehindBuffer(self, config.DB_FLUSH_INTERVAL)
+        self.writer: Optional[SQLiteWriter] = None
+        # آخر صف كُتب لكل مستخدم؛ انتهاء صلاحيته يعني أن last_activity يستحق التحديث
+        self._recent_users = TTLCache(config.USER_CACHE_SIZE, config.USER_ACTIVITY_INTERVAL)
     
     async def init_db(self):
-        """تهيئة قاعدة البيانات"""
+        """تهيئة قاعدة البيانات (مرة واحدة؛ الاستدعاءات اللاحقة لا تفعل شيئاً حتى close)"""
+        if self.engine is not None:
+            return
         try:
             # إنشاء محرك قاعدة البيانات
-            if config.DATABASE_URL.startswith('sqlite'):
-                db_url = config.DATABASE_URL.replace('sqlite://', 'sqlite+aiosqlite://')
-            else:
-                db_url = config.DATABASE_URL.replace('postgresql://', 'postgresql+asyncpg://')
+            db_url = async_database_url(config.DATABASE_URL)
             
-            self.engine = create_async_engine(
-                db_url,
-                echo=False,
-                pool_pre_ping=True
-            )
+            engine_options: Dict[str, Any] = {'echo': False, 'pool_pre_ping': True}
+            sqlite_file = db_url.startswith('sqlite') and make_url(db_url).database not in (None, '', ':memory:')
+            if not db_url.startswith('sqlite'):
+                engine_options.update(
+                    pool_size=config.DB_POOL_SIZE,
+                    max_overflow=config.DB_MAX_OVERFLOW,
+                    pool_timeout=config.DB_POOL_TIMEOUT,
+                    pool_recycle=config.DB_POOL_RECYCLE
+                )
+            elif sqlite_file and config.SQLITE_TUNING:
+                # اتصالات قراءة دائمة بدلاً من اتصال جديد (وخيط جديد) لكل جلسة
+                engine_options.update(
+                    poolclass=AsyncAdaptedQueuePool,
+                    pool_size=max(1, config.SQLITE_READERS),
+                    max_overflow=config.SQLITE_READERS,
+                    pool_pre_ping=False
+                )
+            self.engine = create_async_engine(db_url, **engine_options)
+            if sqlite_file and (config.SQLITE_TUNING or config.SQLITE_SINGLE_WRITER):
+                _configure_sqlite(self.engine, config.SQLITE_TUNING)
             
             self.async_session = sessionmaker(
                 self.engine,
@@ -105,18 +422,58 @@ class DatabaseManager:
                 expire_on_commit=False
             )
             
+            # المخطط يُدار بترحيلات Alembic (migrations/)
             async with self.engine.begin() as conn:
-                await conn.run_sync(Base.metadata.create_all)
+                await conn.run_sync(self._migrate)
+            
+            if sqlite_file and config.SQLITE_SINGLE_WRITER:
+                self.writer = SQLiteWriter(self.engine, config.SQLITE_WRITE_BATCH)
+                await self.writer.start()
+            
+            if config.DB_WRITE_BEHIND:
+                self.buffer.start()
                 
             logger.info("Database initialized successfully")
             
         except Exception as e:
             logger.error(f"Failed to initialize database: {e}")
+            await self.close()
             raise
     
+    @staticmethod
+    def _migrate(connection):
+        """ترقية المخطط إلى آخر ترحيل على اتصال المحرك نفسه"""
+        from alembic import command
+        from alembic.config import Config as AlembicConfig
+        
+        root = Path(__file__).parent
+        alembic_config = AlembicConfig(str(root / 'alembic.ini'))
+        alembic_config.set_main_option('script_location', str(root / 'migrations'))
+        alembic_config.attributes['connection'] = connection
+        if connection.dialect.name == 'postgresql':
+            connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': MIGRATION_LOCK_ID})
+        command.upgrade(alembic_config, 'head')
+    
     async def close(self):
+        await self.buffer.stop()
+        if self.writer:
+            await self.writer.stop()
+            self.writer = None
         if self.engine:
             await self.engine.dispose()
+            self.engine = None
+    
+    async def ping(self) -> bool:
+        """التحقق من إمكانية الوصول إلى قاعدة البيانات"""
+        if not self.engine:
+            return False
+        try:
+            async with self.engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+            return True
+        except Exception as e:
+            logger.warning(f"Database ping failed: {e}")
+            return False
     
     @asynccontextmanager
     async def get_session(self):
@@ -127,113 +484,560 @@ class DatabaseManager:
         finally:
             await session.close()
     
+    async def _write(self, operation: Callable[[AsyncSession], Awaitable[T]]) -> T:
+        """تنفيذ operation(session) في معاملة تُثبَّت بعدها؛ مع الكاتب الوحيد تنضم إلى دفعة مشتركة
+        
+        قد تُعاد operation في معاملة مستقلة إذا فشلت كتابة أخرى في الدفعة، فيجب ألا تغير شيئاً خارج الجلسة،
+        وألا تستدعي دوال كتابة أخرى من DatabaseManager.
+        """
+        if self.writer:
+            return await self.writer.submit(operation)
+        async with self.get_session() as session:
+            result = await operation(session)
+            await session.commit()
+            return result
+    
+    async def _insert(self, session: AsyncSession, model: type, data: Dict[str, Any]):
+        """إضافة سجل وإرجاعه في رحلة واحدة (INSERT ... RETURNING) بدلاً من commit ثم refresh"""
+        if self.engine.dialect.insert_returning:
+            result = await session.execute(insert(model).values(**data).returning(model))
+            return result.scalar_one()
+        row = model(**data)
+        session.add(row)
+        await session.flush()
+        return row
+    
+    def _final_values(self, model: type, row_id: int, values: Dict[str, Any]) -> Dict[str, Any]:
+        """قيم الكتابة النهائية للسجل مع ما ينتظره في ذاكرة الكتابة المؤجلة (تُؤخذ قبل _write)"""
+        return {**self.buffer.take(model, row_id), **values}
+    
     # إدارة المستخدمين
     async def get_user(self, user_id: int) -> Optional[User]:
         async with self.get_session() as session:
             result = await session.execute(select(User).where(User.id == user_id))
             return result.scalar_one_or_none()
     
+    def _upsert(
+        self,
+        model: type,
+        values: Any,
+        key: List[str],
+        update_columns: List[str],
+        increment: bool = False
+    ):
+        """INSERT ... ON CONFLICT DO UPDATE حسب محرك قاعدة البيانات
+        
+        values قاموس أو قائمة صفوف؛ increment يضيف القيم الجديدة إلى الموجودة بدلاً من استبدالها.
+        """
+        dialect = self.engine.dialect.name
+        if dialect == 'postgresql':
+            statement = postgresql_insert(model).values(values)
+        elif dialect == 'sqlite':
+            statement = sqlite_insert(model).values(values)
+        else:
+            raise NotImplementedError(f"Upsert is not supported for {dialect}")
+        if increment:
+            set_ = {column: getattr(model, column) + statement.excluded[column] for column in update_columns}
+        else:
+            set_ = {column: statement.excluded[column] for column in update_columns}
+        return statement.on_conflict_do_update(index_elements=key, set_=set_)
+    
+    async def _bump_stats(self, session: AsyncSession, user_id: Optional[int], completed: int = 0, users: int = 0):
+        """زيادة العدادات المجمعة للمستخدم وللإجمالي داخل معاملة الكتابة نفسها"""
+        owners = [GLOBAL_STATS_ID] + ([user_id] if user_id else [])
+        rows = [{'user_id': owner, 'completed_downloads': completed, 'users': users} for owner in owners]
+        await session.execute(
+            self._upsert(DownloadStats, rows, ['user_id'], ['completed_downloads', 'users'], increment=True)
+        )
+    
     async def create_or_update_user(self, user_data: Dict[str, Any]) -> User:
-        async with self.get_session() as session:
-            result = await session.execute(select(User).where(User.id == user_data['id']))
-            user = result.scalar_one_or_none()
-            
-            if user:
-                user.username = user_data.get('username', user.username)
-                user.first_name = user_data.get('first_name', user.first_name)
-                user.last_name = user_data.get('last_name', user.last_name)
-                user.language_code = user_data.get('language_code', user.language_code)
-                user.last_activity = datetime.now(timezone.utc)
+        """تسجيل المستخدم أو تحديث بياناته في عبارة واحدة (آمنة مع /start المتزامن)
+        
+        لا يُكتب شيء إذا لم تتغير البيانات منذ آخر كتابة خلال USER_ACTIVITY_INTERVAL.
+        """
+        profile = {
+            column: user_data[column]
+            for column in ('username', 'first_name', 'last_name', 'language_code')
+            if column in user_data
+        }
+        cached = self._recent_users.get(user_data['id'])
+        if cached and all(getattr(cached, column) == value for column, value in profile.items()):
+            return cached
+        
+        now = datetime.now(timezone.utc)
+        values = {'language_code': 'ar', **profile, 'id': user_data['id'], 'created_at': now, 'last_activity': now}
+        async def write(session: AsyncSession):
+            if self.engine.dialect.name == 'postgresql':
+                # xmax = 0 في الصف المُرجع يعني أنه أُدرج ولم يُحدَّث
+                statement = self._upsert(User, values, ['id'], [*profile, 'last_activity'])
+                result = await session.execute(
+                    statement.returning(User, literal_column('xmax = 0')),
+                    execution_options={'populate_existing': True}
+                )
+                user, inserted = result.one()
             else:
-                user = User(
-                    id=user_data['id'],
-                    username=user_data.get('username'),
-                    first_name=user_data.get('first_name'),
-                    last_name=user_data.get('last_name'),
-                    language_code=user_data.get('language_code', 'ar')
+                # SQLite لا يكشف أي فرعي ON CONFLICT نُفذ، فالإدراج المشروط أولاً وعدد صفوفه هو المؤشر
+                result = await session.execute(
+                    sqlite_insert(User).values(values).on_conflict_do_nothing(index_elements=['id'])
                 )
-                session.add(user)
-            
-            await session.commit()
-            await session.refresh(user)
+                inserted = result.rowcount == 1
+                if not inserted:
+                    await session.execute(
+                        update(User).where(User.id == user_data['id']).values(**profile, last_activity=now)
+                    )
+                user = await session.get(User, user_data['id'], populate_existing=True)
+            if inserted:
+                await self._bump_stats(session, None, users=1)
             return user
+        user = await self._write(write)
+        
+        self._recent_users.set(user.id, user)
+        return user
     
     async def update_user_settings(self, user_id: int, settings: Dict[str, Any]) -> bool:
-        async with self.get_session() as session:
+        self._recent_users.pop(user_id)
+        async def write(session: AsyncSession):
             await session.execute(update(User).where(User.id == user_id).values(**settings))
-            await session.commit()
             return True
+        return await self._write(write)
+    
+    @staticmethod
+    def _count_download(user_id: int, file_size: int):
+        return update(User).where(User.id == user_id).values(
+            download_count=User.download_count + 1,
+            total_size_downloaded=User.total_size_downloaded + file_size
+        )
     
     async def increment_download_count(self, user_id: int, file_size: int = 0):
-        async with self.get_session() as session:
-            await session.execute(
-                update(User).where(User.id == user_id).values(
-                    download_count=User.download_count + 1,
-                    total_size_downloaded=User.total_size_downloaded + file_size
-                )
-            )
-            await session.commit()
+        async def write(session: AsyncSession):
+            await session.execute(self._count_download(user_id, file_size))
+        await self._write(write)
     
     # إدارة التنزيلات
-    async def create_download(self, download_data: Dict[str, Any]) -> Download:
-        async with self.get_session() as session:
-            download = Download(**download_data)
-            session.add(download)
-            await session.commit()
-            await session.refresh(download)
+    async def create_download(self, download_data: Dict[str, Any], count_for_user: bool = False) -> Download:
+        """إنشاء سجل تنزيل؛ count_for_user يحتسبه في إحصائيات المستخدم في المعاملة نفسها"""
+        async def write(session: AsyncSession):
+            download = await self._insert(session, Download, download_data)
+            if download.status == 'completed':
+                await self._bump_stats(session, download.user_id, completed=1)
+            if count_for_user:
+                await session.execute(
+                    self._count_download(download_data['user_id'], download_data.get('file_size') or 0)
+                )
             return download
+        return await self._write(write)
     
     async def update_download_status(self, download_id: int, status: str, **kwargs):
-        async with self.get_session() as session:
-            update_data = {'status': status}
+        update_data = {'status': status}
+        if status == 'completed':
+            update_data['completed_at'] = datetime.now(timezone.utc)
+        update_data.update(kwargs)
+        if self.buffer.enabled and status in BUFFERED_STATUSES:
+            self.buffer.put(Download, download_id, update_data)
+            return
+        update_data = self._final_values(Download, download_id, update_data)
+        
+        async def write(session: AsyncSession):
             if status == 'completed':
-                update_data['completed_at'] = datetime.now(timezone.utc)
-            update_data.update(kwargs)
-            await session.execute(update(Download).where(Download.id == download_id).values(**update_data))
-            await session.commit()
+                await self._complete(session, download_id, update_data)
+            else:
+                await session.execute(update(Download).where(Download.id == download_id).values(**update_data))
+        await self._write(write)
     
-    async def get_user_downloads(self, user_id: int, limit: int = 20) -> List[Download]:
+    async def _complete(self, session: AsyncSession, download_id: int, values: Dict[str, Any]) -> Optional[int]:
+        """تعليم التنزيل مكتملاً مرة واحدة مع العدادات المجمعة؛ يُرجع معرف المستخدم إن تغيرت حالته"""
+        query = update(Download).where(Download.id == download_id).where(Download.status != 'completed')
+        if self.engine.dialect.update_returning:
+            result = await session.execute(query.values(**values).returning(Download.user_id))
+            user_id = result.scalar_one_or_none()
+        else:
+            user_id = (await session.execute(
+                select(Download.user_id).where(Download.id == download_id)
+            )).scalar_one_or_none()
+            if (await session.execute(query.values(**values))).rowcount != 1:
+                user_id = None
+        if user_id is not None:
+            await self._bump_stats(session, user_id, completed=1)
+        return user_id
+    
+    async def complete_download(self, download_id: int, user_id: int, file_path: str, file_size: int):
+        """إنهاء التنزيل وتحديث إحصائيات المستخدم في معاملة واحدة"""
+        values = self._final_values(Download, download_id, {
+            'status': 'completed',
+            'completed_at': datetime.now(timezone.utc),
+            'file_path': file_path,
+            'file_size': file_size
+        })
+        
+        async def write(session: AsyncSession):
+            completed = await self._complete(session, download_id, values)
+            if completed is not None:
+                await session.execute(self._count_download(user_id, file_size))
+        await self._write(write)
+    
+    async def get_download(self, download_id: int) -> Optional[Download]:
+        async with self.get_session() as session:
+            result = await session.execute(select(Download).where(Download.id == download_id))
+            return result.scalar_one_or_none()
+    
+    async def touch_download(self, download_id: int):
+        """تسجيل نبضة للتنزيل الجاري حتى لا يُعتبر متوقفاً"""
+        if self.buffer.enabled:
+            self.buffer.put(Download, download_id, {'heartbeat_at': datetime.now(timezone.utc)})
+            return
+        async def write(session: AsyncSession):
+            await session.execute(
+                update(Download).where(Download.id == download_id).values(heartbeat_at=datetime.now(timezone.utc))
+            )
+        await self._write(write)
+    
+    async def get_interrupted_downloads(
+        self,
+        statuses: tuple = ('pending', 'downloading'),
+        stale_before: Optional[datetime] = None
+    ) -> List[Download]:
+        """التنزيلات التي توقفت بسبب إعادة التشغيل (بدون نبضة حديثة)"""
         async with self.get_session() as session:
+            query = select(Download).where(Download.status.in_(statuses)).order_by(Download.id)
+            cutoff = retention_cutoff()
+            if cutoff is not None:
+                query = query.where(Download.created_at >= cutoff)
+            if stale_before is not None:
+                query = query.where(func.coalesce(Download.heartbeat_at, Download.created_at) < stale_before)
+            result = await session.execute(query)
+            return list(result.scalars().all())
+    
+    async def mark_download_interrupted(self, download_id: int, expected_status: str) -> bool:
+        """حجز سجل متوقف للاستئناف (شرطياً حتى لا تستأنفه نسختان)"""
+        async def write(session: AsyncSession):
             result = await session.execute(
-                select(Download)
-                .where(Download.user_id == user_id)
-                .order_by(Download.created_at.desc())
-                .limit(limit)
+                update(Download)
+                .where(Download.id == download_id)
+                .where(Download.status == expected_status)
+                .values(status='interrupted', heartbeat_at=datetime.now(timezone.utc))
             )
+            return result.rowcount == 1
+        return await self._write(write)
+    
+    async def get_user_downloads(self, user_id: int, limit: int = 20) -> List[Download]:
+        """أحدث تنزيلات المستخدم من الأشهر غير المؤرشفة فقط (فهرس user_id, created_at)"""
+        async with self.get_session() as session:
+            query = select(Download).where(Download.user_id == user_id)
+            cutoff = retention_cutoff()
+            if cutoff is not None:
+                # في PostgreSQL يقتصر المسح على أقسام الأشهر الحديثة
+                query = query.where(Download.created_at >= cutoff)
+            result = await session.execute(query.order_by(Download.created_at.desc()).limit(limit))
             return result.scalars().all()
     
+    # الاحتفاظ بسجل التنزيلات (retention.py)
+    @property
+    def partitioned(self) -> bool:
+        """downloads مقسم شهرياً (PostgreSQL بعد الترحيل 0003)؛ SQLite جدول واحد تحده الأرشفة"""
+        return self.engine is not None and self.engine.dialect.name == 'postgresql'
+    
+    async def ensure_download_partitions(self, now: Optional[datetime] = None):
+        """إنشاء قسمي الشهر الحالي والتالي مسبقاً حتى لا تقع الإدراجات في القسم الافتراضي"""
+        if not self.partitioned:
+            return
+        month = month_start(now or datetime.now(timezone.utc))
+        for start in (month, next_month(month)):
+            end = next_month(start)
+            try:
+                async with self.engine.begin() as conn:
+                    await conn.execute(text(
+                        f"CREATE TABLE IF NOT EXISTS downloads_y{start:%Y}m{start:%m} PARTITION OF downloads "
+                        f"FOR VALUES FROM ('{start:%Y-%m-%d} 00:00:00+00') TO ('{end:%Y-%m-%d} 00:00:00+00')"
+                    ))
+            except Exception as e:
+                # القسم الافتراضي يحوي صفوفاً من هذا الشهر؛ تبقى هناك حتى تؤرشف
+                logger.warning(f"Could not create downloads partition for {start:%Y-%m}: {e}")
+    
+    async def get_download_partitions(self) -> List[Tuple[str, datetime]]:
+        """أقسام downloads الشهرية مع بداية كل شهر، الأقدم أولاً"""
+        if not self.partitioned:
+            return []
+        async with self.engine.connect() as conn:
+            result = await conn.execute(text(
+                "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = 'downloads'::regclass"
+            ))
+            partitions = []
+            for (name,) in result:
+                match = PARTITION_NAME.match(name)
+                if match:
+                    partitions.append((name, datetime(int(match[1]), int(match[2]), 1, tzinfo=timezone.utc)))
+            return sorted(partitions, key=lambda partition: partition[1])
+    
+    async def drop_download_partition(self, name: str):
+        if not PARTITION_NAME.match(name):
+            raise ValueError(f"Not a downloads partition: {name}")
+        async with self.engine.begin() as conn:
+            await conn.execute(text(f"DROP TABLE IF EXISTS {name}"))
+    
+    async def get_downloads_before(
+        self,
+        before: datetime,
+        after_id: int = 0,
+        limit: int = 1000,
+        since: Optional[datetime] = None
+    ) -> List[Download]:
+        """دفعة من السجلات الأقدم من before بترتيب المعرف (ترقيم بالمفتاح عبر after_id)"""
+        async with self.get_session() as session:
+            query = select(Download).where(Download.created_at < before).where(Download.id > after_id)
+            if since is not None:
+                query = query.where(Download.created_at >= since)
+            result = await session.execute(query.order_by(Download.id).limit(limit))
+            return list(result.scalars().all())
+    
+    async def delete_downloads(self, download_ids: List[int]) -> int:
+        for download_id in download_ids:
+            self.buffer.take(Download, download_id)
+        async def write(session: AsyncSession):
+            result = await session.execute(delete(Download).where(Download.id.in_(download_ids)))
+            return result.rowcount
+        return await self._write(write)
+    
     # إدارة قوائم التشغيل
     async def create_playlist_download(self, playlist_data: Dict[str, Any]) -> PlaylistDownload:
-        async with self.get_session() as session:
-            playlist = PlaylistDownload(**playlist_data)
-            session.add(playlist)
-            await session.commit()
-            await session.refresh(playlist)
-            return playlist
+        async def write(session: AsyncSession):
+            return await self._insert(session, PlaylistDownload, playlist_data)
+        return await self._write(write)
     
     async def update_playlist_progress(self, playlist_id: int, completed: int = 0, failed: int = 0):
-        async with self.get_session() as session:
+        if self.buffer.enabled:
+            self.buffer.add(PlaylistDownload, playlist_id, completed_videos=completed, failed_videos=failed)
+            return
+        async def write(session: AsyncSession):
             await session.execute(
                 update(PlaylistDownload).where(PlaylistDownload.id == playlist_id).values(
                     completed_videos=PlaylistDownload.completed_videos + completed,
                     failed_videos=PlaylistDownload.failed_videos + failed
                 )
             )
-            await session.commit()
+        await self._write(write)
+    
+    async def update_playlist_status(self, playlist_id: int, status: str):
+        update_data = {'status': status}
+        if status in ('completed', 'partial'):
+            update_data['completed_at'] = datetime.now(timezone.utc)
+        update_data = self._final_values(PlaylistDownload, playlist_id, update_data)
+        
+        async def write(session: AsyncSession):
+            await session.execute(
+                update(PlaylistDownload).where(PlaylistDownload.id == playlist_id).values(**update_data)
+            )
+        await self._write(write)
+    
+    # معرفات ملفات تليجرام
+    async def get_telegram_file(self, video_id: str, fmt: str) -> Optional[TelegramFile]:
+        async with self.get_session() as session:
+            result = await session.execute(
+                select(TelegramFile)
+                .where(TelegramFile.video_id == video_id)
+                .where(TelegramFile.format == fmt)
+            )
+            return result.scalar_one_or_none()
+    
+    async def save_telegram_file(self, file_data: Dict[str, Any]) -> TelegramFile:
+        async def write(session: AsyncSession):
+            result = await session.execute(
+                select(TelegramFile)
+                .where(TelegramFile.video_id == file_data['video_id'])
+                .where(TelegramFile.format == file_data['format'])
+            )
+            telegram_file = result.scalar_one_or_none()
+            
+            if telegram_file:
+                for key, value in file_data.items():
+                    setattr(telegram_file, key, value)
+            else:
+                telegram_file = TelegramFile(**file_data)
+                session.add(telegram_file)
+            
+            return telegram_file
+        return await self._write(write)
+    
+    async def delete_telegram_file(self, video_id: str, fmt: str):
+        async def write(session: AsyncSession):
+            await session.execute(
+                delete(TelegramFile)
+                .where(TelegramFile.video_id == video_id)
+                .where((TelegramFile.format == fmt) | TelegramFile.format.like(f"{fmt}#part%"))
+            )
+        await self._write(write)
+    
+    async def get_telegram_file_parts(self, video_id: str, fmt: str) -> List[TelegramFile]:
+        """أجزاء ملف كبير أُرسل مقسماً (بترتيبها)"""
+        async with self.get_session() as session:
+            result = await session.execute(
+                select(TelegramFile)
+                .where(TelegramFile.video_id == video_id)
+                .where(TelegramFile.format.like(f"{fmt}#part%"))
+                .order_by(TelegramFile.format)
+            )
+            return list(result.scalars().all())
+    
+    # طابور المهام
+    async def enqueue_job(self, job_data: Dict[str, Any]) -> Job:
+        async def write(session: AsyncSession):
+            job = Job(**job_data)
+            session.add(job)
+            return job
+        return await self._write(write)
+    
+    async def claim_job(self, worker_id: str) -> Optional[Job]:
+        """حجز المهمة التالية لعامل واحد فقط، بالعدل بين المستخدمين
+        
+        تُقدَّم مهام المستخدمين الذين لم يبلغوا حدهم من المهام الجارية، ثم الأقل استهلاكاً (مهامه الجارية
+        مقسومة على وزنه)، ثم الأقدم. مهمة من بلغ حده تُحجز فقط إذا لم ينتظر غيره، فلا يبقى عامل خاملاً.
+        """
+        running = aliased(Job)
+        active = (
+            select(func.count())
+            .select_from(running)
+            .where(running.user_id == Job.user_id)
+            .where(running.status == 'running')
+            .correlate(Job)
+            .scalar_subquery()
+        )
+        premium = func.coalesce(
+            select(User.is_premium).where(User.id == Job.user_id).correlate(Job).scalar_subquery(),
+            False
+        )
+        limit = case((premium == True, config.PREMIUM_JOB_CONCURRENCY), else_=config.USER_JOB_CONCURRENCY)
+        weight = case((premium == True, config.PREMIUM_WEIGHT), else_=1.0)
+        
+        async def write(session: AsyncSession):
+            result = await session.execute(
+                select(Job.id)
+                .where(Job.status == 'queued')
+                .order_by(case((active < limit, 0), else_=1), active / weight, Job.created_at)
+                .limit(1)
+                .with_for_update(skip_locked=True, of=Job)
+            )
+            job_id = result.scalar_one_or_none()
+            if not job_id:
+                return None
+            
+            # التحديث المشروط يضمن أن عاملاً واحداً فقط يحجز المهمة (يشمل SQLite)
+            now = datetime.now(timezone.utc)
+            claimed = await session.execute(
+                update(Job)
+                .where(Job.id == job_id)
+                .where(Job.status == 'queued')
+                .values(
+                    status='running',
+                    worker_id=worker_id,
+                    attempts=Job.attempts + 1,
+                    started_at=now,
+                    heartbeat_at=now
+                )
+            )
+            if claimed.rowcount != 1:
+                return None
+            
+            result = await session.execute(select(Job).where(Job.id == job_id))
+            return result.scalar_one_or_none()
+        return await self._write(write)
+    
+    async def heartbeat_job(self, job_id: str):
+        async def write(session: AsyncSession):
+            await session.execute(
+                update(Job).where(Job.id == job_id).values(heartbeat_at=datetime.now(timezone.utc))
+            )
+        await self._write(write)
+    
+    async def request_job_cancel(self, user_id: int) -> int:
+        """تعليم مهام المستخدم المنتظرة والجارية للإلغاء"""
+        async def write(session: AsyncSession):
+            result = await session.execute(
+                update(Job)
+                .where(Job.user_id == user_id)
+                .where(Job.status.in_(('queued', 'running')))
+                .values(cancel_requested=True)
+            )
+            return result.rowcount
+        return await self._write(write)
+    
+    async def is_job_cancel_requested(self, job_id: str) -> bool:
+        async with self.get_session() as session:
+            result = await session.execute(select(Job.cancel_requested).where(Job.id == job_id))
+            return bool(result.scalar_one_or_none())
+    
+    async def abandon_stale_jobs(self, stale_before: datetime) -> int:
+        """إغلاق المهام التي مات عاملها؛ التنزيلات نفسها تُستأنف من سجل التنزيلات"""
+        async def write(session: AsyncSession):
+            result = await session.execute(
+                update(Job)
+                .where(Job.status == 'running')
+                .where(Job.heartbeat_at < stale_before)
+                .values(
+                    status='failed',
+                    error_message='interrupted',
+                    delivery_status='delivered',
+                    finished_at=datetime.now(timezone.utc)
+                )
+            )
+            return result.rowcount
+        return await self._write(write)
+    
+    async def finish_job(self, job_id: str, status: str, result: Optional[Dict] = None, error_message: Optional[str] = None):
+        async def write(session: AsyncSession):
+            await session.execute(
+                update(Job).where(Job.id == job_id).values(
+                    status=status,
+                    result=result,
+                    error_message=error_message,
+                    finished_at=datetime.now(timezone.utc)
+                )
+            )
+        await self._write(write)
+    
+    async def claim_finished_jobs(self, limit: int = 20) -> List[Job]:
+        """حجز المهام المنتهية لتسليمها بواسطة نسخة واحدة من البوت"""
+        async def write(session: AsyncSession):
+            result = await session.execute(
+                select(Job.id)
+                .where(Job.status.in_(('done', 'failed')))
+                .where(Job.delivery_status.is_(None))
+                .order_by(Job.finished_at)
+                .limit(limit)
+            )
+            claimed_ids = []
+            for job_id in result.scalars().all():
+                claimed = await session.execute(
+                    update(Job)
+                    .where(Job.id == job_id)
+                    .where(Job.delivery_status.is_(None))
+                    .values(delivery_status='claimed')
+                )
+                if claimed.rowcount == 1:
+                    claimed_ids.append(job_id)
+            
+            if not claimed_ids:
+                return []
+            result = await session.execute(select(Job).where(Job.id.in_(claimed_ids)).order_by(Job.finished_at))
+            return list(result.scalars().all())
+        return await self._write(write)
+    
+    async def mark_job_delivered(self, job_id: str):
+        async def write(session: AsyncSession):
+            await session.execute(update(Job).where(Job.id == job_id).values(delivery_status='delivered'))
+        await self._write(write)
     
     # إحصائيات
     async def get_user_stats(self, user_id: int) -> Dict[str, Any]:
         async with self.get_session() as session:
-            user = await self.get_user(user_id)
-            if not user:
-                return {}
-            
             result = await session.execute(
-                select(func.count(Download.id))
-                .where(Download.user_id == user_id)
-                .where(Download.status == 'completed')
+                select(User, DownloadStats.completed_downloads)
+                .outerjoin(DownloadStats, DownloadStats.user_id == User.id)
+                .where(User.id == user_id)
             )
-            recent_downloads = result.scalar() or 0
+            row = result.first()
+            if not row:
+                return {}
+            user, recent_downloads = row[0], row[1] or 0
             
             size_mb = user.total_size_downloaded / (1024 * 1024)
             size_str = f"{size_mb:.1f} ميجابايت" if size_mb < 1024 else f"{size_mb / 1024:.1f} جيجابايت"
@@ -248,15 +1052,10 @@ class DatabaseManager:
     
     async def get_global_stats(self) -> Dict[str, Any]:
         async with self.get_session() as session:
-            users_result = await session.execute(select(func.count(User.id)).where(User.is_active == True))
-            total_users = users_result.scalar() or 0
-            
-            downloads_result = await session.execute(select(func.count(Download.id)).where(Download.status == 'completed'))
-            total_downloads = downloads_result.scalar() or 0
-            
+            totals = await session.get(DownloadStats, GLOBAL_STATS_ID)
             return {
-                'total_users': total_users,
-                'total_downloads': total_downloads
+                'total_users': totals.users if totals else 0,
+                'total_downloads': totals.completed_downloads if totals else 0
             }
 
 # مثيل عام من مدير قاعدة البيانات
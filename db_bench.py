@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+قياس إنتاجية الكتابة في SQLite تحت تنزيلات متزامنة بإعدادات قاعدة البيانات المختلفة
+
+كل تنزيل وهمي يمر بمسار البوت الفعلي: إنشاء السجل، ثم "downloading"، ثم نبضات، ثم الإكمال مع
+إحصائيات المستخدم، بينما يقرأ مستخدمون آخرون سجلاتهم وإحصائياتهم بالتوازي.
+
+مثال: python db_bench.py --downloads 500 --concurrency 50 --heartbeats 4
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+sys.path.append(str(Path(__file__).parent))
+
+from sqlalchemy import event
+
+from config import config
+from database import DatabaseManager
+
+# (الاسم، SQLITE_TUNING، SQLITE_SINGLE_WRITER)
+PROFILES = [
+    ('default', False, False),
+    ('wal', True, False),
+    ('wal+writer', True, True),
+]
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+async def run_profile(tuning: bool, single_writer: bool, args) -> Dict[str, float]:
+    directory = tempfile.mkdtemp(prefix='db_bench_')
+    config.DATABASE_URL = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    config.SQLITE_TUNING = tuning
+    config.SQLITE_SINGLE_WRITER = single_writer
+    config.DB_WRITE_BEHIND = False
+
+    db = DatabaseManager()
+    await db.init_db()
+    commits = [0]
+    event.listen(db.engine.sync_engine, 'commit', lambda conn: commits.__setitem__(0, commits[0] + 1))
+
+    users = list(range(1, args.users + 1))
+    for user_id in users:
+        await db.create_or_update_user({'id': user_id})
+
+    latencies: List[float] = []
+    errors = {'locked': 0, 'other': 0}
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async def write(operation):
+        started = time.perf_counter()
+        try:
+            await operation
+        except Exception as e:
+            errors['locked' if 'locked' in str(e) else 'other'] += 1
+            return
+        latencies.append(time.perf_counter() - started)
+
+    async def download(index: int):
+        user_id = users[index % len(users)]
+        async with slots:
+            started = time.perf_counter()
+            try:
+                record = await db.create_download({'user_id': user_id, 'url': f'https://example.com/{index}'})
+            except Exception as e:
+                errors['locked' if 'locked' in str(e) else 'other'] += 1
+                return
+            latencies.append(time.perf_counter() - started)
+            await write(db.update_download_status(record.id, 'downloading'))
+            for _ in range(args.heartbeats):
+                await write(db.touch_download(record.id))
+            await write(db.complete_download(record.id, user_id, f'/tmp/{index}.mp4', 1024 * 1024))
+
+    reads = [0]
+    done = asyncio.Event()
+
+    async def reader(user_id: int):
+        while not done.is_set():
+            await db.get_user_downloads(user_id)
+            await db.get_global_stats()
+            reads[0] += 2
+
+    readers = [asyncio.ensure_future(reader(users[i % len(users)])) for i in range(args.readers)]
+    started = time.perf_counter()
+    await asyncio.gather(*(download(i) for i in range(args.downloads)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await asyncio.gather(*readers, return_exceptions=True)
+    await db.close()
+
+    return {
+        'writes/s': len(latencies) / elapsed,
+        'reads/s': reads[0] / elapsed,
+        'p50 ms': statistics.median(latencies) * 1000 if latencies else 0.0,
+        'p95 ms': percentile(latencies, 0.95) * 1000 if latencies else 0.0,
+        'commits': commits[0],
+        'locked': errors['locked'],
+        'errors': errors['other'],
+    }
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="SQLite write throughput benchmark")
+    parser.add_argument("--downloads", type=int, default=500, help="تنزيلات وهمية")
+    parser.add_argument("--concurrency", type=int, default=50, help="تنزيلات متزامنة")
+    parser.add_argument("--heartbeats", type=int, default=4, help="نبضات لكل تنزيل")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--readers", type=int, default=4, help="قراء متزامنون")
+    parser.add_argument("--profile", choices=[name for name, _, _ in PROFILES], action='append')
+    args = parser.parse_args()
+
+    columns = ['writes/s', 'reads/s', 'p50 ms', 'p95 ms', 'commits', 'locked', 'errors']
+    print(f"{'profile':<12}" + ''.join(f"{column:>11}" for column in columns))
+    for name, tuning, single_writer in PROFILES:
+        if args.profile and name not in args.profile:
+            continue
+        result = asyncio.run(run_profile(tuning, single_writer, args))
+        print(f"{name:<12}" + ''.join(
+            f"{result[column]:>11.1f}" if isinstance(result[column], float) else f"{result[column]:>11}"
+            for column in columns
+        ))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,323 @@
+"""
+إدارة مساحة المخزن: فهرس دائم للملفات وإخلاء الأقدم استخداماً ضمن حصة محددة
+"""
+import asyncio
+import os
+import sqlite3
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from config import config
+from executors import InstrumentedExecutor
+from store import content_store
+import logging
+
+logger = logging.getLogger(__name__)
+
+class CacheIndex:
+    """فهرس SQLite لملفات المخزن: الحجم، وآخر استخدام، وعدد الإرسالات الجارية (pins)
+
+    يُستخدم من خيط واحد فقط (خيط المدير)، ويمكن لعدة عمليات مشاركة الملف نفسه، ولو على أجهزة مختلفة
+    عبر مجلد شبكي مع المخزن. لذلك يعمل بسجل التراجع (journal_mode=DELETE) الذي يعتمد على أقفال الملفات فقط؛
+    WAL يحتاج ذاكرة مشتركة لا تعمل بين الأجهزة.
+    """
+
+    def __init__(self, path: Path):
+        self.conn = sqlite3.connect(str(path), timeout=30, isolation_level=None, check_same_thread=False)
+        # يحوّل أيضاً الفهارس التي أنشأتها نسخ سابقة بوضع WAL
+        self.conn.execute("PRAGMA journal_mode=DELETE")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " path TEXT PRIMARY KEY,"
+            " size INTEGER NOT NULL,"
+            " last_access REAL NOT NULL,"
+            " pins INTEGER NOT NULL DEFAULT 0)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS ix_entries_lru ON entries (pins, last_access)")
+
+    def upsert(self, path: str, size: int, accessed: float):
+        self.conn.execute(
+            "INSERT INTO entries (path, size, last_access) VALUES (?, ?, ?) "
+            "ON CONFLICT(path) DO UPDATE SET size = excluded.size, last_access = excluded.last_access",
+            (path, size, accessed)
+        )
+
+    def touch(self, path: str, accessed: float) -> bool:
+        cursor = self.conn.execute("UPDATE entries SET last_access = ? WHERE path = ?", (accessed, path))
+        return cursor.rowcount > 0
+
+    def add_pin(self, path: str, delta: int, accessed: float):
+        self.conn.execute(
+            "UPDATE entries SET pins = MAX(pins + ?, 0), last_access = ? WHERE path = ?",
+            (delta, accessed, path)
+        )
+
+    def reset_pins(self):
+        self.conn.execute("UPDATE entries SET pins = 0 WHERE pins != 0")
+
+    def totals(self) -> Tuple[int, int, int]:
+        """(عدد الملفات، الحجم الكلي، الملفات المثبتة)"""
+        count, size, pinned = self.conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(pins > 0), 0) FROM entries"
+        ).fetchone()
+        return count, size, pinned
+
+    def oldest_unpinned(self, limit: int) -> List[Tuple[str, int]]:
+        return self.conn.execute(
+            "SELECT path, size FROM entries WHERE pins = 0 ORDER BY last_access LIMIT ?", (limit,)
+        ).fetchall()
+
+    def paths(self) -> List[str]:
+        return [row[0] for row in self.conn.execute("SELECT path FROM entries")]
+
+    def remove(self, paths: List[str]):
+        self.conn.executemany("DELETE FROM entries WHERE path = ?", [(path,) for path in paths])
+
+    def close(self):
+        self.conn.close()
+
+class DiskCacheManager:
+    """حصة بايتات للمخزن مع إخلاء LRU بين حدين (high/low watermark)
+
+    عند تجاوز الحد الأعلى تُحذف الملفات الأقدم استخداماً على دفعات حتى الحد الأدنى،
+    ولا يُحذف ملف مثبت (قيد الرفع إلى تليجرام). كل عمليات الفهرس ونظام الملفات
+    تعمل في خيط واحد خاص بالمدير وليس على حلقة الأحداث.
+    """
+
+    def __init__(self, root: Path, index_path: Path):
+        self.root = root
+        self.index_path = index_path
+        self.quota = config.CACHE_QUOTA_MB * 1024 * 1024
+        self.high = int(self.quota * config.CACHE_HIGH_WATERMARK)
+        self.low = int(self.quota * config.CACHE_LOW_WATERMARK)
+        self.executor = InstrumentedExecutor("cache", 1)
+        self._index: Optional[CacheIndex] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+
+    # --- داخل خيط المدير ---
+
+    def _get_index(self) -> CacheIndex:
+        if self._index is None:
+            self.index_path.parent.mkdir(parents=True, exist_ok=True)
+            self._index = CacheIndex(self.index_path)
+        return self._index
+
+    def _key(self, path: Path) -> Optional[str]:
+        """مسار الملف نسبة إلى المخزن، أو None إذا كان خارجه"""
+        try:
+            return str(Path(path).resolve().relative_to(self.root.resolve()))
+        except ValueError:
+            return None
+
+    def _record(self, path: Path) -> int:
+        key = self._key(path)
+        if key is None:
+            return 0
+        index = self._get_index()
+        index.upsert(key, Path(path).stat().st_size, time.time())
+        return index.totals()[1]
+
+    def _touch(self, path: Path):
+        key = self._key(path)
+        if key is not None and not self._get_index().touch(key, time.time()):
+            # ملف سبق الفهرس (من نسخة أقدم أو عامل لم يسجله)
+            self._record(path)
+
+    def _pin(self, path: Path, delta: int):
+        key = self._key(path)
+        if key is not None:
+            self._get_index().add_pin(key, delta, time.time())
+
+    def _evict_batch(self, target: int) -> Tuple[int, int]:
+        """حذف دفعة من الأقدم استخداماً حتى يصل الحجم إلى target؛ يُرجع (العدد، البايتات)"""
+        index = self._get_index()
+        _, total, _ = index.totals()
+        removed, freed = [], 0
+
+        for key, size in index.oldest_unpinned(config.CACHE_EVICT_BATCH):
+            if total - freed <= target:
+                break
+            path = self.root / key
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Could not evict {path}: {e}")
+                continue
+            self._prune_empty_dirs(path.parent)
+            removed.append(key)
+            freed += size
+
+        index.remove(removed)
+        return len(removed), freed
+
+    def _prune_empty_dirs(self, directory: Path):
+        """حذف مجلدات <video_id>/<format> الفارغة بعد الإخلاء"""
+        while directory != self.root and self.root in directory.parents:
+            try:
+                directory.rmdir()
+            except OSError:
+                return
+            directory = directory.parent
+
+    def _reconcile(self) -> Tuple[int, int]:
+        """مطابقة الفهرس مع المخزن: إضافة الملفات غير المفهرسة وحذف سجلات الملفات المفقودة"""
+        index = self._get_index()
+        known = set(index.paths())
+        added = 0
+
+        for directory, dirs, files in os.walk(self.root):
+            # المجلدات المخفية (.staging) ليست جزءاً من المخزن
+            dirs[:] = [name for name in dirs if not name.startswith('.')]
+            for name in files:
+                path = Path(directory) / name
+                if name.startswith('.'):
+                    continue
+                key = self._key(path)
+                if key in known:
+                    known.discard(key)
+                    continue
+                stat = path.stat()
+                index.upsert(key, stat.st_size, stat.st_mtime)
+                added += 1
+
+        index.remove(list(known))
+        return added, len(known)
+
+    def _sweep_partials(self) -> int:
+        """حذف الملفات الجزئية المهملة بعد مهلة الاستئناف، وبقايا التقسيم"""
+        cutoff = time.time() - config.RESUME_RETENTION_HOURS * 3600
+        removed = 0
+        for root in (content_store.staging_root, config.DOWNLOAD_PATH / ".split"):
+            if not root.is_dir():
+                continue
+            for directory, _, files in os.walk(root):
+                for name in files:
+                    path = Path(directory) / name
+                    try:
+                        if name != '.lock' and path.stat().st_mtime < cutoff:
+                            path.unlink()
+                            removed += 1
+                    except OSError:
+                        pass
+        return removed
+
+    def _stats(self) -> Tuple[int, int, int]:
+        return self._get_index().totals()
+
+    # --- واجهة حلقة الأحداث ---
+
+    async def _call(self, fn, *args):
+        return await asyncio.get_event_loop().run_in_executor(self.executor, fn, *args)
+
+    async def record(self, path: Path):
+        """تسجيل ملف أُضيف للمخزن، وطلب الإخلاء إذا تجاوز الحجم الحد الأعلى"""
+        try:
+            total = await self._call(self._record, path)
+        except Exception as e:
+            logger.warning(f"Could not index {path}: {e}")
+            return
+        if total > self.high and self._wakeup:
+            self._wakeup.set()
+
+    async def hit(self, path: Path):
+        """طلب خُدم من المخزن"""
+        self.hits += 1
+        try:
+            await self._call(self._touch, path)
+        except Exception as e:
+            logger.warning(f"Could not update cache access for {path}: {e}")
+
+    def miss(self):
+        """طلب احتاج إلى تنزيل جديد"""
+        self.misses += 1
+
+    async def _safe_pin(self, path, delta: int):
+        try:
+            await self._call(self._pin, path, delta)
+        except Exception as e:
+            logger.warning(f"Could not update pin for {path}: {e}")
+
+    @asynccontextmanager
+    async def pinned(self, path):
+        """منع إخلاء الملف أثناء رفعه"""
+        await self._safe_pin(path, 1)
+        try:
+            yield
+        finally:
+            await self._safe_pin(path, -1)
+
+    async def evict(self) -> int:
+        """الإخلاء على دفعات حتى الحد الأدنى إذا تجاوز الحجم الحد الأعلى"""
+        _, total, _ = await self._call(self._stats)
+        if total <= self.high:
+            return 0
+
+        evicted = 0
+        while total > self.low:
+            count, freed = await self._call(self._evict_batch, self.low)
+            if not count:
+                logger.warning("Cache over quota but every remaining file is pinned")
+                break
+            evicted += count
+            total -= freed
+            self.evictions += count
+            self.evicted_bytes += freed
+
+        logger.info(f"Evicted {evicted} cached files, store size now {total} bytes")
+        return evicted
+
+    async def run(self):
+        """مهمة الخلفية: مطابقة الفهرس عند البدء، ثم إخلاء دوري أو عند الطلب"""
+        self._wakeup = asyncio.Event()
+        await self._call(lambda: self._get_index().reset_pins())
+        added, dropped = await self._call(self._reconcile)
+        if added or dropped:
+            logger.info(f"Cache index reconciled: {added} added, {dropped} missing")
+
+        while True:
+            try:
+                await self.evict()
+                swept = await self._call(self._sweep_partials)
+                if swept:
+                    logger.info(f"Deleted {swept} stale partial files")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Cache maintenance failed: {e}")
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=config.CACHE_SWEEP_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def stats(self) -> Dict[str, Any]:
+        """مقاييس المخزن: الحجم والحصة ونسبة الإصابة والإخلاء"""
+        count, size, pinned = await self._call(self._stats)
+        requests = self.hits + self.misses
+        return {
+            'entries': count,
+            'size': size,
+            'quota': self.quota,
+            'pinned': pinned,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests else 0.0,
+            'evictions': self.evictions,
+            'evicted_bytes': self.evicted_bytes
+        }
+
+    def shutdown(self):
+        if self._index:
+            self.executor.submit(self._index.close)
+        self.executor.shutdown(wait=True)
+
+# مثيل عام من مدير المخزن
+disk_cache = DiskCacheManager(config.STORE_PATH, config.CACHE_INDEX_PATH)
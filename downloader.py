@@ -2,18 +2,32 @@
 محرك التنزيل الرئيسي
 """
 import asyncio
+import copy
 import os
 import re
+import shutil
+from concurrent.futures import Future
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Dict, List, Optional, Any, Union, Callable
+from typing import Dict, List, Optional, Any, Set, Union, Callable, Tuple, Awaitable
 import yt_dlp
 import aiofiles
-from concurrent.futures import ThreadPoolExecutor
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import validators
 import humanize
 from config import config
 from database import db, Download, PlaylistDownload
+from cancellation import CancelToken, DownloadCancelled
+from cache import TTLCache, metadata_cache, canonical_video_id
+from store import content_store, subtitle_key
+from disk_cache import disk_cache
+from bandwidth import bandwidth
+from executors import InstrumentedExecutor
+from progress import CombinedProgress, DownloadProgress, PlaylistProgress, ProgressBridge, ThrottledProgress
+from scheduler import FairScheduler, download_lane
+from formats import DownloadPlan, FormatSelection, TranscodeSpec, downgrade_to_fit, plan_download
+from media import STOP_FILE, mux_streams, transcode_to_fit
 import logging
 
 logger = logging.getLogger(__name__)
@@ -36,6 +50,124 @@ class VideoInfo:
     url: str
     webpage_url: str
 
+class VideoSummary:
+    """ملخص مضغوط لمعلومات الفيديو يُحسب مرة واحدة عند الاستخراج
+
+    يحتوي فقط على ما تحتاجه المعاينة والتنزيل (سلم الجودات ولغات الترجمة)،
+    أما المعلومات الكاملة فتُحمّل عند الحاجة من الذاكرة المؤقتة عبر load_full.
+    """
+    __slots__ = (
+        'id', 'title', 'duration', 'uploader', 'upload_date', 'view_count',
+        'thumbnail', 'url', 'webpage_url', 'qualities', 'subtitles'
+    )
+
+    def __init__(
+        self,
+        id: str,
+        title: str,
+        duration: int,
+        uploader: str,
+        upload_date: str,
+        view_count: int,
+        thumbnail: str,
+        url: str,
+        webpage_url: str,
+        qualities: List[Dict],
+        subtitles: Dict[str, Dict]
+    ):
+        self.id = id
+        self.title = title
+        self.duration = duration
+        self.uploader = uploader
+        self.upload_date = upload_date
+        self.view_count = view_count
+        self.thumbnail = thumbnail
+        self.url = url
+        self.webpage_url = webpage_url
+        self.qualities = qualities
+        self.subtitles = subtitles
+
+    @classmethod
+    def from_info(cls, info: Dict, url: str) -> "VideoSummary":
+        """بناء الملخص من معلومات yt-dlp الخام"""
+        return cls(
+            id=info.get('id', ''),
+            title=info.get('title', 'Unknown'),
+            duration=info.get('duration') or 0,
+            uploader=info.get('uploader', 'Unknown'),
+            upload_date=info.get('upload_date', ''),
+            view_count=info.get('view_count') or 0,
+            thumbnail=info.get('thumbnail', ''),
+            url=url,
+            webpage_url=info.get('webpage_url', url),
+            qualities=build_quality_ladder(info.get('formats') or []),
+            subtitles=build_subtitle_languages(
+                info.get('subtitles') or {}, info.get('automatic_captions') or {}
+            )
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "VideoSummary":
+        return cls(**{name: data.get(name) for name in cls.__slots__})
+
+    async def load_full(self) -> Optional[VideoInfo]:
+        """المعلومات الكاملة (من الذاكرة المؤقتة أو بإعادة الاستخراج)"""
+        return await downloader.extract_video_info(self.url)
+
+def build_quality_ladder(formats: List[Dict]) -> List[Dict]:
+    """سلم الجودات المتاحة من قائمة صيغ yt-dlp"""
+    qualities = []
+    seen_heights = set()
+    
+    for fmt in formats:
+        height = fmt.get('height')
+        if height and height not in seen_heights:
+            quality = f"{height}p"
+            if quality in config.AVAILABLE_QUALITIES:
+                qualities.append({
+                    'quality': quality,
+                    'format_id': fmt.get('format_id'),
+                    'ext': fmt.get('ext', 'mp4'),
+                    'filesize': fmt.get('filesize', 0),
+                    'fps': fmt.get('fps'),
+                    'vcodec': fmt.get('vcodec'),
+                    'acodec': fmt.get('acodec')
+                })
+                seen_heights.add(height)
+    
+    # ترتيب حسب الجودة
+    quality_order = {q: i for i, q in enumerate(config.AVAILABLE_QUALITIES)}
+    qualities.sort(key=lambda x: quality_order.get(x['quality'], 999))
+    
+    return qualities
+
+def build_subtitle_languages(subtitles: Dict[str, List], automatic_captions: Dict[str, List]) -> Dict[str, Dict]:
+    """لغات الترجمة المدعومة المتاحة (الأصلية أولاً ثم التلقائية)"""
+    available_subs = {}
+    
+    # الترجمات الأصلية
+    for lang, subs in subtitles.items():
+        if lang in config.SUPPORTED_LANGUAGES:
+            available_subs[lang] = {
+                'type': 'manual',
+                'language': config.SUPPORTED_LANGUAGES[lang],
+                'formats': [sub.get('ext', 'srt') for sub in subs]
+            }
+    
+    # الترجمات التلقائية
+    for lang, subs in automatic_captions.items():
+        if lang in config.SUPPORTED_LANGUAGES and lang not in available_subs:
+            available_subs[lang] = {
+                'type': 'auto',
+                'language': config.SUPPORTED_LANGUAGES[lang],
+                'formats': [sub.get('ext', 'srt') for sub in subs]
+            }
+    
+    return available_subs
+
 @dataclass
 class PlaylistInfo:
     """معلومات قائمة التشغيل"""
@@ -45,23 +177,74 @@ class PlaylistInfo:
     entries: List[Dict]
     webpage_url: str
 
+class AdmissionRejected(Exception):
+    """رفض التنزيل قبل بدئه؛ نص الاستثناء رسالة موجهة للمستخدم"""
+    
+    def __init__(self, message: str, decision: Dict[str, Any]):
+        super().__init__(message)
+        self.decision = decision
+
 @dataclass
-class DownloadProgress:
-    """معلومات تقدم التنزيل"""
-    downloaded_bytes: int
-    total_bytes: int
-    speed: float
-    eta: int
-    percent: float
-    filename: str
+class Admission:
+    """قرار قبول التنزيل: الجودة والخطة النهائيتان والمساحة المحجوزة لهما"""
+    quality: str
+    plan: DownloadPlan
+    decision: Dict[str, Any]
+    reserved: int = 0
+
+@dataclass
+class InFlightDownload:
+    """تنزيل جارٍ يشترك فيه عدة مستخدمين"""
+    directory: Path  # المجلد المؤقت قبل النقل إلى المخزن
+    bridge: ProgressBridge
+    task: Optional[asyncio.Future] = None
+    waiters: int = 0
+    token: CancelToken = field(default_factory=CancelToken)  # يُلغى عند المهلة أو مغادرة آخر منتظر
 
 class YouTubeDownloader:
     """فئة تنزيل الفيديوهات من YouTube"""
     
     def __init__(self):
-        self.executor = ThreadPoolExecutor(max_workers=config.MAX_CONCURRENT_DOWNLOADS)
-        self.active_downloads: Dict[int, bool] = {}
+        # مجمعات منفصلة حتى لا تحجب التنزيلات الطويلة استخراج المعلومات السريع
+        self.extract_executor = InstrumentedExecutor("extract", config.EXTRACT_WORKERS)
+        self.download_executor = InstrumentedExecutor("download", config.DOWNLOAD_WORKERS)
+        self.subtitle_executor = InstrumentedExecutor("subtitle", config.SUBTITLE_WORKERS)
+        self.postprocess_executor = InstrumentedExecutor("postprocess", config.POSTPROCESS_WORKERS)
+        self.media_executor = InstrumentedExecutor("media", config.MEDIA_WORKERS, processes=True)
+        # رموز الإلغاء للتنزيلات الجارية لكل مستخدم (يستخدمها /cancel)
+        self.active_downloads: Dict[int, Set[CancelToken]] = {}
+        self._inflight: Dict[Tuple[str, str, str], InFlightDownload] = {}
+        # أعمال المجمعات التي تكتب في كل مجلد مؤقت (تُنتظر قبل حذفه)
+        self._staged_work: Dict[Path, List[Future]] = {}
+        self._summaries = TTLCache(config.METADATA_CACHE_SIZE, config.METADATA_CACHE_TTL)
+        # خانات التنزيل موزعة بالعدل بين المستخدمين بدلاً من ترتيب الوصول
+        self.scheduler = FairScheduler(config.MAX_CONCURRENT_DOWNLOADS)
+        self._premium_users = TTLCache(config.METADATA_CACHE_SIZE, config.METADATA_CACHE_TTL)
+        # المساحة المحجوزة للتنزيلات المقبولة التي لم تكتمل بعد
+        self._reserved_bytes = 0
+        self._disk_released: Optional[asyncio.Condition] = None
         
+    @contextmanager
+    def track(self, user_id: int, token: CancelToken):
+        """تسجيل رمز إلغاء لتنزيل جارٍ حتى يصل إليه cancel_user"""
+        tokens = self.active_downloads.setdefault(user_id, set())
+        tokens.add(token)
+        try:
+            yield token
+        finally:
+            tokens.discard(token)
+            if not tokens:
+                self.active_downloads.pop(user_id, None)
+
+    def cancel_user(self, user_id: int, reason: str = 'user') -> int:
+        """إلغاء كل تنزيلات المستخدم الجارية في هذه العملية؛ يُرجع عددها"""
+        tokens = list(self.active_downloads.get(user_id, ()))
+        for token in tokens:
+            token.cancel(reason)
+        if tokens:
+            logger.info(f"Cancelled {len(tokens)} downloads for user {user_id}")
+        return len(tokens)
+
     def _get_ytdl_opts(self, custom_opts: Dict = None) -> Dict:
         """الحصول على خيارات YT-DLP"""
         opts = config.YTDL_OPTS.copy()
@@ -69,23 +252,10 @@ class YouTubeDownloader:
             opts.update(custom_opts)
         return opts
     
-    async def extract_video_info(self, url: str) -> Optional[VideoInfo]:
-        """استخراج معلومات الفيديو"""
+    async def extract_video_info(self, url: str, use_cache: bool = True) -> Optional[VideoInfo]:
+        """استخراج معلومات الفيديو (مع الاستفادة من الذاكرة المؤقتة)"""
         try:
-            loop = asyncio.get_event_loop()
-            
-            opts = self._get_ytdl_opts({
-                'quiet': True,
-                'no_warnings': True,
-                'extract_flat': False
-            })
-            
-            with yt_dlp.YoutubeDL(opts) as ydl:
-                info = await loop.run_in_executor(
-                    self.executor,
-                    lambda: ydl.extract_info(url, download=False)
-                )
-            
+            info = await self._get_raw_info(url, use_cache)
             if not info:
                 return None
             
@@ -110,6 +280,74 @@ class YouTubeDownloader:
             logger.error(f"Failed to extract video info: {e}")
             return None
     
+    async def extract_video_summary(self, url: str, use_cache: bool = True) -> Optional[VideoSummary]:
+        """ملخص الفيديو المضغوط؛ يُحسب مرة واحدة لكل فيديو ثم يُعاد استخدامه"""
+        video_id = canonical_video_id(url)
+        if use_cache and video_id:
+            summary = self._summaries.get(video_id)
+            if summary:
+                return summary
+        
+        try:
+            info = await self._get_raw_info(url, use_cache)
+            if not info:
+                return None
+            
+            summary = VideoSummary.from_info(info, url)
+            self._summaries.set(summary.id, summary)
+            return summary
+            
+        except Exception as e:
+            logger.error(f"Failed to extract video info: {e}")
+            return None
+    
+    async def _get_raw_info(self, url: str, use_cache: bool = True) -> Optional[Dict]:
+        """الحصول على معلومات yt-dlp الخام من الذاكرة المؤقتة أو باستخراجها"""
+        video_id = canonical_video_id(url)
+        if use_cache and video_id:
+            info = await metadata_cache.get(video_id)
+            if info:
+                return info
+        
+        loop = asyncio.get_event_loop()
+        
+        opts = self._get_ytdl_opts({
+            'quiet': True,
+            'no_warnings': True,
+            'extract_flat': False
+        })
+        
+        with yt_dlp.YoutubeDL(opts) as ydl:
+            info = await loop.run_in_executor(
+                self.extract_executor,
+                lambda: ydl.sanitize_info(ydl.extract_info(url, download=False))
+            )
+        
+        if info and info.get('id'):
+            await metadata_cache.set(info['id'], info)
+        
+        return info
+    
+    def _run_ydl_download(self, opts: Dict, url: str, info: Optional[Dict] = None):
+        """تشغيل التنزيل (داخل خيط منفصل)، مع إعادة استخدام المعلومات المستخرجة مسبقاً
+        
+        التنزيل يُسجل في مدير عرض النطاق من بدئه الفعلي حتى انتهائه، وyt-dlp يقرأ
+        ratelimit من opts نفسه فتصل إليه إعادة توزيع الحصص أثناء التنزيل.
+        """
+        def run():
+            with yt_dlp.YoutubeDL(opts) as ydl:
+                if info:
+                    ydl.process_ie_result(copy.deepcopy(info), download=True)
+                else:
+                    ydl.download([url])
+        
+        if opts.get('skip_download'):  # الترجمات لا تُحتسب من عرض النطاق
+            return run()
+        
+        with bandwidth.lease(opts) as lease:
+            opts['progress_hooks'] = [lease.hook(hook) for hook in opts.get('progress_hooks', [])] or [lease.hook()]
+            run()
+    
     async def extract_playlist_info(self, url: str) -> Optional[PlaylistInfo]:
         """استخراج معلومات قائمة التشغيل"""
         try:
@@ -123,7 +361,7 @@ class YouTubeDownloader:
             
             with yt_dlp.YoutubeDL(opts) as ydl:
                 info = await loop.run_in_executor(
-                    self.executor,
+                    self.extract_executor,
                     lambda: ydl.extract_info(url, download=False)
                 )
             
@@ -161,241 +399,434 @@ class YouTubeDownloader:
             minutes = (seconds % 3600) // 60
             return f"{hours}س {minutes}د"
     
-    def get_available_qualities(self, video_info: VideoInfo) -> List[Dict]:
+    def get_available_qualities(self, video_info: Union[VideoInfo, VideoSummary]) -> List[Dict]:
         """الحصول على الجودات المتاحة"""
-        qualities = []
-        seen_heights = set()
-        
-        for fmt in video_info.formats:
-            height = fmt.get('height')
-            if height and height not in seen_heights:
-                quality = f"{height}p"
-                if quality in config.AVAILABLE_QUALITIES:
-                    qualities.append({
-                        'quality': quality,
-                        'format_id': fmt.get('format_id'),
-                        'ext': fmt.get('ext', 'mp4'),
-                        'filesize': fmt.get('filesize', 0),
-                        'fps': fmt.get('fps'),
-                        'vcodec': fmt.get('vcodec'),
-                        'acodec': fmt.get('acodec')
-                    })
-                    seen_heights.add(height)
-        
-        # ترتيب حسب الجودة
-        quality_order = {q: i for i, q in enumerate(config.AVAILABLE_QUALITIES)}
-        qualities.sort(key=lambda x: quality_order.get(x['quality'], 999))
-        
-        return qualities
-    
-    def get_available_subtitles(self, video_info: VideoInfo) -> Dict[str, List]:
+        if isinstance(video_info, VideoSummary):
+            return video_info.qualities
+        return build_quality_ladder(video_info.formats)
+    
+    def get_available_subtitles(self, video_info: Union[VideoInfo, VideoSummary]) -> Dict[str, Dict]:
         """الحصول على الترجمات المتاحة"""
-        available_subs = {}
-        
-        # الترجمات الأصلية
-        for lang, subs in video_info.subtitles.items():
-            if lang in config.SUPPORTED_LANGUAGES:
-                available_subs[lang] = {
-                    'type': 'manual',
-                    'language': config.SUPPORTED_LANGUAGES[lang],
-                    'formats': [sub.get('ext', 'srt') for sub in subs]
-                }
-        
-        # الترجمات التلقائية
-        for lang, subs in video_info.automatic_captions.items():
-            if lang in config.SUPPORTED_LANGUAGES and lang not in available_subs:
-                available_subs[lang] = {
-                    'type': 'auto',
-                    'language': config.SUPPORTED_LANGUAGES[lang],
-                    'formats': [sub.get('ext', 'srt') for sub in subs]
-                }
-        
-        return available_subs
+        if isinstance(video_info, VideoSummary):
+            return video_info.subtitles
+        return build_subtitle_languages(video_info.subtitles, video_info.automatic_captions)
     
     async def download_video(
         self,
         url: str,
         quality: str,
         user_id: int,
-        progress_callback: Optional[Callable[[DownloadProgress], None]] = None
+        progress_callback: Optional[Callable[[DownloadProgress], None]] = None,
+        video_info: Optional[Union[VideoInfo, VideoSummary]] = None,
+        download_id: Optional[int] = None,
+        cancel_token: Optional[CancelToken] = None
     ) -> Optional[str]:
-        """تنزيل الفيديو"""
+        """تنزيل الفيديو (download_id لاستئناف سجل تنزيل متوقف)
+        
+        يرفع DownloadCancelled عند إلغاء cancel_token أو انتهاء مهلته.
+        """
+        if cancel_token is None:
+            # طلب مستقل: رمز خاص به بمهلة التنزيل
+            with self.track(user_id, CancelToken(config.DOWNLOAD_TIMEOUT)) as token:
+                return await self.download_video(
+                    url, quality, user_id, progress_callback, video_info, download_id, token
+                )
         
         download_record = None
+        admission = None
         try:
-            # استخراج معلومات الفيديو
-            video_info = await self.extract_video_info(url)
+            # استخراج معلومات الفيديو (إن لم تُمرر مسبقاً)
+            if not video_info:
+                video_info = await cancel_token.run(self.extract_video_summary(url))
             if not video_info:
                 raise Exception("Failed to extract video information")
             
-            # إنشاء سجل التنزيل
-            download_record = await db.create_download({
-                'user_id': user_id,
-                'url': url,
-                'title': video_info.title,
-                'video_id': video_info.id,
-                'quality': quality,
-                'duration': video_info.duration,
-                'download_type': 'video',
-                'metadata': {
-                    'uploader': video_info.uploader,
-                    'view_count': video_info.view_count,
-                    'upload_date': video_info.upload_date
-                }
-            })
+            # إنشاء سجل التنزيل، أو إعادة استخدام السجل المتوقف
+            if download_id:
+                download_record = await db.get_download(download_id)
+            if not download_record:
+                download_record = await db.create_download({
+                    'user_id': user_id,
+                    'url': url,
+                    'title': video_info.title,
+                    'video_id': video_info.id,
+                    'quality': quality,
+                    'duration': video_info.duration,
+                    'download_type': 'video',
+                    'file_metadata': {
+                        'uploader': video_info.uploader,
+                        'view_count': video_info.view_count,
+                        'upload_date': video_info.upload_date
+                    }
+                })
             
-            # تحديث حالة التنزيل
-            await db.update_download_status(download_record.id, 'downloading')
+            async with self._journal_heartbeat(download_record.id):
+                # الصيغة وإعادة الترميز والقبول تتحدد قبل تنزيل أي بايت
+                plan = await self.plan_video(video_info, quality)
+                try:
+                    admission = await cancel_token.run(self.admit_video(video_info, quality, plan))
+                except AdmissionRejected as e:
+                    await db.update_download_status(
+                        download_record.id,
+                        'rejected',
+                        error_message=str(e),
+                        file_metadata={**(download_record.file_metadata or {}), 'admission': e.decision}
+                    )
+                    raise
+                
+                await db.update_download_status(
+                    download_record.id,
+                    'downloading',
+                    heartbeat_at=datetime.now(timezone.utc),
+                    file_metadata={**(download_record.file_metadata or {}), 'admission': admission.decision}
+                )
+                
+                # من المخزن المشترك، أو تنزيل واحد للطلبات المتزامنة لنفس الفيديو والجودة
+                fetch_quality, plan = admission.quality, admission.plan
+                file_path = await cancel_token.run(self._shared_download(
+                    video_info.id, plan.store_key(fetch_quality, config.UPLOAD_LIMIT_MB), 'video',
+                    lambda flight_dir, hook: self._fetch_video(url, video_info, fetch_quality, flight_dir, hook, plan),
+                    user_id,
+                    progress_callback,
+                    cancel_token
+                ))
+            file_size = file_path.stat().st_size
             
-            # تحديد مجلد التنزيل
-            user_dir = config.DOWNLOAD_PATH / str(user_id)
-            user_dir.mkdir(exist_ok=True)
+            # سجل التنزيل وإحصائيات المستخدم في معاملة واحدة
+            await db.complete_download(download_record.id, user_id, str(file_path), file_size)
             
-            # إعداد خيارات التنزيل
-            output_template = str(user_dir / f"{video_info.title}.%(ext)s")
+            return str(file_path)
+        
+        except AdmissionRejected as e:
+            logger.info(f"Download rejected before start: {e.decision}")
+            raise
+        except DownloadCancelled as e:
+            logger.info(f"Download cancelled: {e.reason}")
+            if download_record:
+                await db.update_download_status(download_record.id, 'cancelled', error_message=e.reason)
+            raise
+        except Exception as e:
+            logger.error(f"Download failed: {e}")
+            if download_record:
+                await db.update_download_status(
+                    download_record.id,
+                    'failed',
+                    error_message=str(e)
+                )
+            return None
+        finally:
+            if admission:
+                await self._release_disk(admission.reserved)
+    
+    async def admit_video(
+        self,
+        video_info: Union[VideoInfo, VideoSummary],
+        quality: str,
+        plan: DownloadPlan
+    ) -> Admission:
+        """قبول التنزيل قبل بدئه: كما هو، أو بجودة أقل، أو بعد انتظار المساحة، أو الرفض
+        
+        يعتمد على الحجم المقدر للصيغة المختارة (المعلن، أو التقريبي، أو معدل البت × المدة)
+        والمساحة الحرة في DOWNLOAD_PATH بعد خصم ما حُجز للتنزيلات الجارية.
+        """
+        decision = {'requested_quality': quality, 'estimated_size': plan.estimated_size}
+        
+        def reject(reason: str, message: str):
+            decision.update(decision='rejected', reason=reason)
+            raise AdmissionRejected(message, decision)
+        
+        if config.MAX_VIDEO_DURATION and (video_info.duration or 0) > config.MAX_VIDEO_DURATION:
+            reject('duration', config.Messages.ERROR_VIDEO_TOO_LONG.format(
+                max_minutes=config.MAX_VIDEO_DURATION // 60
+            ))
+        
+        # ملف موجود في المخزن أو تنزيل جارٍ لنفس المفتاح لا يحتاج إلى مساحة جديدة
+        store_key = plan.store_key(quality, config.UPLOAD_LIMIT_MB)
+        if content_store.lookup(video_info.id, store_key) or (video_info.id, store_key, 'video') in self._inflight:
+            decision.update(decision='accepted', reason='shared')
+            return Admission(quality, plan, decision)
+        
+        max_bytes = config.MAX_FILE_SIZE * 1024 * 1024
+        if plan.selection and plan.estimated_size and plan.estimated_size > max_bytes:
+            raw_info = await metadata_cache.get(video_info.id)
+            lower = downgrade_to_fit(
+                (raw_info or {}).get('formats') or [], plan.selection, video_info.duration, max_bytes
+            )
+            if not lower:
+                reject('size', config.Messages.ERROR_FILE_TOO_LARGE.format(max_size=config.MAX_FILE_SIZE))
             
-            # تنظيف اسم الملف
-            safe_title = re.sub(r'[<>:"/\\|?*]', '_', video_info.title)
-            output_template = str(user_dir / f"{safe_title}.%(ext)s")
+            logger.info(f"Downgrading {video_info.id} from {quality} to {lower} to stay under MAX_FILE_SIZE")
+            quality, plan = lower, await self.plan_video(video_info, lower)
+            decision.update(quality=quality, estimated_size=plan.estimated_size, reason='size')
+        
+        needed = self._disk_needed(plan)
+        reserve = config.DISK_RESERVE_MB * 1024 * 1024
+        condition = self._get_disk_condition()
+        
+        async with condition:
+            if needed + reserve > self._free_disk_bytes() + self._reserved_bytes:
+                # لن يتسع حتى بعد اكتمال التنزيلات الجارية
+                reject('disk', config.Messages.ERROR_DISK_FULL)
+            
+            if needed + reserve > self._free_disk_bytes() - self._reserved_bytes:
+                decision['waited'] = True
+                logger.info(f"Waiting for disk space for {video_info.id} ({self._format_size(needed)})")
+                try:
+                    await asyncio.wait_for(
+                        condition.wait_for(
+                            lambda: needed + reserve <= self._free_disk_bytes() - self._reserved_bytes
+                        ),
+                        timeout=config.ADMISSION_WAIT_TIMEOUT
+                    )
+                except asyncio.TimeoutError:
+                    reject('disk', config.Messages.ERROR_DISK_FULL)
+            
+            self._reserved_bytes += needed
+        
+        decision.setdefault('decision', 'downgraded' if decision.get('quality') else 'accepted')
+        return Admission(quality, plan, decision, reserved=needed)
+    
+    def _disk_needed(self, plan: DownloadPlan) -> int:
+        """المساحة المؤقتة للتنزيل: المساران المنفصلان مع الملف المدموج، ونسخة إعادة الترميز"""
+        size = plan.estimated_size or 0
+        if plan.selection and plan.selection.merged:
+            size *= 2
+        if plan.transcode:
+            size += config.UPLOAD_LIMIT_MB * 1024 * 1024
+        return size
+    
+    def _free_disk_bytes(self) -> int:
+        return shutil.disk_usage(config.DOWNLOAD_PATH).free
+    
+    def _get_disk_condition(self) -> asyncio.Condition:
+        """شرط انتظار تحرر المساحة (يُنشأ داخل حلقة الأحداث)"""
+        if self._disk_released is None:
+            self._disk_released = asyncio.Condition()
+        return self._disk_released
+    
+    async def _release_disk(self, reserved: int):
+        if not reserved:
+            return
+        condition = self._get_disk_condition()
+        async with condition:
+            self._reserved_bytes -= reserved
+            condition.notify_all()
+    
+    async def _fetch_video(
+        self,
+        url: str,
+        video_info: Union[VideoInfo, VideoSummary],
+        quality: str,
+        output_dir: Path,
+        progress_hook: Optional[Callable[[Dict], None]] = None,
+        plan: Optional[DownloadPlan] = None
+    ) -> Path:
+        """تنزيل ملف الفيديو فعلياً إلى مجلد محدد"""
+        
+        # تنظيف اسم الملف
+        safe_title = re.sub(r'[<>:"/\\|?*]', '_', video_info.title)
+        
+        # الصيغة من المعلومات المخزنة (بدون إعادة الاستخراج)
+        raw_info = await metadata_cache.get(video_info.id)
+        if plan is None:
+            plan = await self.plan_video(video_info, quality)
+        selection = plan.selection if raw_info else None
+        
+        if selection and selection.merged:
+            file_path = await self._fetch_merged(url, raw_info, selection, safe_title, output_dir, progress_hook)
+        else:
+            if selection:
+                format_spec = selection.format_spec
+            else:
+                format_spec = f'best[height<={quality[:-1]}]' if quality != 'best' else 'best'
             
             opts = self._get_ytdl_opts({
-                'format': f'best[height<={quality[:-1]}]' if quality != 'best' else 'best',
-                'outtmpl': output_template,
+                'format': format_spec,
+                'outtmpl': str(output_dir / f"{safe_title}.%(ext)s"),
+                'continuedl': True,  # استئناف الملفات الجزئية بعد إعادة التشغيل
+                'max_filesize': config.MAX_FILE_SIZE * 1024 * 1024,  # إيقاف التنزيل فور تجاوز الحد
                 'writesubtitles': False,
                 'writeautomaticsub': False
             })
             
-            # إضافة callback للتقدم
-            if progress_callback:
-                def progress_hook(d):
-                    if d['status'] == 'downloading':
-                        progress = DownloadProgress(
-                            downloaded_bytes=d.get('downloaded_bytes', 0),
-                            total_bytes=d.get('total_bytes', 0),
-                            speed=d.get('speed', 0),
-                            eta=d.get('eta', 0),
-                            percent=d.get('_percent_str', '0%').replace('%', ''),
-                            filename=d.get('filename', '')
-                        )
-                        asyncio.create_task(self._async_progress_callback(progress_callback, progress))
-                
+            # خطاف التقدم (يعمل داخل خيط التنزيل)
+            if progress_hook:
                 opts['progress_hooks'] = [progress_hook]
             
-            # تنزيل الفيديو
-            loop = asyncio.get_event_loop()
-            
-            with yt_dlp.YoutubeDL(opts) as ydl:
-                await loop.run_in_executor(
-                    self.executor,
-                    lambda: ydl.download([url])
-                )
+            await self._run_staged(
+                output_dir, self.download_executor,
+                self._run_ydl_download, opts, url, raw_info
+            )
             
             # البحث عن الملف المُنزل
-            downloaded_files = list(user_dir.glob(f"{safe_title}.*"))
+            downloaded_files = content_store.list_files(output_dir)
             if not downloaded_files:
-                raise Exception("Downloaded file not found")
-            
+                # yt-dlp يتخطى الصيغة أو يوقف تنزيلها بصمت عند تجاوز max_filesize
+                raise Exception(f"Downloaded file not found (limit {config.MAX_FILE_SIZE} MB)")
             file_path = downloaded_files[0]
-            file_size = file_path.stat().st_size
-            
-            # التحقق من حجم الملف
-            if file_size > config.MAX_FILE_SIZE * 1024 * 1024:
-                file_path.unlink()  # حذف الملف
-                raise Exception(f"File too large: {self._format_size(file_size)}")
-            
-            # تحديث سجل التنزيل
-            await db.update_download_status(
-                download_record.id,
-                'completed',
-                file_path=str(file_path),
-                file_size=file_size
+        
+        if plan.transcode:
+            file_path = await self._transcode_to_fit(file_path, plan.transcode, safe_title)
+        
+        file_size = file_path.stat().st_size
+        
+        # التحقق من حجم الملف
+        if file_size > config.MAX_FILE_SIZE * 1024 * 1024:
+            file_path.unlink()  # حذف الملف
+            raise Exception(f"File too large: {self._format_size(file_size)}")
+        
+        return file_path
+    
+    async def plan_video(self, video_info: Union[VideoInfo, VideoSummary], quality: str) -> DownloadPlan:
+        """خطة التنزيل من قائمة الصيغ المخزنة: الصيغة المختارة وهل تحتاج إلى إعادة ترميز"""
+        raw_info = await metadata_cache.get(video_info.id)
+        formats = (raw_info.get('formats') or []) if raw_info else []
+        budget = config.UPLOAD_LIMIT_MB * 1024 * 1024 if config.TRANSCODE_TO_FIT else None
+        return plan_download(formats, quality, video_info.duration, budget, config.TRANSCODE_AUDIO_BITRATE)
+    
+    async def _transcode_to_fit(self, file_path: Path, spec: TranscodeSpec, safe_title: str) -> Path:
+        """إعادة ترميز الملف في مجمع العمليات حتى يتسع في حد الرفع"""
+        budget = config.UPLOAD_LIMIT_MB * 1024 * 1024
+        output_path = file_path.with_name("transcoding.mp4")
+        
+        video_kbps = spec.video_kbps
+        for _ in range(2):
+            logger.info(f"Transcoding {file_path.name} to {video_kbps}k (height={spec.height or 'source'})")
+            await self._run_staged(
+                file_path.parent, self.media_executor,
+                transcode_to_fit,
+                str(file_path), str(output_path), video_kbps, spec.audio_kbps,
+                spec.height, config.TRANSCODE_THREADS, config.TRANSCODE_PRESET,
+                str(file_path.parent / STOP_FILE)
             )
             
-            # تحديث إحصائيات المستخدم
-            await db.increment_download_count(user_id, file_size)
-            
-            return str(file_path)
-            
-        except Exception as e:
-            logger.error(f"Download failed: {e}")
-            if download_record:
-                await db.update_download_status(
-                    download_record.id,
-                    'failed',
-                    error_message=str(e)
-                )
-            return None
+            size = output_path.stat().st_size
+            if size <= budget:
+                break
+            # معدل البت الفعلي تجاوز الهدف: محاولة واحدة بمعدل مصحح
+            video_kbps = int(video_kbps * budget / size * 0.9)
+        else:
+            output_path.unlink(missing_ok=True)
+            raise Exception(f"Transcoded file still exceeds {config.UPLOAD_LIMIT_MB} MB")
+        
+        file_path.unlink(missing_ok=True)
+        return output_path.rename(output_path.with_name(f"{safe_title}.mp4"))
+    
+    async def _fetch_merged(
+        self,
+        url: str,
+        raw_info: Dict,
+        selection: FormatSelection,
+        safe_title: str,
+        output_dir: Path,
+        progress_hook: Optional[Callable[[Dict], None]] = None
+    ) -> Path:
+        """تنزيل مساري الفيديو والصوت بالتوازي ثم دمجهما في مجمع العمليات"""
+        output_path = output_dir / f"{safe_title}.{selection.container}"
+        combined = CombinedProgress(progress_hook, str(output_path), len(selection.streams)) if progress_hook else None
+        
+        stream_paths = await asyncio.gather(*(
+            self._fetch_stream(url, raw_info, fmt, output_dir, combined.hook_for(fmt['format_id']) if combined else None)
+            for fmt in selection.streams
+        ))
+        
+        # الدمج كثيف المعالج لذلك لا يُنفذ في خيوط التنزيل
+        await self._run_staged(
+            output_dir, self.media_executor,
+            mux_streams, str(stream_paths[0]), str(stream_paths[1]), str(output_path),
+            str(output_dir / STOP_FILE)
+        )
+        
+        for path in stream_paths:
+            path.unlink(missing_ok=True)
+        return output_path
+    
+    async def _fetch_stream(
+        self,
+        url: str,
+        raw_info: Dict,
+        fmt: Dict,
+        output_dir: Path,
+        progress_hook: Optional[Callable[[Dict], None]] = None
+    ) -> Path:
+        """تنزيل مسار واحد (فيديو أو صوت) باسم ثابت حتى يمكن استئنافه"""
+        stem = f"stream-{fmt['format_id']}"
+        opts = self._get_ytdl_opts({
+            'format': fmt['format_id'],
+            'outtmpl': str(output_dir / f"{stem}.%(ext)s"),
+            'continuedl': True,
+            'max_filesize': config.MAX_FILE_SIZE * 1024 * 1024,
+            'writesubtitles': False,
+            'writeautomaticsub': False
+        })
+        if progress_hook:
+            opts['progress_hooks'] = [progress_hook]
+        
+        await self._run_staged(
+            output_dir, self.download_executor,
+            self._run_ydl_download, opts, url, raw_info
+        )
+        
+        for path in content_store.list_files(output_dir):
+            if path.stem == stem:
+                return path
+        raise Exception(f"Stream {fmt['format_id']} not found after download")
     
     async def download_subtitle(
         self,
         url: str,
         language: str,
         subtitle_format: str,
-        user_id: int
+        user_id: int,
+        video_info: Optional[Union[VideoInfo, VideoSummary]] = None,
+        download_id: Optional[int] = None,
+        cancel_token: Optional[CancelToken] = None
     ) -> Optional[str]:
-        """تنزيل الترجمة"""
+        """تنزيل الترجمة (download_id لاستئناف سجل تنزيل متوقف)"""
+        if cancel_token is None:
+            with self.track(user_id, CancelToken(config.DOWNLOAD_TIMEOUT)) as token:
+                return await self.download_subtitle(
+                    url, language, subtitle_format, user_id, video_info, download_id, token
+                )
         
         download_record = None
         try:
-            # استخراج معلومات الفيديو
-            video_info = await self.extract_video_info(url)
+            # استخراج معلومات الفيديو (إن لم تُمرر مسبقاً)
+            if not video_info:
+                video_info = await cancel_token.run(self.extract_video_summary(url))
             if not video_info:
                 raise Exception("Failed to extract video information")
             
-            # إنشاء سجل التنزيل
-            download_record = await db.create_download({
-                'user_id': user_id,
-                'url': url,
-                'title': video_info.title,
-                'video_id': video_info.id,
-                'download_type': 'subtitle',
-                'metadata': {
-                    'language': language,
-                    'format': subtitle_format,
-                    'uploader': video_info.uploader
-                }
-            })
-            
-            await db.update_download_status(download_record.id, 'downloading')
-            
-            # تحديد مجلد التنزيل
-            user_dir = config.DOWNLOAD_PATH / str(user_id)
-            user_dir.mkdir(exist_ok=True)
-            
-            # تنظيف اسم الملف
-            safe_title = re.sub(r'[<>:"/\\|?*]', '_', video_info.title)
-            
-            # إعداد خيارات التنزيل
-            opts = self._get_ytdl_opts({
-                'skip_download': True,
-                'writesubtitles': True,
-                'writeautomaticsub': True,
-                'subtitleslangs': [language],
-                'subtitlesformat': subtitle_format,
-                'outtmpl': str(user_dir / f"{safe_title}.%(ext)s")
-            })
-            
-            # تنزيل الترجمة
-            loop = asyncio.get_event_loop()
-            
-            with yt_dlp.YoutubeDL(opts) as ydl:
-                await loop.run_in_executor(
-                    self.executor,
-                    lambda: ydl.download([url])
+            # إنشاء سجل التنزيل جارياً مباشرة، أو إعادة استخدام السجل المتوقف
+            if download_id:
+                download_record = await db.get_download(download_id)
+            if download_record:
+                await db.update_download_status(
+                    download_record.id, 'downloading', heartbeat_at=datetime.now(timezone.utc)
                 )
+            else:
+                download_record = await db.create_download({
+                    'user_id': user_id,
+                    'url': url,
+                    'title': video_info.title,
+                    'video_id': video_info.id,
+                    'download_type': 'subtitle',
+                    'status': 'downloading',
+                    'heartbeat_at': datetime.now(timezone.utc),
+                    'file_metadata': {
+                        'language': language,
+                        'format': subtitle_format,
+                        'uploader': video_info.uploader
+                    }
+                })
             
-            # البحث عن ملف الترجمة
-            subtitle_files = list(user_dir.glob(f"{safe_title}.{language}.{subtitle_format}"))
-            if not subtitle_files:
-                # البحث عن ترجمة تلقائية
-                auto_files = list(user_dir.glob(f"{safe_title}.{language}.*.{subtitle_format}"))
-                if auto_files:
-                    subtitle_files = auto_files
-            
-            if not subtitle_files:
-                raise Exception("Subtitle file not found")
-            
-            file_path = subtitle_files[0]
+            async with self._journal_heartbeat(download_record.id):
+                file_path = await cancel_token.run(self._shared_download(
+                    video_info.id, subtitle_key(language, subtitle_format), 'subtitle',
+                    lambda flight_dir, hook: self._fetch_subtitle(url, video_info, language, subtitle_format, flight_dir),
+                    user_id,
+                    cancel_token=cancel_token
+                ))
             file_size = file_path.stat().st_size
             
             # تحديث سجل التنزيل
@@ -407,7 +838,12 @@ class YouTubeDownloader:
             )
             
             return str(file_path)
-            
+        
+        except DownloadCancelled as e:
+            logger.info(f"Subtitle download cancelled: {e.reason}")
+            if download_record:
+                await db.update_download_status(download_record.id, 'cancelled', error_message=e.reason)
+            raise
         except Exception as e:
             logger.error(f"Subtitle download failed: {e}")
             if download_record:
@@ -418,20 +854,270 @@ class YouTubeDownloader:
                 )
             return None
     
+    async def _fetch_subtitle(
+        self,
+        url: str,
+        video_info: Union[VideoInfo, VideoSummary],
+        language: str,
+        subtitle_format: str,
+        output_dir: Path
+    ) -> Path:
+        """تنزيل ملف الترجمة فعلياً إلى مجلد محدد"""
+        
+        # تنظيف اسم الملف
+        safe_title = re.sub(r'[<>:"/\\|?*]', '_', video_info.title)
+        
+        # إعداد خيارات التنزيل
+        opts = self._get_ytdl_opts({
+            'skip_download': True,
+            'writesubtitles': True,
+            'writeautomaticsub': True,
+            'subtitleslangs': [language],
+            'subtitlesformat': subtitle_format,
+            'outtmpl': str(output_dir / f"{safe_title}.%(ext)s")
+        })
+        
+        # تنزيل الترجمة
+        raw_info = await metadata_cache.get(video_info.id)
+        
+        await self._run_staged(
+            output_dir, self.subtitle_executor,
+            self._run_ydl_download, opts, url, raw_info
+        )
+        
+        # البحث عن ملف الترجمة (أصلية أو تلقائية)
+        subtitle_files = [
+            path for path in content_store.list_files(output_dir)
+            if path.name.endswith(f".{subtitle_format}")
+        ]
+        if not subtitle_files:
+            raise Exception("Subtitle file not found")
+        
+        return subtitle_files[0]
+    
+    async def _shared_download(
+        self,
+        video_id: str,
+        fmt: str,
+        kind: str,
+        fetch: Callable[[Path, Callable[[Dict], None]], Awaitable[Path]],
+        user_id: int,
+        progress_callback: Optional[Callable] = None,
+        cancel_token: Optional[CancelToken] = None
+    ) -> Path:
+        """الحصول على الملف من المخزن المشترك أو تنزيله مرة واحدة (single-flight)
+        
+        الطلبات المتزامنة لنفس الفيديو والصيغة تنتظر التنزيل نفسه وتشترك في تدفق التقدم.
+        يتوقف التنزيل المشترك فقط عندما يُلغي آخر منتظر طلبه.
+        """
+        stored = content_store.lookup(video_id, fmt)
+        if stored:
+            logger.info(f"Serving {video_id} [{fmt}] from content store for user {user_id}")
+            await disk_cache.hit(stored)
+            return stored
+        
+        key = (video_id, fmt, kind)
+        flight = self._inflight.get(key)
+        while flight is not None and flight.token.cancelled:
+            # تنزيل يتوقف الآن: ننتظر خروجه ثم نبدأ تنزيلاً جديداً
+            await asyncio.wait([flight.task])
+            flight = self._inflight.get(key)
+        
+        if flight is None:
+            disk_cache.miss()
+            flight = InFlightDownload(
+                directory=content_store.staging_dir(video_id, fmt),
+                bridge=ProgressBridge(asyncio.get_event_loop()),
+                token=CancelToken(config.DOWNLOAD_TIMEOUT)
+            )
+            flight.task = asyncio.ensure_future(self._run_flight(key, flight, fetch, user_id))
+            # قد لا يبقى منتظر يستلم نتيجة تنزيل أُلغي
+            flight.task.add_done_callback(lambda task: task.cancelled() or task.exception())
+            self._inflight[key] = flight
+        else:
+            logger.info(f"Joining in-flight download {key} for user {user_id}")
+        
+        # كل مشترك يستقبل آخر حالة فقط وبإيقاعه الخاص
+        subscriber = ThrottledProgress(progress_callback) if progress_callback else None
+        if subscriber:
+            flight.bridge.subscribe(subscriber)
+        flight.waiters += 1
+        
+        try:
+            # الحماية من إلغاء المهمة المشتركة عند إلغاء أحد المنتظرين
+            return await asyncio.shield(flight.task)
+        finally:
+            if subscriber:
+                await flight.bridge.unsubscribe(subscriber)
+            flight.waiters -= 1
+            if flight.waiters == 0 and cancel_token and cancel_token.cancelled and not flight.task.done():
+                flight.token.cancel(cancel_token.reason or 'user')
+    
+    async def _run_flight(
+        self,
+        key: Tuple[str, str, str],
+        flight: "InFlightDownload",
+        fetch: Callable[[Path, Callable], Awaitable[Path]],
+        user_id: int
+    ) -> Path:
+        """تشغيل التنزيل المشترك؛ خطاف الجسر يوزع التقدم على جميع المشتركين"""
+        video_id, fmt, kind = key
+        
+        loop = asyncio.get_event_loop()
+        try:
+            # خطاف التقدم يفحص الإلغاء فيوقف yt-dlp عند الدفعة التالية
+            hook = flight.token.wrap_hook(flight.bridge.hook)
+            if kind == 'video':
+                path = await flight.token.run(self._scheduled_fetch(user_id, flight, fetch, hook))
+            else:
+                path = await flight.token.run(fetch(flight.directory, hook))
+            stored = await loop.run_in_executor(
+                self.postprocess_executor,
+                content_store.commit, video_id, fmt, path
+            )
+        except asyncio.CancelledError:
+            # إيقاف التطبيق: نُبقي الملفات الجزئية ليستأنفها التشغيل التالي
+            content_store.release(flight.directory)
+            raise
+        except Exception:
+            # يشمل DownloadCancelled: الملفات الجزئية لتنزيل ملغى لا تُستأنف. المجلد ثابت لكل
+            # (video_id, fmt)، فلا يُحرر ولا تخرج الرحلة من _inflight قبل توقف كل ما يكتب فيه
+            await self._stop_staged_work(flight)
+            await loop.run_in_executor(
+                self.postprocess_executor,
+                content_store.discard, flight.directory
+            )
+            raise
+        finally:
+            self._staged_work.pop(flight.directory, None)
+            self._inflight.pop(key, None)
+        
+        await disk_cache.record(stored)
+        await loop.run_in_executor(
+            self.postprocess_executor,
+            content_store.discard, flight.directory
+        )
+        return stored
+    
+    async def _run_staged(self, directory: Path, executor: InstrumentedExecutor, fn: Callable, *args) -> Any:
+        """تشغيل عمل يكتب في مجلد مؤقت داخل مجمع تنفيذ مع تسجيله على المجلد
+        
+        إلغاء الانتظار لا يوقف الخيط نفسه، لذلك يُحتفظ بالمستقبل حتى ينتظره _stop_staged_work.
+        """
+        future = executor.submit(fn, *args)
+        self._staged_work.setdefault(directory, []).append(future)
+        return await asyncio.wrap_future(future)
+    
+    async def _stop_staged_work(self, flight: "InFlightDownload"):
+        """إيقاف خيوط yt-dlp وعمليات ffmpeg التي ما زالت تكتب في مجلد الرحلة وانتظار خروجها
+        
+        إلغاء الرمز يجعل خطاف التقدم يرفع DownloadCancelled عند الدفعة التالية (ويشمل ذلك
+        المسار الآخر من تنزيل مدمج فشل أحد مساريه)، وملف الإيقاف يقتل ffmpeg في مجمع العمليات.
+        """
+        pending = [future for future in self._staged_work.get(flight.directory, []) if not future.done()]
+        if not pending:
+            return
+        flight.token.cancel('failed')
+        if flight.directory.is_dir():
+            (flight.directory / STOP_FILE).touch()
+        logger.info(f"Waiting for {len(pending)} worker(s) still writing to {flight.directory.name}")
+        await asyncio.gather(*(asyncio.wrap_future(future) for future in pending), return_exceptions=True)
+    
+    async def _scheduled_fetch(
+        self,
+        user_id: int,
+        flight: "InFlightDownload",
+        fetch: Callable[[Path, Callable], Awaitable[Path]],
+        hook: Callable[[Dict], None]
+    ) -> Path:
+        """انتظار خانة تنزيل من الجدولة العادلة (باسم صاحب الطلب الأول) ثم التنزيل
+        
+        موقع الطابور يصل إلى جميع المشتركين عبر جسر التقدم.
+        """
+        lane = download_lane(await self._is_premium(user_id))
+        on_position = lambda position: flight.bridge.publish(DownloadProgress.queued(position))
+        async with self.scheduler.slot(user_id, lane, on_position):
+            return await fetch(flight.directory, hook)
+    
+    async def _is_premium(self, user_id: int) -> bool:
+        premium = self._premium_users.get(user_id)
+        if premium is None:
+            try:
+                user = await db.get_user(user_id)
+            except Exception as e:
+                logger.warning(f"Could not load user {user_id}: {e}")
+                return False
+            premium = bool(user and user.is_premium)
+            self._premium_users.set(user_id, premium)
+        return premium
+    
+    @asynccontextmanager
+    async def _journal_heartbeat(self, download_id: int):
+        """نبضات دورية لسجل التنزيل حتى يميز الاسترداد بين الجاري والمتوقف"""
+        async def beat():
+            while True:
+                await asyncio.sleep(config.JOB_HEARTBEAT_INTERVAL)
+                try:
+                    await db.touch_download(download_id)
+                except Exception as e:
+                    logger.warning(f"Download heartbeat failed: {e}")
+        
+        task = asyncio.ensure_future(beat())
+        try:
+            yield
+        finally:
+            task.cancel()
+    
+    async def record_cached_delivery(
+        self,
+        url: str,
+        video_info: Union[VideoInfo, VideoSummary],
+        fmt: str,
+        download_type: str,
+        user_id: int,
+        file_size: int = 0
+    ):
+        """تسجيل تنزيل تمت تلبيته بإعادة إرسال ملف تليجرام محفوظ"""
+        try:
+            await db.create_download({
+                'user_id': user_id,
+                'url': url,
+                'title': video_info.title,
+                'video_id': video_info.id,
+                'quality': fmt if download_type == 'video' else None,
+                'duration': video_info.duration,
+                'download_type': download_type,
+                'status': 'completed',
+                'file_size': file_size,
+                'completed_at': datetime.now(timezone.utc),
+                'file_metadata': {'telegram_file_id': True}
+            }, count_for_user=download_type == 'video')
+        except Exception as e:
+            logger.error(f"Failed to record cached delivery: {e}")
+    
     async def download_playlist(
         self,
         url: str,
         quality: str,
         user_id: int,
         max_videos: Optional[int] = None,
-        progress_callback: Optional[Callable] = None
+        progress_callback: Optional[Callable[[PlaylistProgress], Awaitable[None]]] = None,
+        cancel_token: Optional[CancelToken] = None
     ) -> Dict[str, Any]:
-        """تنزيل قائمة التشغيل"""
+        """تنزيل قائمة التشغيل (عدة فيديوهات بالتوازي ضمن حدود التزامن)
+        
+        رمز الإلغاء مشترك بين كل فيديوهات القائمة بمهلة PLAYLIST_TIMEOUT للقائمة كاملة،
+        ويرفع DownloadCancelled عند إلغائه.
+        """
+        if cancel_token is None:
+            with self.track(user_id, CancelToken(config.PLAYLIST_TIMEOUT)) as token:
+                return await self.download_playlist(url, quality, user_id, max_videos, progress_callback, token)
         
         playlist_record = None
+        throttle = None
         try:
             # استخراج معلومات قائمة التشغيل
-            playlist_info = await self.extract_playlist_info(url)
+            playlist_info = await cancel_token.run(self.extract_playlist_info(url))
             if not playlist_info:
                 raise Exception("Failed to extract playlist information")
             
@@ -453,65 +1139,132 @@ class YouTubeDownloader:
                 'quality': quality
             })
             
-            # تحديد مجلد التنزيل
-            user_dir = config.DOWNLOAD_PATH / str(user_id) / f"playlist_{playlist_info.id}"
-            user_dir.mkdir(parents=True, exist_ok=True)
+            entries = playlist_info.entries[:total_videos]
+            results: List[Optional[str]] = [None] * total_videos
+            progress = PlaylistProgress(total=total_videos, title=playlist_info.title)
+            pending = {'completed': 0, 'failed': 0}  # تغييرات لم تُكتب بعد في قاعدة البيانات
+            playlist_slots = asyncio.Semaphore(max(1, config.PLAYLIST_CONCURRENCY))
+            throttle = ThrottledProgress(progress_callback) if progress_callback else None
             
-            downloaded_files = []
-            completed = 0
-            failed = 0
+            def publish():
+                if throttle:
+                    throttle.push(progress.snapshot())
             
-            # تنزيل الفيديوهات
-            for i, entry in enumerate(playlist_info.entries[:total_videos]):
+            async def flush_progress():
+                completed, failed = pending['completed'], pending['failed']
+                if completed or failed:
+                    pending['completed'] = pending['failed'] = 0
+                    await db.update_playlist_progress(playlist_record.id, completed, failed)
+            
+            async def download_entry(index: int, entry: Dict):
+                file_path = None
                 try:
-                    if progress_callback:
-                        await progress_callback(f"تنزيل فيديو {i+1}/{total_videos}: {entry.get('title', 'Unknown')}")
-                    
-                    video_url = entry.get('webpage_url') or f"https://youtube.com/watch?v={entry.get('id')}"
-                    file_path = await self.download_video(video_url, quality, user_id)
-                    
-                    if file_path:
-                        downloaded_files.append(file_path)
-                        completed += 1
-                    else:
-                        failed += 1
-                    
-                    # تحديث التقدم
-                    await db.update_playlist_progress(playlist_record.id, 1 if file_path else 0, 1 if not file_path else 0)
-                    
+                    # الحد العام والعدل بين المستخدمين في الجدولة داخل download_video
+                    async with playlist_slots:
+                        cancel_token.check()
+                        progress.active += 1
+                        progress.current_title = entry.get('title') or 'Unknown'
+                        publish()
+                        try:
+                            video_url = entry.get('webpage_url') or f"https://youtube.com/watch?v={entry.get('id')}"
+                            file_path = await self.download_video(
+                                video_url, quality, user_id, cancel_token=cancel_token
+                            )
+                        finally:
+                            progress.active -= 1
+                except DownloadCancelled as e:
+                    if cancel_token.cancelled:
+                        return  # أُلغيت القائمة كلها: لا يُحتسب الفيديو فاشلاً
+                    # انتهت مهلة هذا الفيديو وحده
+                    logger.error(f"Video {index + 1} cancelled: {e}")
                 except Exception as e:
-                    logger.error(f"Failed to download video {i+1}: {e}")
-                    failed += 1
-                    await db.update_playlist_progress(playlist_record.id, 0, 1)
+                    # فشل فيديو واحد لا يوقف بقية القائمة
+                    logger.error(f"Failed to download video {index + 1}: {e}")
+                
+                results[index] = file_path
+                if file_path:
+                    progress.completed += 1
+                    pending['completed'] += 1
+                else:
+                    progress.failed += 1
+                    pending['failed'] += 1
+                publish()
+                
+                # تحديث العدادات على دفعات بدلاً من استعلام لكل فيديو
+                if pending['completed'] + pending['failed'] >= config.PLAYLIST_PROGRESS_BATCH:
+                    await flush_progress()
+            
+            publish()
+            await asyncio.gather(*(download_entry(i, entry) for i, entry in enumerate(entries)))
+            await flush_progress()
+            
+            if cancel_token.cancelled:
+                raise DownloadCancelled(cancel_token.reason or 'user')
+            
+            # النتائج بترتيب قائمة التشغيل
+            downloaded_items = [
+                {'file_path': file_path, 'video_id': entry.get('id')}
+                for entry, file_path in zip(entries, results)
+                if file_path
+            ]
+            completed, failed = progress.completed, progress.failed
             
             # تحديث حالة قائمة التشغيل
             status = 'completed' if failed == 0 else 'partial' if completed > 0 else 'failed'
-            await db.update_download_status(playlist_record.id, status)
+            await db.update_playlist_status(playlist_record.id, status)
             
             return {
                 'playlist_id': playlist_record.id,
                 'total_videos': total_videos,
                 'completed': completed,
                 'failed': failed,
-                'downloaded_files': downloaded_files,
+                'downloaded_files': [item['file_path'] for item in downloaded_items],
+                'downloaded_items': downloaded_items,
+                'quality': quality,
                 'status': status
             }
             
+        except DownloadCancelled as e:
+            logger.info(f"Playlist download cancelled: {e.reason}")
+            if playlist_record:
+                await db.update_playlist_status(playlist_record.id, 'cancelled')
+            raise
         except Exception as e:
             logger.error(f"Playlist download failed: {e}")
             if playlist_record:
-                await db.update_download_status(playlist_record.id, 'failed', error_message=str(e))
+                await db.update_playlist_status(playlist_record.id, 'failed')
             return {
                 'error': str(e),
                 'status': 'failed'
             }
+        
+        finally:
+            if throttle:
+                await throttle.close()
     
-    async def _async_progress_callback(self, callback: Callable, progress: DownloadProgress):
-        """معالج غير متزامن للتقدم"""
-        try:
-            await callback(progress)
-        except Exception as e:
-            logger.error(f"Progress callback error: {e}")
+    def get_executor_stats(self) -> Dict[str, Dict[str, Any]]:
+        """مقاييس مجمعات التنفيذ (عمق الطابور، المهام الجارية، زمن الانتظار)"""
+        return {
+            executor.name: executor.stats()
+            for executor in (
+                self.extract_executor,
+                self.download_executor,
+                self.subtitle_executor,
+                self.postprocess_executor,
+                self.media_executor
+            )
+        }
+    
+    def shutdown(self):
+        """إيقاف مجمعات التنفيذ"""
+        for executor in (
+            self.extract_executor,
+            self.download_executor,
+            self.subtitle_executor,
+            self.postprocess_executor,
+            self.media_executor
+        ):
+            executor.shutdown(wait=False, cancel_futures=True)
     
     def is_valid_url(self, url: str) -> bool:
         """التحقق من صحة الرابط"""
@@ -532,23 +1285,6 @@ class YouTubeDownloader:
     def is_playlist_url(self, url: str) -> bool:
         """التحقق من أن الرابط لقائمة تشغيل"""
         return 'playlist' in url or 'list=' in url
-    
-    async def cleanup_old_files(self, days: int = 7):
-        """تنظيف الملفات القديمة"""
-        try:
-            import time
-            current_time = time.time()
-            cutoff_time = current_time - (days * 24 * 3600)
-            
-            for user_dir in config.DOWNLOAD_PATH.iterdir():
-                if user_dir.is_dir():
-                    for file_path in user_dir.rglob('*'):
-                        if file_path.is_file() and file_path.stat().st_mtime < cutoff_time:
-                            file_path.unlink()
-                            logger.info(f"Deleted old file: {file_path}")
-            
-        except Exception as e:
-            logger.error(f"Cleanup failed: {e}")
 
 # مثيل عام من المنزل
 downloader = YouTubeDownloader()
\ No newline at end of file
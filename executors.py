@@ -0,0 +1,80 @@
+"""
+مجمعات التنفيذ مع مقاييس عمق الطابور
+"""
+import threading
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+class InstrumentedExecutor(Executor):
+    """مجمع خيوط بحجم مستقل يسجل عدد المهام المنتظرة والجارية وزمن الانتظار
+
+    مع processes=True تُنفذ المهام في مجمع عمليات بنفس الحجم (للأعمال كثيفة المعالج)،
+    ويبقى الطابور والمقاييس في خيوط تنتظر نتيجة كل عملية.
+    """
+
+    def __init__(self, name: str, max_workers: int, processes: bool = False):
+        self.name = name
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._processes: Optional[ProcessPoolExecutor] = (
+            ProcessPoolExecutor(max_workers=max_workers) if processes else None
+        )
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.max_queued = 0
+        self._total_wait = 0.0
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        submitted_at = time.monotonic()
+
+        def run():
+            with self._lock:
+                self.queued -= 1
+                self.active += 1
+                self._total_wait += time.monotonic() - submitted_at
+            try:
+                if self._processes:
+                    result = self._processes.submit(fn, *args, **kwargs).result()
+                else:
+                    result = fn(*args, **kwargs)
+            except BaseException:
+                with self._lock:
+                    self.failed += 1
+                raise
+            finally:
+                with self._lock:
+                    self.active -= 1
+                    self.completed += 1
+            return result
+
+        with self._lock:
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+
+        return self._executor.submit(run)
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False):
+        self._executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+        if self._processes:
+            self._processes.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            started = self.completed + self.active
+            return {
+                'workers': self.max_workers,
+                'processes': self._processes is not None,
+                'queued': self.queued,
+                'active': self.active,
+                'completed': self.completed,
+                'failed': self.failed,
+                'max_queued': self.max_queued,
+                'avg_wait': self._total_wait / started if started else 0.0
+            }
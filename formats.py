@@ -0,0 +1,262 @@
+"""
+اختيار صيغ التنزيل: أفضل مسار فيديو وصوت متوافقين للجودة المطلوبة
+"""
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+# ترتيب التوافق (الأول أفضل للتشغيل المباشر في تليجرام)
+VIDEO_CODECS = ('avc1', 'h264', 'vp09', 'vp9', 'av01')
+AUDIO_CODECS = ('mp4a', 'aac', 'opus', 'vorbis')
+
+# الترميزات التي يقبلها كل حاوٍ دون تحويل
+MP4_VIDEO_CODECS = ('avc1', 'h264', 'av01')
+MP4_AUDIO_CODECS = ('mp4a', 'aac')
+WEBM_VIDEO_CODECS = ('vp09', 'vp9', 'av01')
+WEBM_AUDIO_CODECS = ('opus', 'vorbis')
+
+def codec_family(codec: Optional[str]) -> str:
+    """اسم عائلة الترميز بدون الملف الشخصي (avc1.640028 -> avc1)"""
+    return (codec or 'none').split('.')[0].lower()
+
+def _rank(codec: Optional[str], preference: tuple) -> int:
+    family = codec_family(codec)
+    return preference.index(family) if family in preference else len(preference)
+
+def _has_video(fmt: Dict) -> bool:
+    return codec_family(fmt.get('vcodec')) != 'none' and bool(fmt.get('height'))
+
+def _has_audio(fmt: Dict) -> bool:
+    return codec_family(fmt.get('acodec')) != 'none'
+
+@dataclass
+class FormatSelection:
+    """الصيغة المختارة: مسار واحد متكامل أو فيديو وصوت يُدمجان بعد التنزيل"""
+    video: Dict
+    audio: Optional[Dict] = None
+
+    @property
+    def merged(self) -> bool:
+        return self.audio is not None
+
+    @property
+    def height(self) -> int:
+        return self.video.get('height') or 0
+
+    @property
+    def format_spec(self) -> str:
+        """صيغة yt-dlp المكافئة"""
+        if self.audio:
+            return f"{self.video['format_id']}+{self.audio['format_id']}"
+        return self.video['format_id']
+
+    @property
+    def container(self) -> str:
+        """حاوي الملف النهائي (mp4 عندما تسمح الترميزات بذلك)"""
+        if not self.audio:
+            return self.video.get('ext') or 'mp4'
+        vcodec = codec_family(self.video.get('vcodec'))
+        acodec = codec_family(self.audio.get('acodec'))
+        if vcodec in MP4_VIDEO_CODECS and acodec in MP4_AUDIO_CODECS:
+            return 'mp4'
+        if vcodec in WEBM_VIDEO_CODECS and acodec in WEBM_AUDIO_CODECS:
+            return 'webm'
+        return 'mkv'
+
+    @property
+    def streams(self) -> List[Dict]:
+        return [self.video, self.audio] if self.audio else [self.video]
+
+def _best_video(candidates: List[Dict]) -> Optional[Dict]:
+    """أعلى ارتفاع، ثم الترميز الأكثر توافقاً، ثم أعلى معدل بت"""
+    if not candidates:
+        return None
+    return max(
+        candidates,
+        key=lambda fmt: (fmt['height'], -_rank(fmt.get('vcodec'), VIDEO_CODECS), fmt.get('tbr') or 0)
+    )
+
+def _best_audio(candidates: List[Dict], video: Dict) -> Optional[Dict]:
+    """الصوت من عائلة حاوي الفيديو نفسها (m4a مع H.264، opus مع VP9) لتجنب mkv"""
+    if not candidates:
+        return None
+
+    vcodec = codec_family(video.get('vcodec'))
+    matching = MP4_AUDIO_CODECS if vcodec in MP4_VIDEO_CODECS else WEBM_AUDIO_CODECS
+    return max(
+        candidates,
+        key=lambda fmt: (
+            codec_family(fmt.get('acodec')) in matching,
+            -_rank(fmt.get('acodec'), AUDIO_CODECS),
+            fmt.get('abr') or fmt.get('tbr') or 0
+        )
+    )
+
+def _pick(video_only: List[Dict], audio_only: List[Dict], progressive: List[Dict]) -> Optional[FormatSelection]:
+    """أفضل خيار من مجموعة مرشحين؛ المسار المتكامل يفوز عند تساوي الارتفاع لأنه لا يحتاج إلى دمج"""
+    best_progressive = _best_video(progressive)
+    best_video = _best_video(video_only) if audio_only else None
+
+    if best_video and (not best_progressive or best_video['height'] > best_progressive['height']):
+        return FormatSelection(best_video, _best_audio(audio_only, best_video))
+    if best_progressive:
+        return FormatSelection(best_progressive)
+    return None
+
+def select_format(formats: List[Dict], quality: str) -> Optional[FormatSelection]:
+    """اختيار أفضل صيغة للجودة المطلوبة (مثل 1080p أو best)
+
+    إذا لم تتوفر أي صيغة ضمن الارتفاع المطلوب تُختار أقل جودة متاحة بدلاً من الفشل.
+    """
+    max_height = None if quality == 'best' else int(quality.rstrip('p'))
+
+    video_only = [fmt for fmt in formats if _has_video(fmt) and not _has_audio(fmt)]
+    audio_only = [fmt for fmt in formats if _has_audio(fmt) and codec_family(fmt.get('vcodec')) == 'none']
+    progressive = [fmt for fmt in formats if _has_video(fmt) and _has_audio(fmt)]
+
+    def within(candidates: List[Dict]) -> List[Dict]:
+        return [fmt for fmt in candidates if max_height is None or fmt['height'] <= max_height]
+
+    selection = _pick(within(video_only), audio_only, within(progressive))
+    if selection:
+        return selection
+
+    # أقل ارتفاع متاح
+    heights = [fmt['height'] for fmt in video_only + progressive]
+    if not heights:
+        return None
+    lowest = min(heights)
+    return _pick(
+        [fmt for fmt in video_only if fmt['height'] == lowest],
+        audio_only,
+        [fmt for fmt in progressive if fmt['height'] == lowest]
+    )
+
+def estimate_size(fmt: Dict, duration: Optional[float]) -> Optional[int]:
+    """الحجم المتوقع لصيغة واحدة بالبايت (الحجم المعلن، أو التقريبي، أو معدل البت × المدة)"""
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if size:
+        return int(size)
+    if fmt.get('tbr') and duration:
+        return int(fmt['tbr'] * 125 * duration)  # kbit/s -> بايت/ث
+    return None
+
+def estimate_selection_size(selection: FormatSelection, duration: Optional[float]) -> Optional[int]:
+    """الحجم المتوقع للملف النهائي، أو None إذا تعذر تقديره"""
+    sizes = [estimate_size(fmt, duration) for fmt in selection.streams]
+    if None in sizes:
+        return None
+    return sum(sizes)
+
+def downgrade_to_fit(
+    formats: List[Dict],
+    selection: FormatSelection,
+    duration: Optional[float],
+    max_bytes: int
+) -> Optional[str]:
+    """أعلى جودة أقل من الصيغة المختارة يتسع حجمها المقدر في max_bytes (مثل 480p)"""
+    heights = sorted(
+        {fmt['height'] for fmt in formats if _has_video(fmt) and fmt['height'] < selection.height},
+        reverse=True
+    )
+    for height in heights:
+        candidate = select_format(formats, f"{height}p")
+        size = estimate_selection_size(candidate, duration) if candidate else None
+        if size is not None and size <= max_bytes:
+            return f"{height}p"
+    return None
+
+# أدنى معدل بت مقبول للفيديو (kbps) لكل ارتفاع عند إعادة الترميز بـ H.264
+MIN_VIDEO_BITRATE = (
+    (1080, 2500),
+    (720, 1200),
+    (480, 600),
+    (360, 350),
+    (240, 200),
+    (144, 100),
+)
+
+@dataclass
+class TranscodeSpec:
+    """معاملات إعادة الترميز ليتسع الملف في الحجم المسموح"""
+    video_kbps: int
+    audio_kbps: int
+    height: Optional[int] = None  # None = بدون تصغير
+
+@dataclass
+class DownloadPlan:
+    """ما سيُنزّل وكيف يُعالج، محدد قبل تنزيل أي بايت"""
+    selection: Optional[FormatSelection]
+    estimated_size: Optional[int] = None
+    transcode: Optional[TranscodeSpec] = None
+    fitted: bool = False  # عُدلت الجودة لتتسع في الحجم المسموح
+
+    def store_key(self, quality: str, budget_mb: int) -> str:
+        """مفتاح المخزن: النسخة المعدلة للحجم تُخزن منفصلة عن الأصلية"""
+        return f"{quality}-fit{budget_mb}mb" if self.fitted else quality
+
+def plan_transcode(
+    duration: Optional[float],
+    source_height: int,
+    budget_bytes: int,
+    audio_kbps: int
+) -> Optional[TranscodeSpec]:
+    """معدل البت المستهدف من المدة، مع تصغير الارتفاع حتى يبقى المعدل مقبولاً
+
+    يُرجع None إذا كان الحجم المسموح أصغر من أن يحتمل أدنى جودة.
+    """
+    if not duration:
+        return None
+
+    # هامش 5% لترويسات الحاوي وتذبذب معدل البت
+    total_kbps = int(budget_bytes * 0.95 * 8 / 1000 / duration)
+    video_kbps = total_kbps - audio_kbps
+    if video_kbps < MIN_VIDEO_BITRATE[-1][1]:
+        return None
+
+    for height, min_kbps in MIN_VIDEO_BITRATE:
+        if height <= source_height and video_kbps >= min_kbps:
+            return TranscodeSpec(
+                video_kbps=video_kbps,
+                audio_kbps=audio_kbps,
+                height=height if height < source_height else None
+            )
+
+    return TranscodeSpec(video_kbps=video_kbps, audio_kbps=audio_kbps, height=MIN_VIDEO_BITRATE[-1][0])
+
+def plan_download(
+    formats: List[Dict],
+    quality: str,
+    duration: Optional[float],
+    budget_bytes: Optional[int] = None,
+    audio_kbps: int = 128
+) -> DownloadPlan:
+    """اختيار الصيغة وتقرير إعادة الترميز مسبقاً باستخدام الأحجام المعلنة
+
+    إذا لم تتسع الجودة المطلوبة في الحجم المسموح تُحسب جودة الترميز المستهدفة،
+    ويُنزّل أصغر مصدر يكفيها بدلاً من الجودة الكاملة.
+    """
+    selection = select_format(formats, quality)
+    if selection is None:
+        return DownloadPlan(None)
+
+    estimated = estimate_selection_size(selection, duration)
+    if budget_bytes is None or estimated is None or estimated <= budget_bytes:
+        return DownloadPlan(selection, estimated)
+
+    spec = plan_transcode(duration, selection.height, budget_bytes, audio_kbps)
+    if spec is None:
+        return DownloadPlan(selection, estimated)
+
+    if spec.height:
+        # لا فائدة من تنزيل دقة أعلى مما سيبقى بعد التصغير
+        source = select_format(formats, f"{spec.height}p") or selection
+        if source.height >= spec.height:
+            selection = source
+            estimated = estimate_selection_size(selection, duration)
+            if estimated is not None and estimated <= budget_bytes:
+                # المصدر الأصغر يتسع بدون إعادة ترميز
+                return DownloadPlan(selection, estimated, fitted=True)
+            if selection.height == spec.height:
+                spec.height = None
+
+    return DownloadPlan(selection, estimated, spec, fitted=True)
@@ -0,0 +1,629 @@
+"""
+طابور مهام التنزيل والعمال الذين ينفذونها
+"""
+import asyncio
+import json
+import os
+import socket
+import time
+import uuid
+from dataclasses import dataclass, field, asdict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+import humanize
+from config import config
+from cancellation import CancelToken, DownloadCancelled
+from database import db, Job
+from downloader import downloader, DownloadProgress, PlaylistProgress
+from scheduler import FairQueue, job_lane
+from store import subtitle_key
+import logging
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # Redis اختياري
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class DownloadJob:
+    """مهمة تنزيل في الطابور"""
+    kind: str  # video, playlist
+    user_id: int
+    chat_id: int
+    payload: Dict[str, Any]
+    message_id: Optional[int] = None
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = 'queued'  # queued, running, done, failed
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    premium: bool = False  # مسار الأولوية في الجدولة العادلة
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self))
+
+    @classmethod
+    def from_json(cls, raw: str) -> "DownloadJob":
+        return cls(**json.loads(raw))
+
+    @classmethod
+    def from_row(cls, row: Job) -> "DownloadJob":
+        return cls(
+            id=row.id,
+            kind=row.kind,
+            user_id=row.user_id,
+            chat_id=row.chat_id,
+            message_id=row.message_id,
+            payload=row.payload or {},
+            status=row.status,
+            result=row.result,
+            error=row.error_message
+        )
+
+class JobQueue:
+    """الواجهة المشتركة لخلفيات طابور المهام"""
+
+    name = 'base'
+
+    async def enqueue(self, job: DownloadJob):
+        raise NotImplementedError
+
+    async def claim(self, worker_id: str, timeout: float) -> Optional[DownloadJob]:
+        """حجز المهمة التالية أو إرجاع None بعد انتهاء المهلة"""
+        raise NotImplementedError
+
+    async def heartbeat(self, job: DownloadJob):
+        pass
+
+    async def position(self, job: DownloadJob) -> Optional[int]:
+        """موقع المهمة المنتظرة في الطابور (None إذا لم يكن معروفاً)
+
+        معروف في LocalJobQueue فقط؛ ترتيب الحجز في الخلفيات المشتركة لا يطابق موقعاً ثابتاً.
+        """
+        return None
+
+    async def complete(self, job: DownloadJob, result: Dict[str, Any]):
+        raise NotImplementedError
+
+    async def fail(self, job: DownloadJob, error: str):
+        raise NotImplementedError
+
+    async def finished(self, timeout: float) -> List[DownloadJob]:
+        """المهام المنتهية الجاهزة للتسليم إلى المستخدمين"""
+        raise NotImplementedError
+
+    async def ack(self, job: DownloadJob):
+        """تأكيد تسليم نتيجة المهمة"""
+        pass
+
+    async def request_cancel(self, user_id: int):
+        """طلب إلغاء مهام المستخدم المنتظرة والجارية (قد تكون في عامل آخر)"""
+        pass
+
+    async def is_cancelled(self, job: DownloadJob) -> bool:
+        """هل طُلب إلغاء المهمة؛ يفحصه العامل عند الحجز ومع كل نبضة"""
+        return False
+
+    async def reap_stale(self, stale_before: float) -> int:
+        """إغلاق المهام التي توقف عاملها دون إكمالها
+
+        التنزيلات نفسها تُستأنف من سجل التنزيلات، لذلك لا يُعاد تشغيل المهمة.
+        """
+        return 0
+
+    async def ping(self) -> bool:
+        """التحقق من جاهزية الطابور"""
+        return True
+
+    async def close(self):
+        pass
+
+class LocalJobQueue(JobQueue):
+    """طابور داخل العملية نفسها (بديل محلي للتطوير والاختبار)
+
+    المهام تُحجز بالعدل بين المستخدمين (FairQueue) وليس بترتيب الوصول.
+    """
+
+    name = 'local'
+
+    def __init__(self):
+        self._pending = FairQueue()
+        self._ready: Optional[asyncio.Condition] = None
+        self._finished: Optional[asyncio.Queue] = None
+        self._cancel_requests: Dict[int, float] = {}  # user_id -> وقت آخر طلب إلغاء
+
+    def _queues(self):
+        # تُنشأ داخل حلقة الأحداث
+        if self._finished is None:
+            self._ready = asyncio.Condition()
+            self._finished = asyncio.Queue()
+        return self._ready, self._finished
+
+    async def enqueue(self, job: DownloadJob):
+        ready, _ = self._queues()
+        async with ready:
+            self._pending.push(job.user_id, job, job_lane(job.premium))
+            ready.notify()
+
+    async def claim(self, worker_id: str, timeout: float) -> Optional[DownloadJob]:
+        ready, _ = self._queues()
+        async with ready:
+            try:
+                _, job = await asyncio.wait_for(ready.wait_for(self._pending.pop), timeout)
+            except asyncio.TimeoutError:
+                return None
+        job.status = 'running'
+        return job
+
+    async def position(self, job: DownloadJob) -> Optional[int]:
+        return self._pending.position(job)
+
+    async def _finish(self, job: DownloadJob):
+        ready, finished = self._queues()
+        async with ready:
+            self._pending.done(job.user_id)
+            # قد يصبح للمستخدم مكان لمهمة أخرى
+            ready.notify_all()
+        finished.put_nowait(job)
+
+    async def complete(self, job: DownloadJob, result: Dict[str, Any]):
+        job.status = 'done'
+        job.result = result
+        await self._finish(job)
+
+    async def fail(self, job: DownloadJob, error: str):
+        job.status = 'failed'
+        job.error = error
+        await self._finish(job)
+
+    async def finished(self, timeout: float) -> List[DownloadJob]:
+        _, finished = self._queues()
+        try:
+            jobs = [await asyncio.wait_for(finished.get(), timeout)]
+        except asyncio.TimeoutError:
+            return []
+        while not finished.empty():
+            jobs.append(finished.get_nowait())
+        return jobs
+
+    async def request_cancel(self, user_id: int):
+        self._cancel_requests[user_id] = time.time()
+
+    async def is_cancelled(self, job: DownloadJob) -> bool:
+        return job.created_at <= self._cancel_requests.get(job.user_id, 0)
+
+class DatabaseJobQueue(JobQueue):
+    """طابور دائم في جدول jobs (SQLite أو PostgreSQL)، يحجز بالعدل بين المستخدمين (claim_job)"""
+
+    name = 'database'
+
+    async def enqueue(self, job: DownloadJob):
+        await db.enqueue_job({
+            'id': job.id,
+            'kind': job.kind,
+            'user_id': job.user_id,
+            'chat_id': job.chat_id,
+            'message_id': job.message_id,
+            'payload': job.payload
+        })
+
+    async def claim(self, worker_id: str, timeout: float) -> Optional[DownloadJob]:
+        row = await db.claim_job(worker_id)
+        if row is None:
+            await asyncio.sleep(min(timeout, config.JOB_POLL_INTERVAL))
+            return None
+        return DownloadJob.from_row(row)
+
+    async def heartbeat(self, job: DownloadJob):
+        await db.heartbeat_job(job.id)
+
+    async def complete(self, job: DownloadJob, result: Dict[str, Any]):
+        await db.finish_job(job.id, 'done', result=result)
+
+    async def fail(self, job: DownloadJob, error: str):
+        await db.finish_job(job.id, 'failed', error_message=error)
+
+    async def finished(self, timeout: float) -> List[DownloadJob]:
+        rows = await db.claim_finished_jobs()
+        if not rows:
+            await asyncio.sleep(min(timeout, config.JOB_POLL_INTERVAL))
+        return [DownloadJob.from_row(row) for row in rows]
+
+    async def ack(self, job: DownloadJob):
+        await db.mark_job_delivered(job.id)
+
+    async def request_cancel(self, user_id: int):
+        await db.request_job_cancel(user_id)
+
+    async def is_cancelled(self, job: DownloadJob) -> bool:
+        return await db.is_job_cancel_requested(job.id)
+
+    async def reap_stale(self, stale_before: float) -> int:
+        return await db.abandon_stale_jobs(datetime.fromtimestamp(stale_before, timezone.utc))
+
+class RedisJobQueue(JobQueue):
+    """طابور مشترك في Redis بين عدة عمليات أو أجهزة
+
+    الحجز بترتيب الوصول (brpoplpush)؛ العدل بين المستخدمين يُطبق محلياً على خانات التنزيل في كل عامل.
+    """
+
+    name = 'redis'
+
+    PENDING = "jobs:pending"
+    PROCESSING = "jobs:processing"
+    FINISHED = "jobs:finished"
+    HEARTBEATS = "jobs:heartbeats"
+    CANCEL_KEY = "jobs:cancel:{}"  # وقت آخر طلب إلغاء للمستخدم
+    JOB_KEY = "job:{}"
+
+    def __init__(self, redis_url: str):
+        self.redis = aioredis.from_url(redis_url, decode_responses=True)
+
+    async def _save(self, job: DownloadJob):
+        await self.redis.set(self.JOB_KEY.format(job.id), job.to_json())
+
+    async def _load(self, job_id: str) -> Optional[DownloadJob]:
+        raw = await self.redis.get(self.JOB_KEY.format(job_id))
+        return DownloadJob.from_json(raw) if raw else None
+
+    async def enqueue(self, job: DownloadJob):
+        await self._save(job)
+        await self.redis.lpush(self.PENDING, job.id)
+
+    async def claim(self, worker_id: str, timeout: float) -> Optional[DownloadJob]:
+        # النقل الذري إلى قائمة المعالجة حتى لا تضيع المهمة إذا توقف العامل
+        job_id = await self.redis.brpoplpush(self.PENDING, self.PROCESSING, timeout=max(1, int(timeout)))
+        if not job_id:
+            return None
+
+        job = await self._load(job_id)
+        if job is None:
+            await self.redis.lrem(self.PROCESSING, 0, job_id)
+            return None
+
+        job.status = 'running'
+        await self._save(job)
+        await self.heartbeat(job)
+        return job
+
+    async def heartbeat(self, job: DownloadJob):
+        await self.redis.hset(self.HEARTBEATS, job.id, time.time())
+
+    async def _finish(self, job: DownloadJob):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.set(self.JOB_KEY.format(job.id), job.to_json())
+            pipe.lrem(self.PROCESSING, 0, job.id)
+            pipe.hdel(self.HEARTBEATS, job.id)
+            pipe.lpush(self.FINISHED, job.id)
+            await pipe.execute()
+
+    async def complete(self, job: DownloadJob, result: Dict[str, Any]):
+        job.status = 'done'
+        job.result = result
+        await self._finish(job)
+
+    async def fail(self, job: DownloadJob, error: str):
+        job.status = 'failed'
+        job.error = error
+        await self._finish(job)
+
+    async def finished(self, timeout: float) -> List[DownloadJob]:
+        item = await self.redis.brpop(self.FINISHED, timeout=max(1, int(timeout)))
+        if not item:
+            return []
+        job = await self._load(item[1])
+        return [job] if job else []
+
+    async def ack(self, job: DownloadJob):
+        await self.redis.delete(self.JOB_KEY.format(job.id))
+
+    async def request_cancel(self, user_id: int):
+        # تشمل المهام التي أُنشئت قبل الطلب فقط؛ ينتهي المفتاح بعد أطول مهلة ممكنة
+        await self.redis.set(self.CANCEL_KEY.format(user_id), time.time(), ex=config.PLAYLIST_TIMEOUT)
+
+    async def is_cancelled(self, job: DownloadJob) -> bool:
+        requested = await self.redis.get(self.CANCEL_KEY.format(job.user_id))
+        return requested is not None and job.created_at <= float(requested)
+
+    async def reap_stale(self, stale_before: float) -> int:
+        reaped = 0
+        for job_id, beat in (await self.redis.hgetall(self.HEARTBEATS)).items():
+            if float(beat) >= stale_before:
+                continue
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.lrem(self.PROCESSING, 0, job_id)
+                pipe.hdel(self.HEARTBEATS, job_id)
+                pipe.delete(self.JOB_KEY.format(job_id))
+                await pipe.execute()
+            reaped += 1
+        return reaped
+
+    async def ping(self) -> bool:
+        try:
+            return bool(await self.redis.ping())
+        except Exception as e:
+            logger.warning(f"Redis ping failed: {e}")
+            return False
+
+    async def close(self):
+        await self.redis.close()
+
+def create_job_queue(backend: Optional[str] = None) -> JobQueue:
+    """إنشاء طابور المهام حسب الإعدادات (local أو database أو redis)"""
+    backend = (backend or config.JOB_QUEUE_BACKEND).lower()
+
+    if backend == 'redis':
+        if aioredis is None or not config.REDIS_URL:
+            raise ValueError("Redis job queue requires REDIS_URL and the redis package")
+        return RedisJobQueue(config.REDIS_URL)
+
+    if backend == 'database':
+        return DatabaseJobQueue()
+
+    return LocalJobQueue()
+
+class JobWorker:
+    """عامل يستهلك مهام التنزيل من الطابور وينفذها"""
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        bot: Bot,
+        concurrency: Optional[int] = None,
+        worker_id: Optional[str] = None
+    ):
+        self.queue = queue
+        self.bot = bot
+        self.concurrency = concurrency or config.WORKER_CONCURRENCY
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.running = False
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self):
+        self.running = True
+        self._tasks = [asyncio.create_task(self._consume()) for _ in range(self.concurrency)]
+        logger.info(f"Job worker {self.worker_id} started ({self.concurrency} slots, {self.queue.name} queue)")
+
+    async def stop(self):
+        self.running = False
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def run(self):
+        """التشغيل حتى الإيقاف"""
+        await self.start()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _consume(self):
+        while self.running:
+            try:
+                job = await self.queue.claim(self.worker_id, timeout=config.JOB_POLL_INTERVAL)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Failed to claim job: {e}")
+                await asyncio.sleep(config.JOB_POLL_INTERVAL)
+                continue
+
+            if not job:
+                continue
+            try:
+                await self._process(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # لا تنتهي الخانة بخطأ طابور؛ المهمة المحجوزة يستعيدها فحص المهام المتوقفة
+                logger.error(f"Job {job.id} processing failed: {e}")
+
+    async def _fail(self, job: DownloadJob, message: str):
+        """تسجيل فشل المهمة بأفضل جهد؛ خطأ الطابور هنا لا يوقف العامل"""
+        try:
+            await self.queue.fail(job, message)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Failed to mark job {job.id} as failed: {e}")
+
+    async def _process(self, job: DownloadJob):
+        try:
+            cancelled = await self.queue.is_cancelled(job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Job {job.id} cancel check failed: {e}")
+            cancelled = False
+        if cancelled:
+            logger.info(f"Job {job.id} cancelled before start")
+            await self._fail(job, config.Messages.INFO_CANCELLED)
+            return
+
+        # رمز واحد للمهمة كلها، مسجل باسم المستخدم حتى يصل إليه /cancel في هذه العملية
+        token = CancelToken(config.PLAYLIST_TIMEOUT if job.kind == 'playlist' else config.DOWNLOAD_TIMEOUT)
+        heartbeat = asyncio.create_task(self._heartbeat(job, token))
+        try:
+            with downloader.track(job.user_id, token):
+                result = await self.execute(job, token)
+            await self.queue.complete(job, result)
+        except asyncio.CancelledError:
+            raise
+        except DownloadCancelled as e:
+            logger.info(f"Job {job.id} cancelled ({e.reason})")
+            message = config.Messages.ERROR_DOWNLOAD_TIMEOUT if e.reason == 'timeout' else config.Messages.INFO_CANCELLED
+            await self._fail(job, message)
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {e}")
+            await self._fail(job, str(e))
+        finally:
+            heartbeat.cancel()
+
+    async def _heartbeat(self, job: DownloadJob, token: CancelToken):
+        while True:
+            await asyncio.sleep(config.JOB_HEARTBEAT_INTERVAL)
+            try:
+                await self.queue.heartbeat(job)
+                # طلبات الإلغاء من نسخة أخرى للبوت تصل عبر الطابور
+                if await self.queue.is_cancelled(job):
+                    token.cancel('user')
+            except Exception as e:
+                logger.warning(f"Job heartbeat failed: {e}")
+
+    async def execute(self, job: DownloadJob, token: Optional[CancelToken] = None) -> Dict[str, Any]:
+        """تنفيذ المهمة وإرجاع الملفات الناتجة"""
+        token = token or CancelToken(config.DOWNLOAD_TIMEOUT)
+        if job.kind == 'playlist':
+            return await self._run_playlist(job, token)
+        return await self._run_video(job, token)
+
+    async def _run_video(self, job: DownloadJob, token: CancelToken) -> Dict[str, Any]:
+        payload = job.payload
+        url = payload['url']
+        download_type = payload.get('download_type', 'video')
+
+        video_info = await token.run(downloader.extract_video_summary(url))
+        if not video_info:
+            raise Exception("Failed to extract video information")
+
+        files = []
+
+        if download_type in ('video', 'both') and not payload.get('skip_video'):
+            file_path = await downloader.download_video(
+                url,
+                payload['quality'],
+                job.user_id,
+                self._video_progress(job),
+                video_info=video_info,
+                download_id=payload.get('download_id'),
+                cancel_token=token
+            )
+            if file_path:
+                files.append({
+                    'path': file_path,
+                    'type': 'video',
+                    'video_id': video_info.id,
+                    'format': payload['quality']
+                })
+
+        if download_type in ('subtitle', 'both') and not payload.get('skip_subtitle'):
+            subtitle_path = await downloader.download_subtitle(
+                url,
+                payload['subtitle_lang'],
+                payload['subtitle_format'],
+                job.user_id,
+                video_info=video_info,
+                download_id=payload.get('download_id'),
+                cancel_token=token
+            )
+            if subtitle_path:
+                files.append({
+                    'path': subtitle_path,
+                    'type': 'document',
+                    'video_id': video_info.id,
+                    'format': subtitle_key(payload['subtitle_lang'], payload['subtitle_format'])
+                })
+
+        if not files:
+            raise Exception("Download failed")
+
+        return {'files': files}
+
+    async def _run_playlist(self, job: DownloadJob, token: CancelToken) -> Dict[str, Any]:
+        payload = job.payload
+        result = await downloader.download_playlist(
+            payload['url'],
+            payload['quality'],
+            job.user_id,
+            progress_callback=self._playlist_progress(job),
+            cancel_token=token
+        )
+
+        if result.get('status') == 'failed':
+            raise Exception(result.get('error', 'Playlist download failed'))
+
+        return {
+            'playlist': {
+                'total_videos': result.get('total_videos', 0),
+                'completed': result.get('completed', 0),
+                'failed': result.get('failed', 0)
+            },
+            'files': [
+                {
+                    'path': item['file_path'],
+                    'type': 'video',
+                    'video_id': item['video_id'],
+                    'format': result.get('quality')
+                }
+                for item in result.get('downloaded_items', [])
+            ]
+        }
+
+    async def _edit_status(self, job: DownloadJob, text: str, **kwargs):
+        """تحديث رسالة الحالة الخاصة بالمهمة"""
+        if not job.message_id:
+            return
+        try:
+            await self.bot.edit_message_text(text, chat_id=job.chat_id, message_id=job.message_id, **kwargs)
+        except TelegramBadRequest:
+            pass
+
+    def _video_progress(self, job: DownloadJob):
+        last_text = None
+
+        # يُستدعى بإيقاع محدود من جسر التقدم في حلقة الأحداث
+        async def progress_callback(progress: DownloadProgress):
+            nonlocal last_text
+            if progress.status == 'queued':
+                # بانتظار خانة تنزيل في الجدولة العادلة
+                text = config.Messages.INFO_QUEUE_POSITION.format(position=progress.queue_position)
+                if text != last_text:
+                    last_text = text
+                    await self._edit_status(job, text)
+                return
+
+            percent = progress.percent if progress.percent else 0
+            speed_str = humanize.naturalsize(progress.speed) if progress.speed else "0"
+            downloaded_str = humanize.naturalsize(progress.downloaded_bytes)
+            total_str = humanize.naturalsize(progress.total_bytes) if progress.total_bytes else "غير محدد"
+
+            progress_text = f"""
+⬇️ **جاري التنزيل...**
+
+📊 التقدم: {percent:.1f}%
+📥 تم تنزيل: {downloaded_str} / {total_str}
+🚀 السرعة: {speed_str}/ث
+            """
+            if progress.rate_limit:
+                progress_text += f"🚦 الحد الحالي: {humanize.naturalsize(progress.rate_limit)}/ث\n"
+
+            # تجاهل النص المطابق لتوفير استدعاءات API
+            if progress_text == last_text:
+                return
+            last_text = progress_text
+            await self._edit_status(job, progress_text, parse_mode="Markdown")
+
+        return progress_callback
+
+    def _playlist_progress(self, job: DownloadJob):
+        last_text = None
+
+        # رسالة حالة واحدة مجمعة لكل قائمة التشغيل
+        async def progress_callback(progress: PlaylistProgress):
+            nonlocal last_text
+            text = (
+                f"📥 تنزيل قائمة التشغيل: {progress.completed + progress.failed}/{progress.total}\n"
+                f"✅ تم: {progress.completed} | ❌ فشل: {progress.failed} | ⏳ جارٍ: {progress.active}"
+            )
+            if progress.active and progress.current_title:
+                text += f"\n🎬 {progress.current_title[:60]}"
+
+            if text == last_text:
+                return
+            last_text = text
+            await self._edit_status(job, text)
+
+        return progress_callback
@@ -17,6 +17,9 @@ from config import config
 from bot_handler import bot_handler
 from database import db
 from downloader import downloader
+from disk_cache import disk_cache
+from retention import archiver
+from store import content_store
 import uvloop
 
 # إعداد نظام السجلات
@@ -66,6 +69,7 @@ class BotApplication:
         self.logger = setup_logging()
         self.running = False
         self.cleanup_task = None
+        self.archive_task = None
     
     async def startup(self):
         """بدء تشغيل التطبيق"""
@@ -82,8 +86,15 @@ class BotApplication:
             # عرض إحصائيات البدء
             await self._show_startup_stats()
             
-            # بدء مهمة تنظيف الملفات القديمة
-            self.cleanup_task = asyncio.create_task(self._periodic_cleanup())
+            # استئناف التنزيلات التي قطعها الإيقاف السابق
+            await self._recover_downloads()
+            
+            # إدارة مساحة المخزن (إخلاء LRU وحذف الملفات الجزئية المهملة)
+            self.cleanup_task = asyncio.create_task(disk_cache.run())
+            
+            # نقل أشهر سجل التنزيلات القديمة إلى الأرشيف
+            if config.DOWNLOAD_RETENTION_DAYS > 0:
+                self.archive_task = asyncio.create_task(archiver.run())
             
             self.running = True
             self.logger.info("✅ Bot application started successfully")
@@ -99,17 +110,22 @@ class BotApplication:
             
             self.running = False
             
-            # إلغاء مهمة التنظيف
-            if self.cleanup_task:
-                self.cleanup_task.cancel()
-                try:
-                    await self.cleanup_task
-                except asyncio.CancelledError:
-                    pass
+            # إلغاء مهام الخلفية
+            for task in (self.cleanup_task, self.archive_task):
+                if task:
+                    task.cancel()
+                    try:
+                        await task
+                    except asyncio.CancelledError:
+                        pass
             
             # إغلاق البوت
             await bot_handler.stop()
             
+            # إيقاف مجمعات التنفيذ
+            downloader.shutdown()
+            disk_cache.shutdown()
+            
             # تنظيف أخير للملفات المؤقتة
             await self._final_cleanup()
             
@@ -144,27 +160,24 @@ class BotApplication:
         except Exception as e:
             self.logger.warning(f"Could not retrieve startup stats: {e}")
     
-    async def _periodic_cleanup(self):
-        """تنظيف دوري للملفات القديمة"""
-        while self.running:
-            try:
-                await asyncio.sleep(24 * 3600)  # كل 24 ساعة
-                
-                if self.running:
-                    self.logger.info("🧹 Starting periodic cleanup...")
-                    await downloader.cleanup_old_files(days=3)
-                    self.logger.info("✅ Periodic cleanup completed")
-                    
-            except asyncio.CancelledError:
-                break
-            except Exception as e:
-                self.logger.error(f"❌ Periodic cleanup error: {e}")
+    async def _recover_downloads(self):
+        """استئناف التنزيلات المتوقفة من ملفاتها الجزئية"""
+        try:
+            resumed = await bot_handler.recover_interrupted_downloads()
+            if resumed:
+                self.logger.info(f"🔄 Resumed {resumed} interrupted downloads")
+        except Exception as e:
+            self.logger.error(f"❌ Download recovery failed: {e}")
     
     async def _final_cleanup(self):
         """تنظيف نهائي قبل الإغلاق"""
         try:
             # تنظيف الملفات المؤقتة
-            temp_files = list(config.DOWNLOAD_PATH.rglob("*.tmp"))
+            # (المجلدات المؤقتة للتنزيلات تبقى كما هي ليستأنفها التشغيل التالي)
+            temp_files = [
+                path for path in config.DOWNLOAD_PATH.rglob("*.tmp")
+                if content_store.staging_root not in path.parents
+            ]
             for temp_file in temp_files:
                 try:
                     temp_file.unlink()
@@ -213,9 +226,12 @@ async def main():
         # بدء التطبيق
         await app.startup()
         
-        # بدء البوت
+        # بدء البوت (webhook أو long polling)
         try:
-            await bot_handler.start_polling()
+            if config.RUN_MODE == 'webhook':
+                await bot_handler.start_webhook()
+            else:
+                await bot_handler.start_polling()
         except KeyboardInterrupt:
             logger.info("👋 Received keyboard interrupt")
         except Exception as e:
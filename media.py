@@ -0,0 +1,145 @@
+"""
+معالجة الوسائط بـ ffmpeg
+
+الدمج وإعادة الترميز يعملان داخل مجمع العمليات، لذلك كل الدوال على مستوى الوحدة.
+"""
+import asyncio
+import os
+import subprocess
+from pathlib import Path
+from typing import AsyncIterator, Optional
+import ffmpeg
+
+# ملف الإيقاف في المجلد المؤقت: العملية الأم لا تملك مقبض ffmpeg الذي يعمل في مجمع العمليات
+STOP_FILE = '.stop'
+STOP_POLL_INTERVAL = 0.5
+
+def _run(stream, stop_path: Optional[str] = None):
+    """تشغيل أمر ffmpeg مع تحويل الخطأ إلى استثناء قابل للنقل بين العمليات
+
+    مع stop_path يُقتل ffmpeg فور ظهور ملف الإيقاف (إلغاء التنزيل الذي يكتب في المجلد نفسه).
+    """
+    process = stream.overwrite_output().run_async(pipe_stdout=True, pipe_stderr=True)
+    while True:
+        try:
+            _, stderr = process.communicate(timeout=STOP_POLL_INTERVAL)
+            break
+        except subprocess.TimeoutExpired:
+            if stop_path and os.path.exists(stop_path):
+                process.kill()
+                process.communicate()
+                raise RuntimeError("ffmpeg stopped: download cancelled") from None
+    if process.returncode:
+        stderr = (stderr or b'').decode('utf-8', errors='replace').strip()
+        raise RuntimeError(f"ffmpeg failed: {stderr[-500:]}")
+
+def mux_streams(video_path: str, audio_path: str, output_path: str, stop_path: Optional[str] = None) -> str:
+    """دمج مسار الفيديو ومسار الصوت في ملف واحد دون إعادة ترميز"""
+    video = ffmpeg.input(video_path)
+    audio = ffmpeg.input(audio_path)
+
+    options = {'c': 'copy'}
+    if output_path.endswith('.mp4'):
+        options['movflags'] = '+faststart'  # التشغيل قبل اكتمال التحميل في تليجرام
+
+    _run(ffmpeg.output(video.video, audio.audio, output_path, **options), stop_path)
+    return output_path
+
+def has_audio(path: str) -> bool:
+    """هل يحتوي الملف على مسار صوت"""
+    try:
+        probe = ffmpeg.probe(path, select_streams='a')
+    except ffmpeg.Error as e:
+        stderr = (e.stderr or b'').decode('utf-8', errors='replace').strip()
+        raise RuntimeError(f"ffprobe failed: {stderr[-500:]}") from None
+    return bool(probe.get('streams'))
+
+def transcode_to_fit(
+    input_path: str,
+    output_path: str,
+    video_kbps: int,
+    audio_kbps: int,
+    height: Optional[int] = None,
+    threads: int = 2,
+    preset: str = 'veryfast',
+    stop_path: Optional[str] = None
+) -> str:
+    """إعادة الترميز إلى H.264/AAC بمعدل بت محدد (مع تصغير اختياري)
+
+    threads يحد عدد أنوية المعالج لكل مهمة حتى لا تستحوذ مهمة واحدة على الجهاز.
+    """
+    source = ffmpeg.input(input_path)
+    video = source.video
+    if height:
+        video = video.filter('scale', -2, height)
+
+    streams = [video]
+    options = {
+        'vcodec': 'libx264',
+        'preset': preset,
+        'b:v': f'{video_kbps}k',
+        'maxrate': f'{video_kbps}k',
+        'bufsize': f'{video_kbps * 2}k',
+        'threads': threads,
+        'movflags': '+faststart'
+    }
+    if has_audio(input_path):
+        streams.append(source.audio)
+        options.update({'acodec': 'aac', 'b:a': f'{audio_kbps}k'})
+
+    _run(ffmpeg.output(*streams, output_path, **options), stop_path)
+    return output_path
+
+def probe_duration(path: str) -> float:
+    """مدة الملف بالثواني"""
+    try:
+        probe = ffmpeg.probe(path)
+    except ffmpeg.Error as e:
+        stderr = (e.stderr or b'').decode('utf-8', errors='replace').strip()
+        raise RuntimeError(f"ffprobe failed: {stderr[-500:]}") from None
+    return float(probe['format'].get('duration') or 0)
+
+async def iter_segments(input_path: str, output_dir: Path, segment_time: float) -> AsyncIterator[Path]:
+    """تقطيع الملف دون إعادة ترميز عند الإطارات المفتاحية، وإرجاع كل جزء فور اكتماله
+
+    ffmpeg يكتب اسم كل جزء مكتمل في segment_list على stdout، فيمكن رفع الجزء الأول
+    بينما يُقطع الجزء التالي.
+    """
+    suffix = Path(input_path).suffix or '.mp4'
+    command = (
+        ffmpeg
+        .input(input_path)
+        .output(
+            str(output_dir / f"part%03d{suffix}"),
+            c='copy',
+            map=0,
+            f='segment',
+            segment_time=f"{segment_time:.3f}",
+            reset_timestamps=1,
+            segment_list='pipe:1',
+            segment_list_type='flat'
+        )
+        .compile()
+    )
+    # ffmpeg-python يضع الخيارات العامة بعد المخرج، و ffmpeg يتجاهل الخيارات اللاحقة
+    args = [command[0], '-loglevel', 'error', *command[1:]]
+
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        async for line in process.stdout:
+            name = line.decode('utf-8').strip()
+            if name:
+                yield output_dir / Path(name).name
+
+        stderr = await process.stderr.read()
+        if await process.wait() != 0:
+            raise RuntimeError(f"ffmpeg segment failed: {stderr.decode('utf-8', errors='replace')[-500:]}")
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
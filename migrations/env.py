@@ -0,0 +1,54 @@
+"""
+بيئة ترحيلات Alembic: على اتصال البوت عند البدء، أو على DATABASE_URL من سطر الأوامر
+"""
+import asyncio
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from config import config as bot_config
+from database import Base, async_database_url
+
+alembic_config = context.config
+target_metadata = Base.metadata
+
+def run_migrations(connection):
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        # SQLite لا يدعم معظم ALTER TABLE؛ الوضع الدفعي يعيد بناء الجدول
+        render_as_batch=connection.dialect.name == 'sqlite'
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+def run_migrations_offline():
+    context.configure(
+        url=async_database_url(bot_config.DATABASE_URL),
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"}
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+async def run_migrations_cli():
+    engine = create_async_engine(async_database_url(bot_config.DATABASE_URL))
+    try:
+        async with engine.begin() as connection:
+            await connection.run_sync(run_migrations)
+    finally:
+        await engine.dispose()
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    connection = alembic_config.attributes.get('connection')
+    if connection is not None:
+        # من DatabaseManager.init_db داخل معاملته
+        run_migrations(connection)
+    else:
+        if alembic_config.config_file_name:
+            fileConfig(alembic_config.config_file_name)
+        asyncio.run(run_migrations_cli())
@@ -0,0 +1,161 @@
+"""initial schema
+
+المخطط الذي كان ينشئه Base.metadata.create_all. قواعد البيانات التي أُنشئت قبل الترحيلات تحتوي
+على الجداول مسبقاً، فيُنشأ الناقص فقط وتُضاف الأعمدة التي أُضيفت لاحقاً إلى النماذج
+(create_all لا يعدل جدولاً موجوداً).
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17 00:00:00
+
+"""
+from typing import Callable, Dict, List, Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _users() -> List[sa.Column]:
+    return [
+        sa.Column('id', sa.BigInteger(), primary_key=True, autoincrement=False),
+        sa.Column('username', sa.String(100), nullable=True),
+        sa.Column('first_name', sa.String(100), nullable=True),
+        sa.Column('last_name', sa.String(100), nullable=True),
+        sa.Column('language_code', sa.String(10), nullable=True),
+        sa.Column('is_active', sa.Boolean(), nullable=True),
+        sa.Column('is_premium', sa.Boolean(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('last_activity', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('preferred_quality', sa.String(10), nullable=True),
+        sa.Column('preferred_subtitle_lang', sa.String(10), nullable=True),
+        sa.Column('preferred_subtitle_format', sa.String(10), nullable=True),
+        sa.Column('download_count', sa.Integer(), nullable=True),
+        sa.Column('total_size_downloaded', sa.BigInteger(), nullable=True),
+    ]
+
+
+def _downloads() -> List[sa.Column]:
+    return [
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('user_id', sa.BigInteger(), nullable=False),
+        sa.Column('url', sa.Text(), nullable=False),
+        sa.Column('title', sa.Text(), nullable=True),
+        sa.Column('video_id', sa.String(20), nullable=True),
+        sa.Column('quality', sa.String(10), nullable=True),
+        sa.Column('file_size', sa.BigInteger(), nullable=True),
+        sa.Column('duration', sa.Integer(), nullable=True),
+        sa.Column('download_type', sa.String(20), nullable=True),
+        sa.Column('status', sa.String(20), nullable=True),
+        sa.Column('file_path', sa.Text(), nullable=True),
+        sa.Column('error_message', sa.Text(), nullable=True),
+        sa.Column('file_metadata', sa.JSON(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('heartbeat_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('completed_at', sa.DateTime(timezone=True), nullable=True),
+    ]
+
+
+def _playlist_downloads() -> List[sa.Column]:
+    return [
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('user_id', sa.BigInteger(), nullable=False),
+        sa.Column('playlist_url', sa.Text(), nullable=False),
+        sa.Column('playlist_title', sa.Text(), nullable=True),
+        sa.Column('playlist_id', sa.String(50), nullable=True),
+        sa.Column('total_videos', sa.Integer(), nullable=True),
+        sa.Column('completed_videos', sa.Integer(), nullable=True),
+        sa.Column('failed_videos', sa.Integer(), nullable=True),
+        sa.Column('quality', sa.String(10), nullable=True),
+        sa.Column('status', sa.String(20), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('completed_at', sa.DateTime(timezone=True), nullable=True),
+    ]
+
+
+def _telegram_files() -> List[sa.Column]:
+    return [
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('video_id', sa.String(20), nullable=False),
+        sa.Column('format', sa.String(40), nullable=False),
+        sa.Column('file_type', sa.String(20), nullable=False),
+        sa.Column('file_id', sa.Text(), nullable=False),
+        sa.Column('file_unique_id', sa.String(100), nullable=True),
+        sa.Column('file_name', sa.Text(), nullable=True),
+        sa.Column('file_size', sa.BigInteger(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+    ]
+
+
+def _jobs() -> List[sa.Column]:
+    return [
+        sa.Column('id', sa.String(32), primary_key=True),
+        sa.Column('kind', sa.String(20), nullable=False),
+        sa.Column('user_id', sa.BigInteger(), nullable=False),
+        sa.Column('chat_id', sa.BigInteger(), nullable=False),
+        sa.Column('message_id', sa.BigInteger(), nullable=True),
+        sa.Column('payload', sa.JSON(), nullable=False),
+        sa.Column('status', sa.String(20), nullable=True),
+        sa.Column('result', sa.JSON(), nullable=True),
+        sa.Column('error_message', sa.Text(), nullable=True),
+        sa.Column('worker_id', sa.String(100), nullable=True),
+        sa.Column('attempts', sa.Integer(), nullable=True),
+        sa.Column('delivery_status', sa.String(20), nullable=True),
+        sa.Column('cancel_requested', sa.Boolean(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('started_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('heartbeat_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('finished_at', sa.DateTime(timezone=True), nullable=True),
+    ]
+
+
+TABLES: Dict[str, Callable[[], List[sa.Column]]] = {
+    'users': _users,
+    'downloads': _downloads,
+    'playlist_downloads': _playlist_downloads,
+    'telegram_files': _telegram_files,
+    'jobs': _jobs,
+}
+
+# (الجدول، الاسم، الأعمدة، فريد)
+INDEXES = [
+    ('downloads', 'ix_downloads_user_id', ['user_id'], False),
+    ('playlist_downloads', 'ix_playlist_downloads_user_id', ['user_id'], False),
+    ('jobs', 'ix_jobs_user_id', ['user_id'], False),
+    ('jobs', 'ix_jobs_status', ['status'], False),
+]
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    existing = set(inspector.get_table_names())
+
+    for table, columns in TABLES.items():
+        if table not in existing:
+            constraints = []
+            if table == 'telegram_files':
+                constraints.append(sa.UniqueConstraint('video_id', 'format', name='uq_telegram_files_video_format'))
+            op.create_table(table, *columns(), *constraints)
+            continue
+        present = {column['name'] for column in inspector.get_columns(table)}
+        missing = [column for column in columns() if column.name not in present]
+        if missing:
+            with op.batch_alter_table(table) as batch:
+                for column in missing:
+                    batch.add_column(column)
+
+    for table, name, columns, unique in INDEXES:
+        if table in existing and name in {index['name'] for index in inspector.get_indexes(table)}:
+            continue
+        op.create_index(name, table, columns, unique=unique)
+
+
+def downgrade() -> None:
+    for table in reversed(list(TABLES)):
+        op.drop_table(table)
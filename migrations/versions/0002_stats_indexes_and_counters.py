@@ -0,0 +1,60 @@
+"""stats indexes and counters
+
+فهارس مركبة لاستعلامات الحالة (الإحصائيات، الاسترداد، حجز المهام) وجدول download_stats
+للعدادات المجمعة بدلاً من COUNT(*) على downloads، مع تعبئته من البيانات الموجودة.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+GLOBAL_STATS_ID = 0
+
+
+def upgrade() -> None:
+    op.create_index('ix_downloads_user_status_created', 'downloads', ['user_id', 'status', 'created_at'])
+    op.create_index('ix_downloads_status_created', 'downloads', ['status', 'created_at'])
+    op.create_index('ix_jobs_status_created', 'jobs', ['status', 'created_at'])
+    op.create_index('ix_jobs_user_status', 'jobs', ['user_id', 'status'])
+
+    stats = op.create_table(
+        'download_stats',
+        sa.Column('user_id', sa.BigInteger(), primary_key=True, autoincrement=False),
+        sa.Column('completed_downloads', sa.BigInteger(), nullable=False),
+        sa.Column('users', sa.BigInteger(), nullable=False),
+    )
+
+    downloads = sa.table('downloads', sa.column('user_id'), sa.column('status'))
+    users = sa.table('users', sa.column('id'), sa.column('is_active'))
+    completed = downloads.c.status == 'completed'
+    columns = ['user_id', 'completed_downloads', 'users']
+
+    op.execute(stats.insert().from_select(columns, sa.select(
+        downloads.c.user_id, sa.func.count(), sa.literal(0)
+    ).where(completed).group_by(downloads.c.user_id)))
+
+    op.execute(stats.insert().from_select(columns, sa.select(
+        sa.literal(GLOBAL_STATS_ID),
+        sa.select(sa.func.count()).select_from(downloads).where(completed).scalar_subquery(),
+        sa.select(sa.func.count()).select_from(users).where(users.c.is_active == sa.true()).scalar_subquery()
+    )))
+
+
+def downgrade() -> None:
+    op.drop_table('download_stats')
+    op.drop_index('ix_jobs_user_status', table_name='jobs')
+    op.drop_index('ix_jobs_status_created', table_name='jobs')
+    op.drop_index('ix_downloads_status_created', table_name='downloads')
+    op.drop_index('ix_downloads_user_status_created', table_name='downloads')
@@ -0,0 +1,112 @@
+"""partition downloads
+
+created_at يصبح NOT NULL ومفتاحاً لسجل التنزيلات، وفهرس (user_id, created_at) يخدم "أحدث التنزيلات"
+بدلاً من فهرس user_id وحده. في PostgreSQL يتحول downloads إلى جدول مقسم شهرياً على created_at
+(مفتاحه الأساسي id, created_at) مع قسم افتراضي؛ تُنسخ الصفوف مرة واحدة إلى الأقسام.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 00:00:00
+
+"""
+from datetime import datetime, timezone
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (الاسم، الأعمدة) بعد هذا الترحيل
+INDEXES = [
+    ('ix_downloads_user_created', ['user_id', 'created_at']),
+    ('ix_downloads_user_status_created', ['user_id', 'status', 'created_at']),
+    ('ix_downloads_status_created', ['status', 'created_at']),
+]
+
+
+def _next_month(start: datetime) -> datetime:
+    return start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+
+
+def _create_partition(table: str, start: datetime):
+    end = _next_month(start)
+    op.execute(
+        f"CREATE TABLE downloads_y{start:%Y}m{start:%m} PARTITION OF {table} "
+        f"FOR VALUES FROM ('{start:%Y-%m-%d} 00:00:00+00') TO ('{end:%Y-%m-%d} 00:00:00+00')"
+    )
+
+
+def _partition_postgresql():
+    bind = op.get_bind()
+    sequence = bind.execute(sa.text("SELECT pg_get_serial_sequence('downloads', 'id')")).scalar()
+    oldest = bind.execute(sa.text(
+        "SELECT date_trunc('month', min(created_at) AT TIME ZONE 'UTC') FROM downloads"
+    )).scalar()
+
+    op.execute("CREATE TABLE downloads_partitioned (LIKE downloads INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)")
+    op.execute("ALTER TABLE downloads_partitioned ADD PRIMARY KEY (id, created_at)")
+
+    now = datetime.now(timezone.utc)
+    month = (oldest or now).replace(day=1, hour=0, minute=0, second=0, microsecond=0, tzinfo=timezone.utc)
+    last = _next_month(now.replace(day=1, hour=0, minute=0, second=0, microsecond=0))
+    while month <= last:
+        _create_partition('downloads_partitioned', month)
+        month = _next_month(month)
+    op.execute("CREATE TABLE downloads_default PARTITION OF downloads_partitioned DEFAULT")
+
+    op.execute("INSERT INTO downloads_partitioned SELECT * FROM downloads")
+    # التسلسل مملوك للجدول القديم فيُحذف معه؛ يُنقل إلى الجدول الجديد
+    op.execute(f"ALTER SEQUENCE {sequence} OWNED BY NONE")
+    op.execute("DROP TABLE downloads")
+    op.execute("ALTER TABLE downloads_partitioned RENAME TO downloads")
+    op.execute("ALTER TABLE downloads RENAME CONSTRAINT downloads_partitioned_pkey TO downloads_pkey")
+    op.execute(f"ALTER SEQUENCE {sequence} OWNED BY downloads.id")
+
+    for name, columns in INDEXES:
+        op.create_index(name, 'downloads', columns)
+
+
+def upgrade() -> None:
+    downloads = sa.table(
+        'downloads', sa.column('created_at'), sa.column('heartbeat_at'), sa.column('completed_at')
+    )
+    op.execute(downloads.update().where(downloads.c.created_at.is_(None)).values(
+        created_at=sa.func.coalesce(downloads.c.completed_at, downloads.c.heartbeat_at, sa.func.current_timestamp())
+    ))
+
+    if op.get_bind().dialect.name == 'postgresql':
+        _partition_postgresql()
+        return
+
+    with op.batch_alter_table('downloads') as batch:
+        batch.alter_column('created_at', existing_type=sa.DateTime(timezone=True), nullable=False)
+    op.drop_index('ix_downloads_user_id', table_name='downloads')
+    op.create_index('ix_downloads_user_created', 'downloads', ['user_id', 'created_at'])
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == 'postgresql':
+        sequence = op.get_bind().execute(sa.text("SELECT pg_get_serial_sequence('downloads', 'id')")).scalar()
+        op.execute("CREATE TABLE downloads_plain (LIKE downloads INCLUDING DEFAULTS)")
+        op.execute("INSERT INTO downloads_plain SELECT * FROM downloads")
+        op.execute(f"ALTER SEQUENCE {sequence} OWNED BY NONE")
+        op.execute("DROP TABLE downloads")
+        op.execute("ALTER TABLE downloads_plain RENAME TO downloads")
+        op.execute("ALTER TABLE downloads ADD CONSTRAINT downloads_pkey PRIMARY KEY (id)")
+        op.execute("ALTER TABLE downloads ALTER COLUMN created_at DROP NOT NULL")
+        op.execute(f"ALTER SEQUENCE {sequence} OWNED BY downloads.id")
+        for name, columns in INDEXES[1:]:
+            op.create_index(name, 'downloads', columns)
+        op.create_index('ix_downloads_user_id', 'downloads', ['user_id'])
+        return
+
+    op.drop_index('ix_downloads_user_created', table_name='downloads')
+    op.create_index('ix_downloads_user_id', 'downloads', ['user_id'])
+    with op.batch_alter_table('downloads') as batch:
+        batch.alter_column('created_at', existing_type=sa.DateTime(timezone=True), nullable=True)
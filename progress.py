@@ -0,0 +1,217 @@
+"""
+نقل تقدم التنزيل من خيوط yt-dlp إلى حلقة الأحداث مع تقليل عدد التحديثات
+"""
+import asyncio
+import threading
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional
+from config import config
+import logging
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class DownloadProgress:
+    """معلومات تقدم التنزيل"""
+    downloaded_bytes: int
+    total_bytes: int
+    speed: float
+    eta: int
+    percent: float
+    filename: str
+    status: str = 'downloading'  # queued, downloading, finished
+    queue_position: int = 0
+    rate_limit: int = 0  # حصة التنزيل الحالية من مدير عرض النطاق (0 = بدون حد)
+
+    @classmethod
+    def queued(cls, position: int) -> "DownloadProgress":
+        """انتظار خانة تنزيل في الجدولة العادلة"""
+        return cls(0, 0, 0, 0, 0.0, '', status='queued', queue_position=position)
+
+    @classmethod
+    def from_hook(cls, d: Dict) -> "DownloadProgress":
+        """إنشاء التقدم من قاموس خطاف yt-dlp"""
+        downloaded = d.get('downloaded_bytes') or 0
+        total = d.get('total_bytes') or d.get('total_bytes_estimate') or 0
+        if d.get('status') == 'finished':
+            percent = 100.0
+        else:
+            percent = downloaded * 100.0 / total if total else 0.0
+
+        return cls(
+            downloaded_bytes=downloaded,
+            total_bytes=total,
+            speed=d.get('speed') or 0,
+            eta=d.get('eta') or 0,
+            percent=min(percent, 100.0),
+            filename=d.get('filename', ''),
+            status=d.get('status', 'downloading'),
+            rate_limit=d.get('rate_limit') or 0
+        )
+
+@dataclass
+class PlaylistProgress:
+    """التقدم الإجمالي لتنزيل قائمة تشغيل"""
+    total: int
+    title: str = ''
+    completed: int = 0
+    failed: int = 0
+    active: int = 0
+    current_title: str = ''
+
+    @property
+    def percent(self) -> float:
+        return (self.completed + self.failed) * 100.0 / self.total if self.total else 100.0
+
+    @property
+    def status(self) -> str:
+        return 'finished' if self.completed + self.failed >= self.total else 'downloading'
+
+    @property
+    def filename(self) -> str:
+        return self.title
+
+    def snapshot(self) -> "PlaylistProgress":
+        return PlaylistProgress(**self.__dict__)
+
+class ThrottledProgress:
+    """يحتفظ بآخر حالة فقط ويرسلها بإيقاع محدد لكل رسالة
+
+    التحديث يُرسل عند مرور الفاصل الزمني الأدنى أو تقدم النسبة بالخطوة المحددة،
+    والحالة النهائية تُرسل دائماً (فوراً، وعند close إن بقيت معلقة).
+    """
+
+    def __init__(
+        self,
+        callback: Callable[[DownloadProgress], Awaitable[None]],
+        interval: Optional[float] = None,
+        min_step: Optional[float] = None
+    ):
+        self.callback = callback
+        self.interval = config.PROGRESS_UPDATE_INTERVAL if interval is None else interval
+        self.min_step = config.PROGRESS_UPDATE_STEP if min_step is None else min_step
+        self._latest: Optional[DownloadProgress] = None
+        self._last_emit = 0.0
+        self._last_percent = -100.0
+        self._last_filename = ''
+        self._task: Optional[asyncio.Task] = None
+        self._sleeping = False
+        self._closed = False
+
+    def push(self, progress: DownloadProgress):
+        """تسجيل أحدث حالة (يُستدعى من حلقة الأحداث)"""
+        if self._closed:
+            return
+        # ملف جديد (مثل مسار الصوت بعد الفيديو) يبدأ من الصفر
+        if progress.filename != self._last_filename:
+            self._last_filename = progress.filename
+            self._last_percent = -100.0
+
+        self._latest = progress
+        if self._task is not None and self._sleeping and self._due(progress):
+            # انتظار الفاصل لم يعد لازماً
+            self._task.cancel()
+            self._task = None
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._drain())
+
+    def _due(self, progress: DownloadProgress) -> bool:
+        return progress.status == 'finished' or progress.percent - self._last_percent >= self.min_step
+
+    async def _drain(self):
+        while self._latest is not None:
+            progress = self._latest
+            wait = self.interval - (time.monotonic() - self._last_emit)
+            if wait > 0 and not self._due(progress) and not self._closed:
+                self._sleeping = True
+                try:
+                    await asyncio.sleep(wait)
+                finally:
+                    self._sleeping = False
+                continue  # نرسل أحدث حالة بعد الانتظار
+
+            self._latest = None
+            await self._emit(progress)
+
+    async def _emit(self, progress: DownloadProgress):
+        self._last_emit = time.monotonic()
+        self._last_percent = progress.percent
+        try:
+            await self.callback(progress)
+        except Exception as e:
+            logger.error(f"Progress callback error: {e}")
+
+    async def close(self):
+        """إرسال آخر حالة معلقة دون انتظار الفاصل ثم التوقف عن قبول التحديثات"""
+        self._closed = True
+        task = self._task
+        if task and not task.done():
+            if self._sleeping:
+                task.cancel()
+            # تحديث جارٍ يكتمل، ثم يرسل _drain ما بقي فوراً
+            await asyncio.gather(task, return_exceptions=True)
+        progress, self._latest = self._latest, None
+        if progress is not None:
+            await self._emit(progress)
+
+class CombinedProgress:
+    """يجمع تقدم عدة مسارات تُنزل بالتوازي (فيديو وصوت) في تقدم واحد
+
+    الخطافات تُستدعى من خيوط مختلفة، والنتيجة تُمرر إلى خطاف واحد باسم الملف النهائي.
+    """
+
+    def __init__(self, hook: Callable[[Dict], None], filename: str, streams: int):
+        self.hook = hook
+        self.filename = filename
+        self.streams = streams
+        self._states: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def hook_for(self, stream: str) -> Callable[[Dict], None]:
+        def stream_hook(d: Dict):
+            if d.get('status') not in ('downloading', 'finished'):
+                return
+            with self._lock:
+                self._states[stream] = d
+                combined = self._combine()
+            self.hook(combined)
+        return stream_hook
+
+    def _combine(self) -> Dict:
+        states = list(self._states.values())
+        finished = len(states) == self.streams and all(d.get('status') == 'finished' for d in states)
+        return {
+            'status': 'finished' if finished else 'downloading',
+            'downloaded_bytes': sum(d.get('downloaded_bytes') or 0 for d in states),
+            'total_bytes': sum(d.get('total_bytes') or d.get('total_bytes_estimate') or 0 for d in states),
+            'speed': sum(d.get('speed') or 0 for d in states if d.get('status') == 'downloading'),
+            'rate_limit': sum(d.get('rate_limit') or 0 for d in states if d.get('status') == 'downloading'),
+            'eta': max((d.get('eta') or 0 for d in states), default=0),
+            'filename': self.filename
+        }
+
+class ProgressBridge:
+    """جسر آمن بين خطافات yt-dlp (داخل خيوط التنفيذ) وحلقة الأحداث"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.subscribers: List[ThrottledProgress] = []
+
+    def hook(self, d: Dict):
+        """خطاف التقدم لـ yt-dlp؛ لا يلمس حلقة الأحداث إلا عبر call_soon_threadsafe"""
+        if d.get('status') not in ('downloading', 'finished') or not self.subscribers:
+            return
+        self.loop.call_soon_threadsafe(self.publish, DownloadProgress.from_hook(d))
+
+    def publish(self, progress: DownloadProgress):
+        for subscriber in list(self.subscribers):
+            subscriber.push(progress)
+
+    def subscribe(self, subscriber: ThrottledProgress):
+        self.subscribers.append(subscriber)
+
+    async def unsubscribe(self, subscriber: ThrottledProgress):
+        if subscriber in self.subscribers:
+            self.subscribers.remove(subscriber)
+        await subscriber.close()
@@ -0,0 +1,121 @@
+"""
+الاحتفاظ بسجل التنزيلات: نقل الأشهر القديمة من downloads إلى أرشيف NDJSON مضغوط على القرص
+
+كل شهر في ملف ARCHIVE_PATH/downloads/2026-07.ndjson.gz بسطر JSON لكل سجل. تُضاف كل دفعة كعضو gzip
+جديد (يقرأ الملف كاملاً gzip.open أو zcat)، وتُكتب على القرص قبل حذف سجلاتها من الجدول؛ فإذا
+انقطعت العملية بين الخطوتين تتكرر الدفعة في الأرشيف ولا تضيع، ويُزال التكرار بالحقل id.
+"""
+import asyncio
+import gzip
+import json
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from config import config
+from database import Download, db, month_start, next_month, retention_cutoff
+
+logger = logging.getLogger(__name__)
+
+class DownloadArchiver:
+    """مهمة خلفية تُبقي downloads في حدود DOWNLOAD_RETENTION_DAYS
+
+    PostgreSQL: يُصدَّر القسم الشهري القديم كاملاً ثم يُحذف بـ DROP TABLE (بلا DELETE ولا تضخم فهارس).
+    SQLite والقسم الافتراضي: تُصدَّر السجلات وتُحذف على دفعات من ARCHIVE_BATCH.
+    """
+
+    def __init__(self, path: Path, batch_size: int):
+        self.path = path
+        self.batch_size = max(1, batch_size)
+        self.archived = 0
+        self.dropped_partitions = 0
+        self.last_run: Optional[datetime] = None
+
+    def archive_file(self, month: datetime) -> Path:
+        return self.path / 'downloads' / f"{month:%Y-%m}.ndjson.gz"
+
+    @staticmethod
+    def _record(download: Download) -> Dict[str, Any]:
+        record = {}
+        for column in Download.__table__.columns:
+            value = getattr(download, column.name)
+            record[column.name] = value.isoformat() if isinstance(value, datetime) else value
+        return record
+
+    def _append(self, lines: Dict[Path, List[str]]):
+        for file_path, records in lines.items():
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(file_path, 'ab') as raw:
+                with gzip.GzipFile(fileobj=raw, mode='wb') as archive:
+                    archive.write(''.join(records).encode('utf-8'))
+                raw.flush()
+                os.fsync(raw.fileno())
+
+    async def _export(self, rows: List[Download]):
+        lines: Dict[Path, List[str]] = defaultdict(list)
+        for row in rows:
+            record = json.dumps(self._record(row), ensure_ascii=False, default=str)
+            lines[self.archive_file(month_start(row.created_at))].append(record + '\n')
+        await asyncio.get_event_loop().run_in_executor(None, self._append, lines)
+
+    async def _move(self, before: datetime, since: Optional[datetime] = None, partition: Optional[str] = None) -> int:
+        """تصدير السجلات بين since وbefore، ثم حذفها دفعة دفعة أو حذف قسمها مرة واحدة"""
+        moved = 0
+        after_id = 0
+        while True:
+            rows = await db.get_downloads_before(before, after_id, self.batch_size, since=since)
+            if not rows:
+                break
+            await self._export(rows)
+            if partition is None:
+                await db.delete_downloads([row.id for row in rows])
+            after_id = rows[-1].id
+            moved += len(rows)
+        if partition is not None:
+            await db.drop_download_partition(partition)
+            self.dropped_partitions += 1
+        return moved
+
+    async def archive(self, now: Optional[datetime] = None) -> int:
+        """دورة أرشفة واحدة؛ تُرجع عدد السجلات المنقولة"""
+        cutoff = retention_cutoff(now)
+        if cutoff is None:
+            return 0
+        await db.ensure_download_partitions(now)
+
+        moved = 0
+        for name, start in await db.get_download_partitions():
+            if next_month(start) <= cutoff:
+                moved += await self._move(next_month(start), since=start, partition=name)
+        # SQLite، وما وقع في القسم الافتراضي
+        moved += await self._move(cutoff)
+
+        self.archived += moved
+        self.last_run = now or datetime.now(timezone.utc)
+        if moved:
+            logger.info(f"Archived {moved} downloads older than {cutoff:%Y-%m-%d} to {self.path}")
+        return moved
+
+    async def run(self):
+        """مهمة الخلفية: أرشفة عند البدء ثم كل ARCHIVE_INTERVAL ثانية"""
+        while True:
+            try:
+                await self.archive()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Downloads archival failed: {e}")
+            await asyncio.sleep(config.ARCHIVE_INTERVAL)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'archived': self.archived,
+            'dropped_partitions': self.dropped_partitions,
+            'last_run': self.last_run
+        }
+
+# مثيل عام من مؤرشف السجل
+archiver = DownloadArchiver(config.ARCHIVE_PATH, config.ARCHIVE_BATCH)
@@ -0,0 +1,212 @@
+"""
+جدولة عادلة بين المستخدمين (Weighted Fair Queuing) مع مسارات أولوية للمشتركين المميزين
+"""
+import asyncio
+import bisect
+import itertools
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+from config import config
+import logging
+
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class Lane:
+    """مسار أولوية: وزن حصة المستخدم والحد الأقصى لطلباته المتزامنة"""
+    weight: float
+    limit: int
+
+def download_lane(premium: bool) -> Lane:
+    """مسار خانات التنزيل حسب نوع الاشتراك"""
+    if premium:
+        return Lane(config.PREMIUM_WEIGHT, config.PREMIUM_DOWNLOAD_CONCURRENCY)
+    return Lane(1.0, config.USER_DOWNLOAD_CONCURRENCY)
+
+def job_lane(premium: bool) -> Lane:
+    """مسار مهام الطابور حسب نوع الاشتراك"""
+    if premium:
+        return Lane(config.PREMIUM_WEIGHT, config.PREMIUM_JOB_CONCURRENCY)
+    return Lane(1.0, config.USER_JOB_CONCURRENCY)
+
+class FairQueue:
+    """طابور عادل بالأوزان: كل مستخدم يحصل على خدمة بنسبة وزنه مهما كان عدد طلباته
+
+    لكل عنصر وسم بداية = max(الزمن الافتراضي، آخر وسم إنهاء للمستخدم) ووسم إنهاء = البداية + التكلفة / الوزن،
+    ويُخدم أصغر وسم إنهاء بين المستخدمين الذين لم يبلغوا حدهم من الطلبات الجارية. الحد لا يترك خانة
+    فارغة: إذا لم ينتظر إلا من بلغوا حدهم يُخدم أصغر وسم بينهم.
+    """
+
+    def __init__(self):
+        self.virtual_time = 0.0
+        self.running: Dict[Hashable, int] = {}
+        self._entries: List[Tuple[float, int, float, Hashable, Any]] = []  # (finish, seq, start, user, item) مرتبة
+        self._last_finish: Dict[Hashable, float] = {}
+        self._limits: Dict[Hashable, int] = {}
+        self._seq = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def push(self, user: Hashable, item: Any, lane: Lane, cost: float = 1.0):
+        start = max(self.virtual_time, self._last_finish.get(user, 0.0))
+        finish = start + cost / lane.weight
+        self._last_finish[user] = finish
+        self._limits[user] = lane.limit
+        bisect.insort(self._entries, (finish, next(self._seq), start, user, item))
+
+    def pop(self) -> Optional[Tuple[Hashable, Any]]:
+        """أصغر وسم إنهاء لمستخدم لم يبلغ حده، وإلا أصغر وسم عموماً؛ None إذا كان الطابور فارغاً"""
+        if not self._entries:
+            return None
+        index = next(
+            (
+                index for index, entry in enumerate(self._entries)
+                if self.running.get(entry[3], 0) < self._limits.get(entry[3], 1)
+            ),
+            0
+        )
+        _, _, start, user, item = self._entries.pop(index)
+        self.running[user] = self.running.get(user, 0) + 1
+        self.virtual_time = max(self.virtual_time, start)
+        return user, item
+
+    def done(self, user: Hashable):
+        """انتهاء طلب جارٍ للمستخدم"""
+        remaining = self.running.get(user, 0) - 1
+        if remaining > 0:
+            self.running[user] = remaining
+            return
+        self.running.pop(user, None)
+        self._forget(user)
+
+    def remove(self, item: Any) -> bool:
+        """حذف عنصر لم يُخدم بعد (إلغاء الانتظار) دون احتساب حصته على المستخدم"""
+        for index, entry in enumerate(self._entries):
+            if entry[4] is item:
+                del self._entries[index]
+                user = entry[3]
+                pending = [e[0] for e in self._entries if e[3] == user]
+                self._last_finish[user] = max(pending, default=min(entry[2], self._last_finish.get(user, 0.0)))
+                self._forget(user)
+                return True
+        return False
+
+    def _forget(self, user: Hashable):
+        # وسم المستخدم الخامل لا يؤثر بعد أن يتجاوزه الزمن الافتراضي
+        if user in self.running or self._last_finish.get(user, 0.0) > self.virtual_time:
+            return
+        if any(entry[3] == user for entry in self._entries):
+            return
+        self._last_finish.pop(user, None)
+        self._limits.pop(user, None)
+
+    def items(self) -> List[Tuple[Hashable, Any]]:
+        """العناصر المنتظرة بترتيب الخدمة المتوقع"""
+        return [(entry[3], entry[4]) for entry in self._entries]
+
+    def position(self, item: Any) -> Optional[int]:
+        for index, entry in enumerate(self._entries, 1):
+            if entry[4] is item:
+                return index
+        return None
+
+class _Waiter:
+    __slots__ = ('future', 'on_position', 'position')
+
+    def __init__(self, future: asyncio.Future, on_position: Optional[Callable[[int], None]]):
+        self.future = future
+        self.on_position = on_position
+        self.position = 0
+
+class FairScheduler:
+    """خانات تنزيل محدودة توزع على المستخدمين بالعدل (WFQ) بدلاً من ترتيب الوصول
+
+    يُنشأ داخل حلقة الأحداث ويُستخدم منها فقط.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = max(1, capacity)
+        self.queue = FairQueue()
+        self.active = 0
+        self.granted = 0
+        self.total_wait = 0.0
+
+    async def acquire(
+        self,
+        user: Hashable,
+        lane: Lane,
+        on_position: Optional[Callable[[int], None]] = None
+    ):
+        """انتظار خانة؛ on_position يستقبل موقع الطلب في الطابور كلما تغير"""
+        loop = asyncio.get_event_loop()
+        waiter = _Waiter(loop.create_future(), on_position)
+        queued_at = loop.time()
+        self.queue.push(user, waiter, lane)
+        self._dispatch()
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self.release(user)  # مُنحت الخانة قبل الإلغاء مباشرة
+            elif self.queue.remove(waiter):
+                self._notify_positions()
+            raise
+
+        self.granted += 1
+        self.total_wait += loop.time() - queued_at
+
+    def release(self, user: Hashable):
+        self.active -= 1
+        self.queue.done(user)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        user: Hashable,
+        lane: Lane,
+        on_position: Optional[Callable[[int], None]] = None
+    ):
+        await self.acquire(user, lane, on_position)
+        try:
+            yield
+        finally:
+            self.release(user)
+
+    def _dispatch(self):
+        changed = False
+        while self.active < self.capacity:
+            popped = self.queue.pop()
+            if popped is None:
+                break
+            user, waiter = popped
+            changed = True
+            if waiter.future.done():
+                self.queue.done(user)  # أُلغي ولم يُحذف بعد
+                continue
+            self.active += 1
+            waiter.future.set_result(None)
+        if changed or len(self.queue):
+            self._notify_positions()
+
+    def _notify_positions(self):
+        for position, (_, waiter) in enumerate(self.queue.items(), 1):
+            if waiter.on_position and waiter.position != position:
+                waiter.position = position
+                try:
+                    waiter.on_position(position)
+                except Exception as e:
+                    logger.warning(f"Queue position callback failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'capacity': self.capacity,
+            'active': self.active,
+            'waiting': len(self.queue),
+            'users': len(self.queue.running),
+            'granted': self.granted,
+            'avg_wait': self.total_wait / self.granted if self.granted else 0.0
+        }
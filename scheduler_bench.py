@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+محاكاة لقياس عدالة الجدولة وإنتاجيتها تحت حمل غير متوازن (بدون شبكة أو تليجرام)
+
+مستخدم واحد يرسل عدة قوائم تشغيل كبيرة دفعة واحدة، ومستخدمون عاديون ومميزون يرسلون
+فيديوهات قليلة على فترات، وتُقارن الجدولة العادلة (FairScheduler) بترتيب الوصول (FIFO).
+
+مثال: python scheduler_bench.py --slots 3 --heavy-playlists 3 --playlist-size 50 --light-users 10
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List
+
+sys.path.append(str(Path(__file__).parent))
+
+from scheduler import FairScheduler, Lane
+
+@dataclass
+class Request:
+    user: str
+    arrival: float  # بوحدات المحاكاة
+    service: float
+    lane: Lane
+    wait: float = 0.0
+    done: float = 0.0
+
+def build_workload(args) -> List[Request]:
+    rng = random.Random(args.seed)
+    normal = Lane(1.0, args.user_limit)
+    premium = Lane(args.premium_weight, args.premium_limit)
+
+    def service() -> float:
+        return rng.lognormvariate(0, 0.5)
+
+    requests = [
+        Request('heavy', 0.0, service(), normal)
+        for _ in range(args.heavy_playlists * args.playlist_size)
+    ]
+    for user in range(args.light_users):
+        for _ in range(rng.randint(1, 3)):
+            requests.append(Request(f'light{user}', rng.uniform(0, args.horizon), service(), normal))
+    for user in range(args.premium_users):
+        for _ in range(rng.randint(3, 6)):
+            requests.append(Request(f'premium{user}', rng.uniform(0, args.horizon), service(), premium))
+    return sorted(requests, key=lambda r: r.arrival)
+
+class FifoScheduler:
+    """ترتيب الوصول مع نفس عدد الخانات (السلوك السابق)"""
+
+    def __init__(self, capacity: int):
+        self.semaphore = asyncio.Semaphore(capacity)
+
+    async def acquire(self, user, lane):
+        await self.semaphore.acquire()
+
+    def release(self, user):
+        self.semaphore.release()
+
+async def simulate(policy: str, requests: List[Request], args) -> Dict[str, List[Request]]:
+    scheduler = FairScheduler(args.slots) if policy == 'fair' else FifoScheduler(args.slots)
+    loop = asyncio.get_event_loop()
+    start = loop.time()
+
+    def now() -> float:
+        return (loop.time() - start) / args.scale
+
+    async def run(request: Request):
+        await asyncio.sleep(request.arrival * args.scale)
+        await scheduler.acquire(request.user, request.lane)
+        request.wait = now() - request.arrival
+        try:
+            await asyncio.sleep(request.service * args.scale)
+        finally:
+            scheduler.release(request.user)
+        request.done = now()
+
+    runs = [Request(r.user, r.arrival, r.service, r.lane) for r in requests]
+    await asyncio.gather(*(run(r) for r in runs))
+
+    by_group: Dict[str, List[Request]] = {}
+    for request in runs:
+        group = request.user.rstrip('0123456789')
+        by_group.setdefault(group, []).append(request)
+    return by_group
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def report(policy: str, by_group: Dict[str, List[Request]]):
+    everything = [r for group in by_group.values() for r in group]
+    makespan = max(r.done for r in everything)
+    print(f"\n== {policy} ==  makespan {makespan:.1f}  throughput {len(everything) / makespan:.2f}/unit")
+    # slowdown = (الانتظار + الخدمة) / الخدمة؛ الجدولة العادلة تُبقيه قريباً من 1 لأصحاب الطلبات القليلة
+    print(f"{'group':<10}{'requests':>10}{'mean wait':>12}{'p95 wait':>12}{'slowdown':>12}")
+    for group, requests in sorted(by_group.items()):
+        waits = [r.wait for r in requests]
+        slowdown = statistics.mean((r.wait + r.service) / r.service for r in requests)
+        print(
+            f"{group:<10}{len(requests):>10}{statistics.mean(waits):>12.2f}"
+            f"{percentile(waits, 0.95):>12.2f}{slowdown:>12.2f}"
+        )
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Fair scheduler simulation benchmark")
+    parser.add_argument("--slots", type=int, default=3, help="خانات التنزيل")
+    parser.add_argument("--heavy-playlists", type=int, default=3, help="قوائم المستخدم الثقيل")
+    parser.add_argument("--playlist-size", type=int, default=50)
+    parser.add_argument("--light-users", type=int, default=10)
+    parser.add_argument("--premium-users", type=int, default=2)
+    parser.add_argument("--user-limit", type=int, default=2, help="USER_DOWNLOAD_CONCURRENCY")
+    parser.add_argument("--premium-limit", type=int, default=3, help="PREMIUM_DOWNLOAD_CONCURRENCY")
+    parser.add_argument("--premium-weight", type=float, default=3.0, help="PREMIUM_WEIGHT")
+    parser.add_argument("--horizon", type=float, default=30.0, help="فترة وصول الطلبات الخفيفة (وحدات)")
+    parser.add_argument("--scale", type=float, default=0.005, help="ثوانٍ حقيقية لكل وحدة محاكاة")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    requests = build_workload(args)
+    for policy in ('fifo', 'fair'):
+        report(policy, asyncio.run(simulate(policy, requests, args)))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
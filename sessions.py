@@ -0,0 +1,89 @@
+"""
+تخزين حالات المحادثة وجلسات المستخدمين (ذاكرة محدودة أو Redis)
+"""
+import json
+import time
+from functools import partial
+from typing import Any, Dict, Optional
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from cache import TTLCache
+from config import config
+import logging
+
+try:
+    from aiogram.fsm.storage.redis import DefaultKeyBuilder, RedisStorage
+except ImportError:  # Redis اختياري
+    RedisStorage = None
+
+logger = logging.getLogger(__name__)
+
+# تسلسل مضغوط لبيانات الجلسة
+dumps = partial(json.dumps, separators=(',', ':'), ensure_ascii=False)
+
+class TTLMemoryStorage(BaseStorage):
+    """تخزين FSM داخل العملية بحجم أقصى وانتهاء صلاحية
+
+    كل مفتاح يُحفظ كسلسلة JSON واحدة (الحالة والبيانات)، ويُخرج الأقدم استخداماً
+    عند امتلاء الذاكرة، وتُحذف الجلسات المنتهية دورياً.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, purge_interval: float = 60.0):
+        self.records = TTLCache(maxsize, ttl)
+        self.purge_interval = purge_interval
+        self._next_purge = time.monotonic() + purge_interval
+
+    def _load(self, key: StorageKey) -> Dict[str, Any]:
+        raw = self.records.get(key)
+        return json.loads(raw) if raw else {}
+
+    def _save(self, key: StorageKey, record: Dict[str, Any]):
+        if record.get('s') is None and not record.get('d'):
+            self.records.pop(key)
+        else:
+            self.records.set(key, dumps(record))
+
+        if time.monotonic() >= self._next_purge:
+            self._next_purge = time.monotonic() + self.purge_interval
+            purged = self.records.purge_expired()
+            if purged:
+                logger.debug(f"Purged {purged} expired sessions")
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = self._load(key)
+        record['s'] = state.state if isinstance(state, State) else state
+        self._save(key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return self._load(key).get('s')
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = self._load(key)
+        record['d'] = data
+        self._save(key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return self._load(key).get('d') or {}
+
+    async def close(self) -> None:
+        pass
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+def create_fsm_storage(backend: Optional[str] = None) -> BaseStorage:
+    """إنشاء تخزين الجلسات حسب الإعدادات (memory أو redis)"""
+    backend = (backend or config.SESSION_BACKEND).lower()
+
+    if backend == 'redis':
+        if RedisStorage is None or not config.REDIS_URL:
+            raise ValueError("Redis session storage requires REDIS_URL and the redis package")
+        return RedisStorage.from_url(
+            config.REDIS_URL,
+            key_builder=DefaultKeyBuilder(prefix="session"),
+            state_ttl=config.SESSION_TTL,
+            data_ttl=config.SESSION_TTL,
+            json_dumps=dumps
+        )
+
+    return TTLMemoryStorage(config.SESSION_CACHE_SIZE, config.SESSION_TTL)
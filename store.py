@@ -0,0 +1,111 @@
+"""
+المخزن المشترك للملفات المنزلة (مفهرس بمعرف الفيديو والصيغة)
+"""
+import os
+import re
+import shutil
+import uuid
+from pathlib import Path
+from typing import Dict, IO, List, Optional
+from config import config
+import logging
+
+try:
+    import fcntl
+except ImportError:  # غير متاح على Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# امتدادات الملفات غير المكتملة التي يتركها yt-dlp
+PARTIAL_SUFFIXES = ('.part', '.ytdl')
+
+def subtitle_key(language: str, subtitle_format: str) -> str:
+    """مفتاح صيغة ملف الترجمة في المخزن"""
+    return f"sub-{language}.{subtitle_format}"
+
+class ContentStore:
+    """مخزن ملفات مشترك بين جميع المستخدمين
+
+    كل ملف يُحفظ مرة واحدة في المسار <root>/<video_id>/<format>/ ويُعاد استخدامه
+    للطلبات اللاحقة بدلاً من تنزيله لكل مستخدم.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.staging_root = root / ".staging"
+        self._locks: Dict[Path, IO] = {}
+
+    def _safe(self, value: str) -> str:
+        return re.sub(r'[^A-Za-z0-9_.-]', '_', value)
+
+    def key_dir(self, video_id: str, fmt: str) -> Path:
+        return self.root / self._safe(video_id) / self._safe(fmt)
+
+    def list_files(self, directory: Path) -> List[Path]:
+        """الملفات المكتملة في المجلد (بدون الملفات الجزئية)"""
+        if not directory.is_dir():
+            return []
+        return sorted(
+            path for path in directory.iterdir()
+            if path.is_file() and path.suffix not in PARTIAL_SUFFIXES and not path.name.startswith('.')
+        )
+
+    def lookup(self, video_id: str, fmt: str) -> Optional[Path]:
+        """البحث عن ملف مخزن مسبقاً"""
+        files = self.list_files(self.key_dir(video_id, fmt))
+        return files[0] if files else None
+
+    def staging_dir(self, video_id: str, fmt: str) -> Path:
+        """المجلد المؤقت للتنزيل قبل نقله إلى المخزن
+
+        المجلد ثابت لكل مفتاح حتى يستأنف yt-dlp ملفاته الجزئية بعد إعادة التشغيل،
+        وإذا كانت عملية أخرى تستخدمه نعود إلى مجلد فريد.
+        """
+        directory = self.staging_root / f"{self._safe(video_id)}-{self._safe(fmt)}"
+        directory.mkdir(parents=True, exist_ok=True)
+
+        if not self._lock(directory):
+            directory = self.staging_root / uuid.uuid4().hex
+            directory.mkdir(parents=True, exist_ok=True)
+        return directory
+
+    def _lock(self, directory: Path) -> bool:
+        if fcntl is None:
+            return True
+
+        handle = open(directory / ".lock", "w")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+
+        self._locks[directory] = handle
+        return True
+
+    def release(self, directory: Path):
+        """تحرير المجلد المؤقت مع الإبقاء على ملفاته الجزئية"""
+        handle = self._locks.pop(directory, None)
+        if handle:
+            handle.close()
+
+    def is_resumable(self, path: Path) -> bool:
+        """ملف جزئي في مجلد مؤقت يمكن استئنافه"""
+        return path.suffix in PARTIAL_SUFFIXES and self.staging_root in path.parents
+
+    def commit(self, video_id: str, fmt: str, file_path: Path) -> Path:
+        """نقل الملف المكتمل من المجلد المؤقت إلى موقعه في المخزن"""
+        target_dir = self.key_dir(video_id, fmt)
+        target_dir.mkdir(parents=True, exist_ok=True)
+
+        target = target_dir / file_path.name
+        os.replace(file_path, target)
+        return target
+
+    def discard(self, directory: Path):
+        self.release(directory)
+        shutil.rmtree(directory, ignore_errors=True)
+
+# مثيل عام من المخزن
+content_store = ContentStore(config.STORE_PATH)
@@ -0,0 +1,34 @@
+"""
+الاتصال بـ Bot API (الخادم العام أو خادم telegram-bot-api ذاتي الاستضافة)
+"""
+from pathlib import Path
+from typing import Optional, Union
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
+from aiogram.types import FSInputFile, InputFile
+from config import config
+
+def is_local_server() -> bool:
+    """خادم محلي يقرأ الملفات من نظام الملفات مباشرة"""
+    return bool(config.TELEGRAM_API_URL) and config.TELEGRAM_API_LOCAL
+
+def create_bot() -> Bot:
+    """إنشاء Bot موجه إلى TELEGRAM_API_URL (مشترك بين البوت والعمال المستقلين)"""
+    if config.TELEGRAM_API_URL:
+        api = TelegramAPIServer.from_base(config.TELEGRAM_API_URL, is_local=config.TELEGRAM_API_LOCAL)
+    else:
+        api = PRODUCTION
+
+    session = AiohttpSession(api=api, timeout=config.TELEGRAM_API_TIMEOUT)
+    return Bot(token=config.BOT_TOKEN, session=session)
+
+def input_file(path: Union[str, Path], filename: Optional[str] = None) -> Union[InputFile, str]:
+    """الملف المرسل: مساره المطلق مع الخادم المحلي، وإلا يُرفع محتواه عبر HTTP
+
+    في الوضع المحلي يقرأ الخادم الملف بنفسه، فلا يمر محتواه عبر عملية البوت.
+    يجب أن يرى الخادم الملف بالمسار نفسه (مجلد DOWNLOAD_PATH مشترك).
+    """
+    if is_local_server():
+        return Path(path).resolve().as_uri()
+    return FSInputFile(path, filename=filename)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+أداة محلية لإرسال تحديثات تليجرام مصطنعة إلى خادم الـ webhook
+
+مثال: python webhook_harness.py --url http://localhost:8080 --count 200 --concurrency 20
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+import aiohttp
+
+def make_update(update_id: int, user_id: int, text: str) -> Dict:
+    """تحديث رسالة نصية من مستخدم وهمي في محادثة خاصة"""
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private', 'first_name': 'Harness'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Harness', 'language_code': 'ar'},
+            'text': text
+        }
+    }
+
+async def check(session: aiohttp.ClientSession, url: str) -> str:
+    try:
+        async with session.get(url) as response:
+            return f"{response.status} {await response.text()}"
+    except aiohttp.ClientError as e:
+        return f"error: {e}"
+
+async def run(args) -> int:
+    endpoint = f"{args.url.rstrip('/')}{args.path}"
+    headers = {'X-Telegram-Bot-Api-Secret-Token': args.secret} if args.secret else {}
+    semaphore = asyncio.Semaphore(args.concurrency)
+    statuses: Counter = Counter()
+    latencies: List[float] = []
+
+    async with aiohttp.ClientSession() as session:
+        print(f"healthz: {await check(session, args.url.rstrip('/') + '/healthz')}")
+        print(f"readyz:  {await check(session, args.url.rstrip('/') + '/readyz')}")
+
+        async def post(index: int):
+            update = make_update(args.start_id + index, args.user_id + index % args.users, args.text)
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    async with session.post(endpoint, json=update, headers=headers) as response:
+                        await response.read()
+                        statuses[response.status] += 1
+                except aiohttp.ClientError as e:
+                    statuses[type(e).__name__] += 1
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(post(i) for i in range(args.count)))
+        elapsed = time.perf_counter() - started
+
+    print(f"sent {args.count} updates in {elapsed:.2f}s ({args.count / elapsed:.1f}/s)")
+    print(f"statuses: {dict(statuses)}")
+    if latencies:
+        latencies.sort()
+        p95 = latencies[int(len(latencies) * 0.95) - 1] if len(latencies) >= 20 else latencies[-1]
+        print(f"latency ms: median {statistics.median(latencies):.1f}, p95 {p95:.1f}, max {latencies[-1]:.1f}")
+
+    return 0 if set(statuses) == {200} else 1
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Post synthetic updates to the webhook server")
+    parser.add_argument("--url", default="http://localhost:8080", help="عنوان الخادم")
+    parser.add_argument("--path", default="/webhook", help="مسار الـ webhook")
+    parser.add_argument("--secret", default=None, help="قيمة WEBHOOK_SECRET")
+    parser.add_argument("--count", type=int, default=100, help="عدد التحديثات")
+    parser.add_argument("--concurrency", type=int, default=10, help="طلبات متزامنة")
+    parser.add_argument("--users", type=int, default=10, help="عدد المستخدمين الوهميين")
+    parser.add_argument("--user-id", type=int, default=900000000, help="معرف أول مستخدم وهمي")
+    parser.add_argument("--start-id", type=int, default=1, help="أول update_id")
+    parser.add_argument("--text", default="/help", help="نص الرسالة")
+    return asyncio.run(run(parser.parse_args(argv)))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+عامل تنزيل مستقل يستهلك المهام من الطابور المشترك (database أو redis)
+
+مثال: python worker.py --processes 4 --concurrency 2
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import sys
+from pathlib import Path
+
+# إعداد المسار لاستيراد الوحدات
+sys.path.append(str(Path(__file__).parent))
+
+from config import config
+from database import db
+from downloader import downloader
+from jobs import JobWorker, create_job_queue
+from telegram_api import create_bot
+
+logger = logging.getLogger(__name__)
+
+def setup_logging():
+    """إعداد السجلات لعملية العامل"""
+    logging.basicConfig(
+        level=getattr(logging, config.LOG_LEVEL.upper()),
+        format="%(asctime)s - %(processName)s - %(name)s - %(levelname)s - %(message)s",
+        handlers=[logging.StreamHandler(sys.stdout)],
+        force=True
+    )
+    logging.getLogger("aiogram").setLevel(logging.WARNING)
+    logging.getLogger("yt_dlp").setLevel(logging.WARNING)
+
+async def run_worker(concurrency: int):
+    """تشغيل عامل واحد حتى الإيقاف"""
+    await db.init_db()
+
+    bot = create_bot()
+    queue = create_job_queue()
+    worker = JobWorker(queue, bot, concurrency=concurrency)
+
+    try:
+        await worker.run()
+    finally:
+        await worker.stop()
+        await queue.close()
+        await bot.session.close()
+        await db.close()
+        downloader.shutdown()
+
+def worker_process(concurrency: int):
+    setup_logging()
+    try:
+        asyncio.run(run_worker(concurrency))
+    except KeyboardInterrupt:
+        pass
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Download worker")
+    parser.add_argument("--processes", type=int, default=1, help="عدد عمليات العمال")
+    parser.add_argument("--concurrency", type=int, default=config.WORKER_CONCURRENCY, help="مهام متزامنة لكل عملية")
+    args = parser.parse_args()
+
+    setup_logging()
+
+    if config.JOB_QUEUE_BACKEND not in ('database', 'redis'):
+        logger.error("Standalone workers need JOB_QUEUE_BACKEND=database or redis")
+        return 1
+
+    if args.processes <= 1:
+        worker_process(args.concurrency)
+        return 0
+
+    processes = [
+        multiprocessing.Process(target=worker_process, args=(args.concurrency,), name=f"worker-{i + 1}")
+        for i in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.join()
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())